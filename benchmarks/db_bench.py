@@ -0,0 +1,49 @@
+# Compares how many repo style queries per second we get from the pooled connection against the old
+# connect-per-call approach. Run from the repo root: python -m benchmarks.db_bench
+
+import os
+import sqlite3
+import tempfile
+import time
+import src.database.imgdatabase as imgdatabase
+
+ROWS = 2000
+ROUNDS = 5000
+
+
+def per_call_connect(db_path:str, query:str, params):
+    """What every execute_* call used to do."""
+    with sqlite3.connect(db_path) as conn:
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON;")
+        cursor.execute(query, params)
+        return cursor.fetchall()
+
+
+def run(label:str, fn) -> float:
+    start = time.perf_counter()
+    for i in range(ROUNDS):
+        fn("SELECT * FROM Images WHERE 1=1 AND full_path = ?", [f"/bench/{i % ROWS}.png"])
+    qps = ROUNDS / (time.perf_counter() - start)
+    print(f"{label:<20}{qps:>12,.0f} queries/sec")
+    return qps
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        handler = getattr(imgdatabase, "__database")(db_path)
+        handler.execute_mass_transaction([
+            f"INSERT INTO Images (full_path, file_name, ext, md5) VALUES ('/bench/{i}.png', '{i}', '.png', '{i:032x}')"
+            for i in range(ROWS)
+        ])
+
+        old = run("connect per call", lambda q, p: per_call_connect(db_path, q, p))
+        new = run("pooled connection", handler.execute_query)
+        print(f"{'speedup':<20}{new / old:>12.1f}x")
+        handler.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,346 @@
+# End to end throughput of the scan commands, offline. Builds a synthetic image library (see synthetic_tree.py), starts
+# local stand-ins for SauceNAO and Danbooru (see fake_services.py), then runs each command against them the same way main.py
+# would, every one in its own process so peak memory is its own. Reports files/sec, DB statements, commits and HTTP calls per
+# file, and peak RSS, and saves it all as JSON named after the commit so runs can be compared.
+#
+#   full_scan       fresh library, fresh DB
+#   rescan          full_scan again on what's left, after some of the files were renamed/moved
+#   check_results   reviews everything the scans left, answering the prompts from a script instead of the keyboard
+#   md5_scan        fresh library, fresh DB
+#   skip_scan       fresh library, fresh DB
+#
+# Run from the repo root: python -m benchmarks.e2e_bench [--files 500 --saucenao-latency 0.2 ...] [--compare old.json]
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import webbrowser
+import benchmarks.synthetic_tree as synthetic_tree
+from benchmarks.synthetic_tree import TreeSpec
+from benchmarks.fake_services import FakeSaucenao, FakeDanbooru
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ["full_scan", "rescan", "check_results", "md5_scan", "skip_scan"]
+# What the stand-in's similarities are set either side of.
+HIGH_THRESHOLD = 92
+LOW_THRESHOLD = 65
+# check-results answers, in turn: none match, the first one does, all of them do.
+ANSWERS = ["n", "0", "a"]
+
+
+# Everything from here to the parent side runs in the scenario's own process, with the working directory set to where its
+# config.json and DB live. The app is only imported in there.
+
+class StatementCounter:
+    """SQLite trace callback. Counts every statement the app's DB runs, each row of an executemany included, and every commit
+    (autocommit writes outside of BEGIN/COMMIT are one each)."""
+    def __init__(self):
+        self.statements = 0
+        self.commits = 0
+        self.__in_transaction:set[int] = set()
+
+
+    def attach(self, handler):
+        """Traces every connection the handler opens from here on, on any thread."""
+        get_connection = handler.get_connection
+        traced = set()
+        def get_traced_connection():
+            conn = get_connection()
+            if not id(conn) in traced:
+                traced.add(id(conn))
+                conn.set_trace_callback(lambda statement: self.__count(id(conn), statement))
+            return conn
+        handler.get_connection = get_traced_connection
+
+
+    def __count(self, conn:int, statement:str):
+        keyword = statement.lstrip()[:8].upper()
+        if keyword.startswith("BEGIN"):
+            self.__in_transaction.add(conn)
+        # Savepoints (nested transaction() blocks) are left out, only the outermost COMMIT reaches the disk.
+        elif keyword.startswith("COMMIT"):
+            self.__in_transaction.discard(conn)
+            self.commits += 1
+        elif keyword.startswith("ROLLBACK") and not " TO " in statement.upper():
+            self.__in_transaction.discard(conn)
+        elif keyword.startswith(("SELECT", "INSERT", "UPDATE", "DELETE", "REPLACE", "WITH")):
+            self.statements += 1
+            if not conn in self.__in_transaction and not keyword.startswith(("SELECT", "WITH")):
+                self.commits += 1
+
+
+class DanbooruClient:
+    """The part of danbooru.API the app uses, sent to the stand-in through the app's shared transport like the real one is."""
+    def __init__(self, hostname:str):
+        import src.transport as transport
+        self.hostname = hostname
+        self.http = transport.shared()
+
+
+    def get_posts(self, params:dict) -> list[dict]:
+        return self.http.get(f"{self.hostname}/posts.json", params=params).json()
+
+
+    def get_post(self, post_id:int) -> dict:
+        return self.http.get(f"{self.hostname}/posts/{post_id}.json").json()
+
+
+    def add_favorite(self, post_id:int):
+        self.http.post(f"{self.hostname}/favorites.json", params={"post_id": post_id})
+
+
+class NullBrowser(webbrowser.BaseBrowser):
+    """check-results opens every image and post in the browser, this one doesn't."""
+    def open(self, url:str, new:int = 0, autoraise:bool = True) -> bool:
+        return True
+
+
+class ScriptedInput:
+    """Stands in for input(), giving the same answers in turn to every prompt."""
+    def __init__(self, answers:list[str]):
+        self.answers = answers
+        self.prompts = 0
+
+
+    def __call__(self, prompt:str = "") -> str:
+        answer = self.answers[self.prompts % len(self.answers)]
+        self.prompts += 1
+        return answer
+
+
+def peak_rss_mb(children:bool = False) -> float | None:
+    """Peak RSS of this process, or of the largest process it's waited on."""
+    try:
+        import resource
+    except ImportError:
+        # Not on Windows.
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS.
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def count_files(directory:str) -> int:
+    return sum(len(names) for _, _, names in os.walk(directory))
+
+
+def run_scenario(scenario:str, directory:str, danbooru_url:str, profile:bool = False) -> dict:
+    import builtins
+    import src.metrics as metrics
+    import src.saucenaoconfig as saucenaoconfig
+    import src.database.imgdatabase as imgdatabase
+    import src.saucenaoscan as saucenaoscan
+    import src.checkresults as checkresults
+    from src.ratelimit import TokenBucket, ThrottledClient
+    from src.postcache import PostCache
+
+    client = DanbooruClient(danbooru_url)
+    saucenaoscan.danAPI = ThrottledClient(client, TokenBucket(saucenaoconfig.config.settings["DANBOORU_REQUESTS_PER_SECOND"], 1), "danbooru")
+    saucenaoscan.post_cache = PostCache(saucenaoscan.danAPI)
+    checkresults.danAPI = client
+    checkresults.post_cache = PostCache(client)
+    webbrowser.register("benchmark", None, NullBrowser("benchmark"))
+    answers = ScriptedInput(ANSWERS)
+    builtins.input = answers
+
+    counter = StatementCounter()
+    counter.attach(imgdatabase.db_handler)
+    items = count_files(directory)
+    if profile:
+        metrics.enable(scenario)
+    start = time.perf_counter()
+    match scenario:
+        case "full_scan" | "rescan":
+            saucenaoscan.full_scan(directory, True, HIGH_THRESHOLD, LOW_THRESHOLD, False)
+        case "md5_scan":
+            saucenaoscan.md5_scan(directory, True, saucenaoconfig.config.settings["HASH_WORKERS"])
+        case "skip_scan":
+            saucenaoscan.skip_scan(directory, True)
+        case "check_results":
+            checkresults.check_low_threshold_results(LOW_THRESHOLD)
+            items = answers.prompts
+    elapsed = time.perf_counter() - start
+    imgdatabase.db_handler.close()
+    profiled = metrics.finish()
+
+    return {
+        "items": items,
+        "seconds": elapsed,
+        "db_statements": counter.statements,
+        "db_commits": counter.commits,
+        "peak_rss_mb": peak_rss_mb(),
+        # The thumbnail process pool, reported apart since it's separate processes.
+        "peak_rss_workers_mb": peak_rss_mb(children=True),
+        "profile": profiled.summary() if profiled is not None else None,
+    }
+
+
+def child(args):
+    result = run_scenario(args.scenario, args.directory, args.danbooru_url, args.profile)
+    with open(args.result, "w") as f:
+        json.dump(result, f)
+
+
+# Parent side.
+
+def git_revision() -> str:
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+        return f"{revision}-dirty" if dirty else revision
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def write_config(workdir:str, saucenao:FakeSaucenao, danbooru_rps:float):
+    """Only what differs from the defaults, the app fills in the rest."""
+    os.makedirs(workdir, exist_ok=True)
+    with open(os.path.join(workdir, "config.json"), "w") as f:
+        json.dump({"SAUCENAO_URL": saucenao.search_url, "DEFAULT_BROWSER": "benchmark", "DANBOORU_REQUESTS_PER_SECOND": danbooru_rps,
+                   "LOG_DIR": os.path.join(workdir, "logs")}, f, indent=4)
+
+
+def launch(scenario:str, workdir:str, directory:str, saucenao:FakeSaucenao, danbooru:FakeDanbooru, profile:bool = False) -> dict:
+    saucenao.reset()
+    danbooru.reset()
+    result_path = os.path.join(workdir, f"{scenario}.json")
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")]))}
+    with open(os.path.join(workdir, f"{scenario}.log"), "w") as log:
+        proc = subprocess.run([sys.executable, "-m", "benchmarks.e2e_bench", "--child", scenario, "--directory", directory,
+                               "--danbooru-url", danbooru.url, "--result", result_path, *(["--profile"] if profile else [])],
+                              cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    if proc.returncode != 0:
+        raise RuntimeError(f"{scenario} exited with {proc.returncode}, see {log.name}")
+    with open(result_path) as f:
+        result = json.load(f)
+
+    items = max(result["items"], 1)
+    result["items_per_sec"] = result["items"] / result["seconds"] if result["seconds"] > 0 else 0
+    result["db_statements_per_item"] = result["db_statements"] / items
+    result["db_commits_per_item"] = result["db_commits"] / items
+    result["http_calls"] = {"saucenao": dict(saucenao.calls), "danbooru": dict(danbooru.calls)}
+    result["http_calls_per_item"] = (saucenao.total_calls + danbooru.total_calls) / items
+    return result
+
+
+def summary_line(name:str, result:dict) -> str:
+    rss = f"{result['peak_rss_mb']:>7.1f} MB" if result["peak_rss_mb"] is not None else f"{'-':>10}"
+    return (f"{name:<15}{result['items']:>6} items {result['items_per_sec']:>9.1f}/s {result['db_statements_per_item']:>7.1f} stmts "
+            f"{result['db_commits_per_item']:>6.2f} commits {result['http_calls_per_item']:>6.2f} http /item {rss}")
+
+
+def compare(current:dict, previous:dict):
+    print(f"\nvs {previous['revision']} ({previous['created']})")
+    for key in ["tree", "services"]:
+        if current[key] != previous.get(key):
+            print(f"NOTE: ran with a different {key}, not like for like")
+    for name, result in current["scenarios"].items():
+        before = previous["scenarios"].get(name)
+        if before is None:
+            continue
+        changes = []
+        for key, label in [("items_per_sec", "items/s"), ("db_statements_per_item", "stmts/item"), ("db_commits_per_item", "commits/item"),
+                           ("http_calls_per_item", "http/item"), ("peak_rss_mb", "peak MB")]:
+            if before.get(key) and result.get(key) is not None:
+                changes.append(f"{label} {(result[key] - before[key]) / before[key]:+.0%}")
+        print(f"{name:<15}{', '.join(changes)}")
+
+
+def main(args) -> int:
+    spec = TreeSpec(args.files, formats=args.formats, duplicate_ratio=args.duplicate_ratio, rename_ratio=args.rename_ratio,
+                    pixiv_ratio=args.pixiv_ratio, subdirs=args.subdirs, seed=args.seed)
+    if args.sizes:
+        spec.sizes = [tuple(int(v) for v in size.split("x")) for size in args.sizes]
+    scenarios = args.scenarios or SCENARIOS
+    report = {
+        "revision": git_revision(),
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "profile": args.profile,
+        "tree": spec.to_dict(),
+        "services": {"saucenao_latency": args.saucenao_latency, "danbooru_latency": args.danbooru_latency,
+                     "short_limit": args.short_limit, "long_limit": args.long_limit, "danbooru_rps": args.danbooru_rps},
+        "scenarios": {},
+    }
+
+    with tempfile.TemporaryDirectory(prefix="saucenao_bench_") as tmp, \
+         FakeSaucenao(args.saucenao_latency, args.short_limit, args.long_limit) as saucenao, \
+         FakeDanbooru(args.danbooru_latency) as danbooru:
+        tmp = args.workdir or tmp
+        start = time.perf_counter()
+        source = os.path.join(tmp, "source")
+        made = synthetic_tree.generate(source, spec)
+        print(f"Generated {made['images']} images and {made['duplicates']} copies ({made['bytes'] / 1024**2:.1f} MB) in {time.perf_counter() - start:.1f}s")
+
+        for scenario in scenarios:
+            # The rescan and check-results carry on from the full scan's library and DB, the rest get their own.
+            workdir = os.path.join(tmp, "full_scan" if scenario in ["full_scan", "rescan", "check_results"] else scenario)
+            directory = os.path.join(workdir, "library")
+            if not os.path.exists(directory):
+                write_config(workdir, saucenao, args.danbooru_rps)
+                shutil.copytree(source, directory)
+            if scenario == "rescan":
+                synthetic_tree.rename(directory, spec)
+
+            try:
+                result = launch(scenario, workdir, directory, saucenao, danbooru, args.profile)
+            except RuntimeError as e:
+                print(f"{e}{'' if args.workdir else ', run with --workdir to keep it'}")
+                return 1
+            report["scenarios"][scenario] = result
+            print(summary_line(scenario, result))
+
+    output = args.output or os.path.join(ROOT, "benchmarks", "results", f"{datetime.date.today()}_{report['revision']}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=4)
+    print(f"Saved to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+    return 0
+
+
+def parse_args(argv:list[str] = None):
+    parser = argparse.ArgumentParser(description="Offline end to end benchmark of the scan commands.")
+    parser.add_argument("--files", type=int, default=200, help="Files in the synthetic library.")
+    parser.add_argument("--sizes", nargs="+", metavar="WxH", help="Image sizes to pick from, e.g. 800x600 1920x1080.")
+    parser.add_argument("--formats", nargs="+", choices=list(synthetic_tree.FORMATS), default=[".png", ".jpg"])
+    parser.add_argument("--duplicate-ratio", type=float, default=0.1, help="Share of files that are copies of another.")
+    parser.add_argument("--rename-ratio", type=float, default=0.2, help="Share of files moved before the rescan.")
+    parser.add_argument("--pixiv-ratio", type=float, default=0.1, help="Share of files named by Pixiv ID.")
+    parser.add_argument("--subdirs", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--saucenao-latency", type=float, default=0.0, help="Seconds the SauceNAO stand-in holds each response.")
+    parser.add_argument("--danbooru-latency", type=float, default=0.0, help="Seconds the Danbooru stand-in holds each response.")
+    parser.add_argument("--short-limit", type=int, default=100_000, help="SauceNAO searches per 30 seconds.")
+    parser.add_argument("--long-limit", type=int, default=1_000_000, help="SauceNAO searches per 24 hours.")
+    parser.add_argument("--danbooru-rps", type=float, default=10, help="DANBOORU_REQUESTS_PER_SECOND for the app.")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, help="Scenarios to run, defaults to all of them.")
+    parser.add_argument("--output", help="Where to save the results. Defaults to benchmarks/results/<date>_<commit>.json.")
+    parser.add_argument("--profile", action="store_true", help="Run the scenarios with --profile's stage timers on, saved with the results.")
+    parser.add_argument("--workdir", help="Build the libraries and DBs here and leave them, along with each scenario's output, to look at after.")
+    parser.add_argument("--compare", metavar="JSON", help="Earlier results to compare against.")
+    # Used by the parent to run a scenario in its own process.
+    parser.add_argument("--child", choices=SCENARIOS, dest="scenario", help=argparse.SUPPRESS)
+    parser.add_argument("--directory", help=argparse.SUPPRESS)
+    parser.add_argument("--danbooru-url", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.scenario is not None:
+        child(args)
+    else:
+        sys.exit(main(args))
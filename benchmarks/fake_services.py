@@ -0,0 +1,261 @@
+# Local stand-ins for SauceNAO and Danbooru, for the end to end benchmark (see e2e_bench.py). Each one is a small HTTP
+# server on localhost answering the handful of endpoints the app calls, with a configurable delay on every response and,
+# for SauceNAO, the 30 second/24 hour search limits. Every request is counted so a run can report HTTP calls per file.
+#
+# Answers are worked out from a hash of what was asked about rather than stored, so the same image always gets the same
+# results and nothing has to be set up ahead of time:
+#   SauceNAO    hash of the uploaded thumbnail, decides between a high match, low match or no match
+#   Danbooru    hash of the md5/Pixiv ID/post id, decides whether a post exists and whether its artist is banned
+
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+SHORT_WINDOW = 30
+LONG_WINDOW = 24 * 60 * 60
+ID_IN_PATH = re.compile(r"/\d+")
+
+
+def bucket(value:str | bytes) -> float:
+    """Spreads anything evenly over [0, 1), the same way every time."""
+    if isinstance(value, str):
+        value = value.encode()
+    return int.from_bytes(hashlib.sha1(value).digest()[:4], "big") / 2**32
+
+
+def post_id(value:str | bytes) -> int:
+    if isinstance(value, str):
+        value = value.encode()
+    return int.from_bytes(hashlib.sha1(b"post" + value).digest()[:4], "big") % 9_000_000 + 1_000_000
+
+
+class FakeService:
+    """Runs a handler on its own thread until close(), counting requests by endpoint."""
+    def __init__(self, latency:float = 0):
+        self.latency = latency
+        self.calls:dict[str, int] = {}
+        self.__lock = threading.Lock()
+        self.__server = ThreadingHTTPServer(("127.0.0.1", 0), self.__handler())
+        self.__server.daemon_threads = True
+        self.__thread = threading.Thread(target=self.__server.serve_forever, name=type(self).__name__, daemon=True)
+        self.__thread.start()
+
+
+    @property
+    def url(self) -> str:
+        host, port = self.__server.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+    @property
+    def total_calls(self) -> int:
+        with self.__lock:
+            return sum(self.calls.values())
+
+
+    def count(self, endpoint:str):
+        with self.__lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+
+
+    def reset(self):
+        with self.__lock:
+            self.calls.clear()
+
+
+    def close(self):
+        self.__server.shutdown()
+        self.__server.server_close()
+        self.__thread.join()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def handle(self, method:str, path:str, query:dict[str, list[str]], body:bytes, headers) -> tuple[int, object]:
+        """Returns the status code and whatever should be sent back as JSON."""
+        raise NotImplementedError
+
+
+    def __handler(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, so connection pooling on the app's side is measured the same as it would be against the real thing.
+            protocol_version = "HTTP/1.1"
+
+            def __respond(self, method:str):
+                url = urlparse(self.path)
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                # Counted by endpoint, i.e. every post lookup together as /posts/{id}.json.
+                service.count(f"{method} {ID_IN_PATH.sub('/{id}', url.path)}")
+                if service.latency > 0:
+                    time.sleep(service.latency)
+
+                status, data = service.handle(method, url.path, parse_qs(url.query), body, self.headers)
+                content = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def do_GET(self):
+                self.__respond("GET")
+
+            def do_POST(self):
+                self.__respond("POST")
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def multipart_file(body:bytes, content_type:str) -> bytes:
+    """Pulls the uploaded file out of a multipart/form-data body."""
+    boundary = content_type.split("boundary=")[-1].strip('"').encode()
+    for part in body.split(b"--" + boundary):
+        head, _, content = part.partition(b"\r\n\r\n")
+        if b"filename=" in head:
+            return content.removesuffix(b"\r\n")
+    return b""
+
+
+class FakeSaucenao(FakeService):
+    """POST /search.php, answering like index_danbooru would with output_type=2."""
+    def __init__(self, latency:float = 0, short_limit:int = 100_000, long_limit:int = 1_000_000, high_ratio:float = 0.2,
+                 low_ratio:float = 0.3, high_similarity:float = 95.0, low_similarity:float = 75.0, clock = time.monotonic):
+        """
+        Args:
+            latency (float, optional): Seconds to hold every response.
+            short_limit (int, optional): Searches allowed per 30 seconds, any more get a 429.
+            long_limit (int, optional): Searches allowed per 24 hours, any more get a 429.
+            high_ratio (float, optional): Share of images with a result above high_similarity, favorited by a scan.
+            low_ratio (float, optional): Share of images with a result at low_similarity, left for check-results.
+            high_similarity, low_similarity (float, optional): Similarity given to those results. Set these to either side
+                of the thresholds the scan runs with. Everything else gets a result well under both.
+        """
+        self.short_limit = short_limit
+        self.long_limit = long_limit
+        self.high_ratio = high_ratio
+        self.low_ratio = low_ratio
+        self.high_similarity = high_similarity
+        self.low_similarity = low_similarity
+        self.clock = clock
+        self.__sent:deque[float] = deque()
+        self.__lock = threading.Lock()
+        super().__init__(latency)
+
+
+    @property
+    def search_url(self) -> str:
+        return f"{self.url}/search.php"
+
+
+    def __spend(self) -> tuple[int, int] | None:
+        """Counts a search against both limits, returning what's left of each, or None if either is used up."""
+        with self.__lock:
+            now = self.clock()
+            while any(self.__sent) and self.__sent[0] <= now - LONG_WINDOW:
+                self.__sent.popleft()
+            short_used = sum(1 for t in self.__sent if t > now - SHORT_WINDOW)
+            if short_used >= self.short_limit or len(self.__sent) >= self.long_limit:
+                return None
+            self.__sent.append(now)
+            return self.short_limit - short_used - 1, self.long_limit - len(self.__sent)
+
+
+    def result(self, thumbnail:bytes, similarity:float) -> dict:
+        dan_id = post_id(thumbnail + str(similarity).encode())
+        return {
+            "header": {"similarity": f"{similarity:.2f}", "thumbnail": "", "index_id": 9, "index_name": f"Index #9: Danbooru - {dan_id}.jpg", "dupes": 0, "hidden": 0},
+            "data": {"ext_urls": [f"https://danbooru.donmai.us/post/show/{dan_id}"], "danbooru_id": dan_id, "creator": "", "material": "", "characters": "", "source": ""},
+        }
+
+
+    def handle(self, method, path, query, body, headers):
+        if method != "POST" or path != "/search.php":
+            return 404, {}
+        remaining = self.__spend()
+        if remaining is None:
+            return 429, {"header": {"status": -2, "message": "Search Rate Too High."}}
+
+        thumbnail = multipart_file(body, headers.get("Content-Type", ""))
+        roll = bucket(thumbnail)
+        similarities = [30.0]
+        if roll < self.high_ratio:
+            similarities = [self.high_similarity, self.low_similarity - 10]
+        elif roll < self.high_ratio + self.low_ratio:
+            similarities = [self.low_similarity, self.low_similarity - 2, 30.0]
+        results = [self.result(thumbnail, s) for s in similarities]
+
+        short_remaining, long_remaining = remaining
+        header = {
+            "user_id": "0", "account_type": "1", "short_limit": str(self.short_limit), "long_limit": str(self.long_limit),
+            "long_remaining": long_remaining, "short_remaining": short_remaining, "status": 0, "results_requested": "8",
+            "index": {"9": {"status": 0, "parent_id": 9, "id": 9, "results": len(results)}}, "search_depth": "128",
+            "minimum_similarity": 0, "query_image_display": "", "query_image": "image.png", "results_returned": len(results),
+        }
+        return 200, {"header": header, "results": results}
+
+
+class FakeDanbooru(FakeService):
+    """GET /posts.json (md5:, id: and pixiv: searches), GET /posts/<id>.json and POST /favorites.json."""
+    def __init__(self, latency:float = 0, md5_ratio:float = 0.1, pixiv_ratio:float = 0.5, banned_ratio:float = 0.05,
+                 image_size:tuple[int, int] = (4000, 4000)):
+        """
+        Args:
+            latency (float, optional): Seconds to hold every response.
+            md5_ratio (float, optional): Share of md5s Danbooru already has a post for, favorited without a search.
+            pixiv_ratio (float, optional): Share of Pixiv IDs Danbooru has a post for, the rest are skipped by a scan.
+            banned_ratio (float, optional): Share of posts made by a banned artist.
+            image_size (tuple[int, int], optional): Size of every post. Bigger than the synthetic images so matches aren't
+                kept for being smaller.
+        """
+        self.md5_ratio = md5_ratio
+        self.pixiv_ratio = pixiv_ratio
+        self.banned_ratio = banned_ratio
+        self.image_size = image_size
+        super().__init__(latency)
+
+
+    def post(self, dan_id:int, md5:str = None) -> dict:
+        width, height = self.image_size
+        post = {"id": dan_id, "is_banned": bucket(f"banned{dan_id}") < self.banned_ratio, "image_width": width, "image_height": height}
+        if md5 is not None:
+            post["md5"] = md5
+        return post
+
+
+    def search(self, tags:str) -> list[dict]:
+        kind, _, values = tags.partition(":")
+        values = [v for v in values.split(",") if v]
+        match kind:
+            case "md5":
+                return [self.post(post_id(md5), md5) for md5 in values if bucket(md5) < self.md5_ratio]
+            case "id":
+                return [self.post(int(dan_id)) for dan_id in values]
+            case "pixiv":
+                return [self.post(post_id(pixiv_id)) for pixiv_id in values if bucket(f"pixiv{pixiv_id}") < self.pixiv_ratio]
+        return []
+
+
+    def handle(self, method, path, query, body, headers):
+        if method == "GET" and path == "/posts.json":
+            return 200, self.search(query.get("tags", [""])[0])
+        if method == "GET" and path.startswith("/posts/") and path.endswith(".json"):
+            return 200, self.post(int(path[len("/posts/"):-len(".json")]))
+        if method == "POST" and path == "/favorites.json":
+            return 200, {}
+        return 404, {}
@@ -0,0 +1,38 @@
+# Streams synthetic rows through imagerepo.bulk_insert_images and reports rows/sec along with peak Python memory, which
+# should stay flat no matter how many rows go in. Run from the repo root: python -m benchmarks.ingest_bench [rows]
+
+import os
+import sys
+import tempfile
+import tracemalloc
+import src.database.imgdatabase as imgdatabase
+import src.repos.imagerepo as imagerepo
+
+STAT = os.stat_result((0o100644, 0, 0, 1, 0, 0, 1024, 0, 0, 0))
+
+
+def rows(count:int, prefix:str):
+    for i in range(count):
+        yield f"/archive/{prefix}/it's {i}.png", f"{prefix}{i:031x}", imagerepo.image_scan_status.full_scan, STAT
+
+
+def run(label:str, count:int, prefix:str):
+    tracemalloc.start()
+    stats = imagerepo.bulk_insert_images(rows(count, prefix))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"{label:<24}{stats.rows:>10,} rows {stats.written:>10,} written {stats.rows_per_sec:>10,.0f} rows/sec   peak {peak / 1024 / 1024:>6.1f} MB")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    with tempfile.TemporaryDirectory() as tmp:
+        imgdatabase.db_handler = getattr(imgdatabase, "__database")(os.path.join(tmp, "bench.db"))
+        run("insert", count // 10, "a")
+        run("insert", count, "b")
+        run("re-import (paths known)", count // 10, "a")
+        imgdatabase.db_handler.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# Times how long the CLI takes to get going, using python -X importtime to see which modules it spent it on. Fails if
+# --help pulls in any of the heavy dependencies or creates the DB, those are only meant to load once a command runs.
+# Run from the repo root: python -m benchmarks.startup_bench
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+COMMANDS = [["--help"], ["check-results", "--help"], ["scan", "--help"], ["reprocess", "--help"]]
+# Modules that have no business being imported just to print help.
+HEAVY = ["PIL", "requests", "danbooru", "crontab", "colorama", "sqlite3", "aiohttp"]
+RUNS = 5
+MAIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+
+
+def parse_importtime(stderr:str) -> dict[str, int]:
+    """Module name to cumulative import time in microseconds, top level imports only."""
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Nested imports are indented under whatever imported them, only count the top of each tree.
+        if not name.startswith("  "):
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+def run(args:list[str], cwd:str) -> tuple[float, dict[str, int]]:
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", MAIN, *args], cwd=cwd, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f"{' '.join(args)} exited with {proc.returncode}:\n{proc.stderr}")
+    return elapsed, parse_importtime(proc.stderr)
+
+
+def main() -> int:
+    failed = 0
+    # Run somewhere empty, the app makes config.json and the DB in the working directory.
+    with tempfile.TemporaryDirectory() as tmp:
+        for args in COMMANDS:
+            timings = [run(args, tmp) for _ in range(RUNS)]
+            wall = sorted(t[0] for t in timings)[RUNS // 2]
+            imports = timings[-1][1]
+            print(f"main.py {' '.join(args):<24}{wall * 1000:>8.1f} ms wall {sum(imports.values()) / 1000:>8.1f} ms importing")
+            for name, cumulative in sorted(imports.items(), key=lambda i: i[1], reverse=True)[:5]:
+                print(f"        {cumulative / 1000:>8.1f} ms  {name}")
+
+            heavy = sorted({name.split(".")[0] for name in imports} & set(HEAVY))
+            if heavy:
+                failed += 1
+                print(f"FAIL    imported {', '.join(heavy)}")
+
+        if any(name.startswith("saucenaoDB.db") for name in os.listdir(tmp)):
+            failed += 1
+            print("FAIL    created the DB")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
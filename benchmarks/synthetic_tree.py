@@ -0,0 +1,125 @@
+# Builds folders of made up images for the end to end benchmark (see e2e_bench.py), shaped like a real download folder:
+# a mix of sizes and formats, some byte for byte copies of other files, some named by Pixiv ID, spread over subfolders.
+# Every image is drawn from the seed, so the same spec always makes the same files and the same md5s.
+# Run on its own to look at one: python -m benchmarks.synthetic_tree <dir> [files]
+
+import os
+import random
+import shutil
+import sys
+from PIL import Image, ImageDraw
+
+FORMATS = {".png": "PNG", ".jpg": "JPEG", ".gif": "GIF", ".bmp": "BMP"}
+
+
+class TreeSpec:
+    def __init__(self, files:int = 200, sizes:list[tuple[int, int]] = None, formats:list[str] = None, duplicate_ratio:float = 0.1,
+                 rename_ratio:float = 0.2, pixiv_ratio:float = 0.1, subdirs:int = 4, seed:int = 0):
+        """
+        Args:
+            files (int, optional): Files in the tree, copies included.
+            sizes (list[tuple[int, int]], optional): Image sizes, picked from at random. Defaults to a spread from 800x600 to 2560x1440.
+            formats (list[str], optional): Extensions to save as, picked from at random. Defaults to .png and .jpg.
+            duplicate_ratio (float, optional): Share of files that are a byte for byte copy of an earlier one under another name.
+            rename_ratio (float, optional): Share of files rename() moves between runs, for the rescan.
+            pixiv_ratio (float, optional): Share of files named like a Pixiv download (12345678_p0.png), which get a Pixiv ID lookup.
+            subdirs (int, optional): Subfolders the files are spread over, 0 to keep them all at the top.
+            seed (int, optional): Seed everything is drawn from.
+        """
+        self.files = files
+        self.sizes = sizes or [(800, 600), (1280, 720), (1920, 1080), (2560, 1440)]
+        self.formats = formats or [".png", ".jpg"]
+        self.duplicate_ratio = duplicate_ratio
+        self.rename_ratio = rename_ratio
+        self.pixiv_ratio = pixiv_ratio
+        self.subdirs = subdirs
+        self.seed = seed
+        for ext in self.formats:
+            if not ext in FORMATS:
+                raise ValueError(f"Unsupported format {ext}, expected one of {', '.join(FORMATS)}")
+
+
+    def to_dict(self) -> dict:
+        return {
+            "files": self.files,
+            "sizes": [list(s) for s in self.sizes],
+            "formats": self.formats,
+            "duplicate_ratio": self.duplicate_ratio,
+            "rename_ratio": self.rename_ratio,
+            "pixiv_ratio": self.pixiv_ratio,
+            "subdirs": self.subdirs,
+            "seed": self.seed,
+        }
+
+
+def draw_image(rand:random.Random, size:tuple[int, int]) -> Image.Image:
+    """Flat colour with a handful of random boxes. Different enough between images that their perceptual hashes don't
+    collide, and quick to draw and encode unlike noise."""
+    image = Image.new("RGB", size, tuple(rand.randrange(256) for _ in range(3)))
+    draw = ImageDraw.Draw(image)
+    width, height = size
+    for _ in range(12):
+        x, y = rand.randrange(width), rand.randrange(height)
+        draw.rectangle([x, y, x + rand.randrange(width // 2) + 1, y + rand.randrange(height // 2) + 1],
+                       fill=tuple(rand.randrange(256) for _ in range(3)))
+    return image
+
+
+def file_name(rand:random.Random, spec:TreeSpec, i:int, ext:str) -> str:
+    if rand.random() < spec.pixiv_ratio:
+        return f"{rand.randrange(10_000_000, 130_000_000)}_p{rand.randrange(4)}{ext}"
+    return f"image_{i:06d}{ext}"
+
+
+def folder(rand:random.Random, root:str, spec:TreeSpec) -> str:
+    return os.path.join(root, f"folder_{rand.randrange(spec.subdirs):02d}") if spec.subdirs > 0 else root
+
+
+def generate(root:str, spec:TreeSpec) -> dict[str, int]:
+    """Fills root with spec.files images. Returns how many of each kind were made."""
+    rand = random.Random(spec.seed)
+    made = {"images": 0, "duplicates": 0, "pixiv": 0, "bytes": 0}
+    originals:list[str] = []
+    os.makedirs(root, exist_ok=True)
+
+    for i in range(spec.files):
+        if any(originals) and rand.random() < spec.duplicate_ratio:
+            source = rand.choice(originals)
+            full_path = os.path.join(folder(rand, root, spec), file_name(rand, spec, i, os.path.splitext(source)[1]))
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            shutil.copyfile(source, full_path)
+            made["duplicates"] += 1
+        else:
+            ext = rand.choice(spec.formats)
+            full_path = os.path.join(folder(rand, root, spec), file_name(rand, spec, i, ext))
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            image = draw_image(rand, rand.choice(spec.sizes))
+            image.save(full_path, FORMATS[ext], **({"quality": 90} if ext == ".jpg" else {}))
+            originals.append(full_path)
+            made["images"] += 1
+        made["pixiv"] += "_p" in os.path.basename(full_path)
+        made["bytes"] += os.path.getsize(full_path)
+    return made
+
+
+def rename(root:str, spec:TreeSpec) -> int:
+    """Moves spec.rename_ratio of whatever files are left under root to a new name in another folder, the way files get
+    sorted by hand between runs. Returns how many were moved."""
+    rand = random.Random(spec.seed + 1)
+    paths = sorted(os.path.join(path, name) for path, _, names in os.walk(root) for name in names)
+    moved = 0
+    for full_path in paths:
+        if rand.random() >= spec.rename_ratio:
+            continue
+        target = os.path.join(folder(rand, root, spec), f"renamed_{moved:06d}_{os.path.basename(full_path)}")
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.rename(full_path, target)
+        moved += 1
+    return moved
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit("usage: python -m benchmarks.synthetic_tree <dir> [files]")
+    spec = TreeSpec(int(sys.argv[2]) if len(sys.argv) > 2 else 200)
+    print(generate(sys.argv[1], spec))
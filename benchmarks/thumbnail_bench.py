@@ -0,0 +1,56 @@
+# Measures how many upload payloads per second we can build: the old full decode, draft mode decoding, and draft mode
+# spread over the prefetcher's process pool. Run from the repo root: python -m benchmarks.thumbnail_bench
+
+import io
+import os
+import sys
+import time
+import tempfile
+from PIL import Image
+import src.thumbnail as thumbnail
+from src.thumbnail import ThumbnailPrefetcher
+
+FILES = 24
+SIZE = (4000, 3000)
+
+
+def full_decode(full_path:str) -> bytes:
+    """What API.__get_image_data used to do."""
+    with Image.open(full_path) as image:
+        image = image.convert('RGB')
+        image.thumbnail(thumbnail.THUMBSIZE, resample=Image.Resampling.LANCZOS)
+        with io.BytesIO() as imageData:
+            image.save(imageData,format='PNG')
+            return imageData.getvalue()
+
+
+def prefetched(paths:list[str], prefetcher:ThumbnailPrefetcher):
+    for future in [prefetcher.submit(p) for p in paths]:
+        future.result()
+
+
+def run(label:str, fn):
+    start = time.perf_counter()
+    fn()
+    print(f"{label:<28}{FILES / (time.perf_counter() - start):>8.1f} payloads/sec")
+
+
+def main():
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count()
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        for i in range(FILES):
+            full_path = os.path.join(tmp, f"{i}.jpg")
+            Image.effect_noise(SIZE, 40 + i).convert("RGB").save(full_path, quality=90)
+            paths.append(full_path)
+
+        print(f"{FILES} JPEGs at {SIZE[0]}x{SIZE[1]}")
+        run("full decode", lambda: [full_decode(p) for p in paths])
+        run("draft decode", lambda: [thumbnail.build_payload(p) for p in paths])
+        # Started outside the timing, the scan starts its workers before the first file too.
+        with ThumbnailPrefetcher(workers) as prefetcher:
+            run(f"draft decode, {workers} processes", lambda: prefetched(paths, prefetcher))
+
+
+if __name__ == "__main__":
+    main()
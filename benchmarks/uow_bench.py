@@ -0,0 +1,68 @@
+# Counts commits (each one an fsync of the WAL under SQLite's default synchronous=FULL) per scanned file, with every
+# write committed on its own versus held by a unit of work. Run from the repo root: python -m benchmarks.uow_bench
+
+import os
+import tempfile
+import time
+import src.database.imgdatabase as imgdatabase
+import src.repos.unitofwork as unitofwork
+import src.repos.saucenaoresultrepo as saucenaoresultrepo
+from src.scanindex import ScanIndex
+
+FILES = 500
+
+
+class CommitCounter:
+    """Autocommit writes outside of BEGIN/COMMIT are a commit each, same as every COMMIT."""
+    def __init__(self):
+        self.commits = 0
+        self.__in_transaction = False
+
+
+    def __call__(self, statement:str):
+        statement = statement.lstrip().upper()
+        if statement.startswith("BEGIN"):
+            self.__in_transaction = True
+        elif statement.startswith(("COMMIT", "ROLLBACK")):
+            self.__in_transaction = False
+            self.commits += 1
+        elif statement.startswith(("INSERT", "UPDATE", "DELETE")) and not self.__in_transaction:
+            self.commits += 1
+
+
+def scan(prefix:str):
+    """The writes process_results makes for a file with two low matches that ends up with a phash."""
+    index = ScanIndex()
+    for i in range(FILES):
+        image_uid = index.insert_image(f"/{prefix}/{i}.png", f"{prefix}{i:030x}")
+        index.update_phash(image_uid, f"{i:016x}")
+        for site_id in (i, i + FILES):
+            saucenaoresultrepo.insert_result(image_uid, 512, site_id, 70.0)
+
+
+def run(label:str, fn):
+    counter = CommitCounter()
+    imgdatabase.db_handler.get_connection().set_trace_callback(counter)
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    imgdatabase.db_handler.get_connection().set_trace_callback(None)
+    print(f"{label:<22}{counter.commits / FILES:>8.2f} fsyncs/file {FILES / elapsed:>10,.0f} files/sec")
+
+
+def held():
+    with unitofwork.begin():
+        scan("b")
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        imgdatabase.db_handler = getattr(imgdatabase, "__database")(os.path.join(tmp, "bench.db"))
+        print(f"{FILES} files, 4 writes each")
+        run("commit per write", lambda: scan("a"))
+        run("unit of work", held)
+        imgdatabase.db_handler.close()
+
+
+if __name__ == "__main__":
+    main()
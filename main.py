@@ -3,8 +3,6 @@
 import sys
 import codecs
 import click
-import src.checkresults as checkresults
-import src.saucenaoscan as saucenaoscan
 import src.saucenaoconfig as saucenaoconfig
 
 config = saucenaoconfig.config
@@ -12,6 +10,9 @@ config = saucenaoconfig.config
 sys.stdout = codecs.getwriter('utf8')(sys.stdout.detach())
 sys.stderr = codecs.getwriter('utf8')(sys.stderr.detach())
 
+# Commands import what they need when they run rather than up here, so cron and --help don't pay for PIL, requests, the
+# Danbooru client or opening the DB unless the command actually uses them. See benchmarks/startup_bench.py.
+
 # Allow an argument to subsititute for another. Good to have for reference, but no longer needed.
 #########EXPAND CLICK FUNCTIONALITY##########
 #class Mutex(click.Option):
@@ -39,15 +40,33 @@ def commands():
     pass
 
 
+def start_profile(profile:bool, command:str):
+    if profile:
+        import src.metrics as metrics
+        metrics.enable(command)
+
+
+def finish_profile():
+    """Writes out the profile of the run if --profile was given, as JSON and for Prometheus' textfile collector."""
+    import src.metrics as metrics
+    profile = metrics.finish(config.settings["METRICS_FILE"], config.settings["METRICS_TEXTFILE"])
+    if profile is not None:
+        print(profile)
+        print(f"Metrics written to {', '.join(p for p in [config.settings['METRICS_FILE'], config.settings['METRICS_TEXTFILE']] if p)}")
+
+
 @click.command()
 @click.option("-t", "--threshold", type=click.FLOAT, default=config.settings["LOW_THRESHOLD"], show_default=True, 
               help="Compare files above minimum similarity threshold.")
-def check_results(threshold:float):
+@click.option("-p", "--preview", is_flag=True, default=False, show_default=True, 
+              help="Open the cached thumbnail sent to Saucenao instead of the full size local file.")
+def check_results(threshold:float, preview:bool):
     """
     Check images that didn't get automatically added to Danbooru. Will open your browser to display the image on your machine
     to compare with the image found on Danbooru. File will be favorited to Danbooru and removed locally if match is confirmed.
     """
-    checkresults.check_low_threshold_results(threshold)
+    import src.checkresults as checkresults
+    checkresults.check_low_threshold_results(threshold, preview)
 
 
 @click.command()
@@ -64,16 +83,25 @@ def check_results(threshold:float):
               help="Schedules a crontab task to run.")
 @click.option("-m", "--md5_only", is_flag=True, default=False, show_default=True, 
               help="Only scan files via MD5. This only searches Danbooru and will not be limited to daily searches by Saucenao.")
-def scan(directory:str, recursive:bool, high_threshold:int, low_threshold:int, schedule:bool, md5_only:bool):
+@click.option("-w", "--workers", type=click.IntRange(min=1), default=1, show_default=True, 
+              help="Danbooru lookups to run at once during an MD5 only scan, only allowed with -m. Requests are still limited by DANBOORU_REQUESTS_PER_SECOND in config.json.")
+@click.option("--profile", is_flag=True, default=False, show_default=True, 
+              help="Time each stage of the scan and write the totals to METRICS_FILE and METRICS_TEXTFILE in config.json. Kept on the crontab task with -s.")
+def scan(directory:str, recursive:bool, high_threshold:int, low_threshold:int, schedule:bool, md5_only:bool, workers:int, profile:bool):
     """
     Connects to the Saucenao web API to look at specified file(s) and determine if they match. If they match, will favorite the image
     on Danbooru then remove the file from the local machine.
     """
+    if workers > 1 and not md5_only:
+        raise click.UsageError("--workers only applies to an MD5 only scan, add -m or leave --workers off.")
+    import src.saucenaoscan as saucenaoscan
+    start_profile(profile, "md5_scan" if md5_only else "scan")
     if md5_only:
-        saucenaoscan.md5_scan(directory, recursive)
+        saucenaoscan.md5_scan(directory, recursive, workers)
     else:
         saucenaoscan.full_scan(directory, recursive, high_threshold, low_threshold, schedule)
         
+    finish_profile()
     print("Scan Complete.")
 
 
@@ -82,18 +110,66 @@ def scan(directory:str, recursive:bool, high_threshold:int, low_threshold:int, s
 @click.option("-r", "--recursive", 
               is_flag=True, show_default=True, default=False, 
               help="Pull images from all sub-directories within specified directory.")
-def skip_scan(directory:str, recursive:bool):
+@click.option("--profile", is_flag=True, default=False, show_default=True, 
+              help="Time each stage of the scan and write the totals to METRICS_FILE and METRICS_TEXTFILE in config.json.")
+def skip_scan(directory:str, recursive:bool, profile:bool):
     """
     Skips scan for files that won't be found or if DB corrupted and files no longer working properly.
     """
+    import src.saucenaoscan as saucenaoscan
+    start_profile(profile, "skip_scan")
     saucenaoscan.skip_scan(directory, recursive)
         
+    finish_profile()
     print("Scan Complete.")
 
 
+@click.command()
+@click.option("-h", "--high_threshold", type=int, default=config.settings["HIGH_THRESHOLD"], show_default=True, 
+              help="Files that meet the high threshold will be automatically favorited to Danbooru. Default can be changed in config.json.")
+@click.option("-l", "--low_threshold", type=int, default=config.settings["LOW_THRESHOLD"], show_default=True, 
+              help="""Files above low threshold will be recorded and can be checked via 'check-results'.
+              Results underthreshold are discarded. Default can be changed in config.json.""")
+def reprocess(high_threshold:int, low_threshold:int):
+    """
+    Re-runs the results of already scanned images against new thresholds using their cached Saucenao responses, without spending
+    any searches. Saucenao only returned results above the low threshold used at the time, so anything below that can't be recovered.
+    """
+    import src.saucenaoscan as saucenaoscan
+    saucenaoscan.reprocess(high_threshold, low_threshold)
+
+    print("Reprocess Complete.")
+
+
+@click.command()
+@click.option("-a", "--action", multiple=True, 
+              help="Only show records of this action, i.e. favorited, low_match, no_match, rejected. Can be given more than once.")
+@click.option("-p", "--path", help="Only show records for paths containing this.")
+@click.option("-m", "--md5", help="Only show records for the file with this md5.")
+@click.option("-i", "--post_id", type=int, help="Only show records for this Danbooru post.")
+@click.option("-s", "--since", type=click.DateTime(), help="Only show records from this date/time on.")
+@click.option("-j", "--json", "as_json", is_flag=True, default=False, show_default=True, 
+              help="Print the records as JSON lines, for piping into jq and the like.")
+def log(action:tuple[str], path:str, md5:str, post_id:int, since, as_json:bool):
+    """
+    Searches the logs of past runs (LOG_DIR in config.json), compressed ones included, for what happened to which files.
+    """
+    import json
+    import src.runlog as runlog
+    for record in runlog.read(actions=list(action), path=path, md5=md5, post_id=post_id, since=since):
+        if as_json:
+            print(json.dumps(record, ensure_ascii=False))
+            continue
+        similarity = f"{record['similarity']}%" if "similarity" in record else ""
+        print(f"{record['timestamp'][:19]} {record['command']:<13} {record['action']:<14} {similarity:>7} {record.get('post_id', ''):>9}  "
+              f"{record.get('path') or record.get('message', '')}")
+
+
 commands.add_command(check_results)
 commands.add_command(scan)
 commands.add_command(skip_scan)
+commands.add_command(reprocess)
+commands.add_command(log)
 
 
 if __name__ == "__main__":
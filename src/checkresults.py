@@ -1,5 +1,5 @@
 import os
-import sys
+import tempfile
 import webbrowser
 from PIL import Image as PILImage
 from colorama import Fore, Style
@@ -8,18 +8,26 @@ from src.modules.imgmodule import Image, Saucenao_Result
 from src.database.imgdatabase import Parameter
 import src.repos.imagerepo as imagerepo
 import src.repos.saucenaoresultrepo as saucenaoresultrepo
-
-if sys.platform == "linux":
-    sys.path.append(os.path.expanduser("~/pCloudDrive/repos/DanbooruAPI/"))
-elif sys.platform == "win32":
-    sys.path.append("P:/repos/DanbooruAPI/")
-
-import danbooru
-
-danAPI = danbooru.API()
+import src.danclient as danclient
+import src.payloadcache as payloadcache
+import src.runlog as runlog
+from src.postcache import PostCache
+from src.scanpipeline import Pipeline
+
+danAPI = danclient.LazyAPI()
+post_cache = PostCache(danAPI)
 config = saucenaoconfig.config
 
 
+class Review:
+    """An image waiting on the user, along with everything the prompt needs."""
+    def __init__(self, image:Image, results:list[Saucenao_Result]):
+        self.image = image
+        self.results = results
+        self.exists = True
+        self.size:tuple[int, int] = None
+        self.posts:list[dict] = None
+
 
 def remove_file(image:Image):
     imagerepo.delete_image(int(image.image_uid))
@@ -27,17 +35,40 @@ def remove_file(image:Image):
         os.remove(image.full_path)
 
 
-def add_favorite(img_id):
-    danAPI.add_favorite(img_id)
-    print(f"{img_id} added to favorites.")
+def add_favorite(image:Image, result:Saucenao_Result):
+    danAPI.add_favorite(result.site_id)
+    print(f"{result.site_id} added to favorites.")
+    runlog.write("favorited", image.full_path, image.md5, result.similarity, result.site_id, f"{result.site_id} added to favorites.")
+
 
+def get_preview(image:Image) -> str:
+    """Writes out the same thumbnail that was sent to Saucenao, it's small enough to open instantly even if the original lives on a slow share."""
+    preview_path = os.path.join(tempfile.gettempdir(), "saucenao_previews", f"{image.md5}.png")
+    if not os.path.exists(preview_path):
+        os.makedirs(os.path.dirname(preview_path), exist_ok=True)
+        with open(preview_path, "wb") as f:
+            f.write(payloadcache.shared().get_or_build(image.md5, image.full_path))
+    return preview_path
 
-def display_results(image:Image, results:list[Saucenao_Result]):
-    webbrowser.get(config.settings["DEFAULT_BROWSER"]).open(image.full_path, new = 0)
+
+def prepare_review(review:Review, preview:bool = False) -> Review:
+    """Runs a few images ahead of the prompt so the user never waits on the disk or Danbooru in between images."""
+    review.exists = os.path.exists(review.image.full_path)
+    if review.exists and any(review.results):
+        with PILImage.open(review.image.full_path) as image:
+            review.size = image.size
+        review.posts = [post_cache.get_post(r.site_id) for r in review.results]
+        if preview:
+            get_preview(review.image)
+    return review
+
+
+def display_results(image:Image, results:list[Saucenao_Result], preview:bool = False, posts:list[dict] = None):
+    webbrowser.get(config.settings["DEFAULT_BROWSER"]).open(get_preview(image) if preview else image.full_path, new = 0)
 
     for i in range(0, len(results)):
         result = results[i]
-        post = danAPI.get_post(result.site_id)
+        post = posts[i] if posts is not None else post_cache.get_post(result.site_id)
         print(f"{Fore.LIGHTMAGENTA_EX}{result.site_id} ({result.similarity}%) {post['image_width']} x {post['image_height']}  [{i}] {Fore.LIGHTMAGENTA_EX}{Style.RESET_ALL}")
         webbrowser.get(config.settings["DEFAULT_BROWSER"]).open(f"{danAPI.hostname}/posts/{result.site_id}", new = 2)
 
@@ -50,44 +81,57 @@ def display_results(image:Image, results:list[Saucenao_Result]):
                         update_params=[Parameter("status", 1)],
                         where_params=[Parameter("result_uid", [r.result_uid for r in results])
                     ])
+                    for r in results:
+                        runlog.write("rejected", image.full_path, image.md5, r.similarity, r.site_id)
                     break
                 case "a":
                     for r in results:
-                        add_favorite(r.site_id)
+                        add_favorite(image, r)
                     remove_file(image)
                     break
                 case _:
                     try:
                         for i in [int(i.strip()) for i in input_val.split(",")]:
-                            add_favorite(results[i].site_id)
+                            add_favorite(image, results[i])
                         remove_file(image)
                         break
                     except:
                         print("Invalid input.")
     except Exception as e:
         print(e)
+        runlog.write("error", message=str(e))
 
 
-def check_low_threshold_results(threshold:float):
+def check_low_threshold_results(threshold:float, preview:bool = False):
+    pipeline:Pipeline = None
     try:
-        image_list = imagerepo.get_images([Parameter("status", 1)])
-        for i in image_list:
-            if not os.path.exists(i.full_path):
+        runlog.start("check_results")
+        # Fetch the posts for everything about to be reviewed up front, a batch at a time, rather than one by one in between prompts.
+        post_cache.warm_from_results([Parameter("similarity", threshold, Parameter.Condition.GRTOREQUAL), Parameter("status", 0)])
+        # Images and their results are read on the pipeline's thread, its own connection, so the changes made here while
+        # the user works through them don't affect the read. The next few images are prepared while the user decides.
+        depth = config.settings["REVIEW_PREFETCH"]
+        reviews = (Review(image, results) for image, results in saucenaoresultrepo.get_pending_reviews(threshold))
+        pipeline = Pipeline(reviews, depth).stage("prepare", lambda r: prepare_review(r, preview), depth)
+        for review in pipeline:
+            i = review.image
+            if not review.exists:
                 remove_file(i)
                 print(f"{i.file_name} already deleted. Removed entry.")
+                runlog.write("missing", i.full_path, i.md5, message=f"{i.file_name} already deleted. Removed entry.")
                 continue
 
-            results_list = saucenaoresultrepo.get_results([
-                Parameter("image_uid", i.image_uid),
-                Parameter("similarity", threshold, Parameter.Condition.GRTOREQUAL),
-                Parameter("status", 0),
-            ])
-
-            if any(results_list):
-                image = PILImage.open(i.full_path)
-                print(f"{Fore.LIGHTGREEN_EX}{i.file_name+i.ext} {image.width} x {image.height}{Fore.LIGHTMAGENTA_EX}{Style.RESET_ALL}")
-                display_results(i, results_list)
+            if any(review.results):
+                width, height = review.size
+                print(f"{Fore.LIGHTGREEN_EX}{i.file_name+i.ext} {width} x {height}{Fore.LIGHTMAGENTA_EX}{Style.RESET_ALL}")
+                display_results(i, review.results, preview, review.posts)
     except Exception as e:
         print(e)
+        runlog.write("error", message=str(e))
+    finally:
+        if pipeline is not None:
+            pipeline.close()
+        runlog.close()
 
+    print(post_cache.stats)
     print("Done.")
\ No newline at end of file
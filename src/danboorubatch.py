@@ -0,0 +1,190 @@
+import threading
+from collections import deque
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor, Future
+
+# Danbooru's md5 metatag takes a comma separated list, so a whole batch of files can be checked in one search
+# instead of one search per file.
+
+# Danbooru caps a page at 200 posts, this also keeps the query string to a sane length.
+BATCH_SIZE = 100
+
+
+def lookup_md5s(api, md5s:list[str]) -> tuple[dict[str, list[dict]], int]:
+    """Searches Danbooru for every md5 at once.
+
+    Args:
+        api: Danbooru client, anything with a get_posts(params) method.
+        md5s (list[str]): md5s to search for.
+
+    Returns:
+        tuple[dict[str, list[dict]], int]: Posts found keyed by md5, and how many calls it took.
+    """
+    found:dict[str, list[dict]] = {}
+    hidden = __search(api, md5s, found)
+    calls = 1
+    if any(hidden):
+        calls += __bisect(api, [md5 for md5 in md5s if not md5 in found], hidden, found)
+    return found, calls
+
+
+def __search(api, md5s:list[str], found:dict[str, list[dict]]) -> list[dict]:
+    """One search for every md5, adding what it finds to found. Returns the posts that couldn't be matched to an md5."""
+    if len(md5s) == 1:
+        posts = api.get_posts({"tags": f"md5:{md5s[0]}"})
+        if any(posts):
+            found[md5s[0]] = posts
+        return []
+
+    hidden = []
+    for post in api.get_posts({"tags": f"md5:{','.join(md5s)}", "limit": len(md5s)}):
+        if "md5" in post:
+            found.setdefault(post["md5"], []).append(post)
+        else:
+            hidden.append(post)
+    return hidden
+
+
+def __bisect(api, unresolved:list[str], hidden:list[dict], found:dict[str, list[dict]]) -> int:
+    """Works out which of the unresolved md5s the hidden posts belong to. Returns how many calls it took.
+
+    Danbooru leaves the md5 off posts the account can't fully see (banned artists being the main one), so they can't be
+    matched back to a file from a batch search. Searching half of the md5s again tells which half they're in, and the
+    other half's share is whatever didn't come back, so a hidden post costs a call per halving rather than one per file."""
+    if len(unresolved) == 1:
+        found[unresolved[0]] = hidden
+        return 0
+
+    middle = len(unresolved) // 2
+    first, second = unresolved[:middle], unresolved[middle:]
+    first_hidden = __search(api, first, found)
+    # A lone md5 gets its posts back with or without the md5 on them.
+    if len(first) == 1 and first[0] in found:
+        first_hidden = found.pop(first[0])
+    calls = 1
+    if any(first_hidden):
+        calls += __bisect(api, first, first_hidden, found)
+    first_ids = {post["id"] for post in first_hidden}
+    second_hidden = [post for post in hidden if not post["id"] in first_ids]
+    if any(second_hidden):
+        calls += __bisect(api, second, second_hidden, found)
+    return calls
+
+
+class BatchStats:
+    def __init__(self):
+        self.files = 0
+        self.calls = 0
+
+
+    @property
+    def calls_saved(self) -> int:
+        return self.files - self.calls
+
+
+    def __str__(self):
+        return f"Danbooru MD5 lookups: {self.files} files in {self.calls} calls ({self.calls_saved} saved)"
+
+
+class MD5Batcher:
+    """Holds files waiting on a Danbooru md5 lookup and resolves them a batch at a time.
+
+    With more than one worker, batches are looked up on a thread pool while the caller keeps queueing files.
+    Resolved batches are always handed back in the order they were queued, so whatever the caller does with
+    them (DB writes, output) happens on its own thread in a deterministic order.
+    """
+    def __init__(self, api, batch_size:int = BATCH_SIZE, workers:int = 1, precheck:Callable[[any], bool] = None):
+        """
+        Args:
+            api: Danbooru client, anything with a get_posts(params) method.
+            batch_size (int, optional): Files per lookup. Defaults to BATCH_SIZE.
+            workers (int, optional): Lookups that can run at once. Defaults to 1, which looks batches up on the caller's thread.
+            precheck (Callable, optional): Run on each key before the lookup, keys that fail it come back with posts set to None.
+        """
+        self.api = api
+        self.batch_size = batch_size
+        self.workers = max(1, workers)
+        self.precheck = precheck
+        self.stats = BatchStats()
+        self.__pending:list[tuple[any, str]] = []
+        self.__pending_md5s:set[str] = set()
+        self.__in_flight:deque[tuple[set[str], Future]] = deque()
+        self.__pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="danbooru") if self.workers > 1 else None
+        self.__lock = threading.Lock()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def close(self):
+        if self.__pool is not None:
+            self.__pool.shutdown(cancel_futures=True)
+
+
+    def is_pending(self, md5:str) -> bool:
+        return md5 in self.__pending_md5s or any(md5 in md5s for md5s, _ in self.__in_flight)
+
+
+    def add(self, key, md5:str) -> list[tuple[any, str, list[dict] | None]]:
+        """Queues a file for lookup. Returns whichever batches have finished, oldest first, which may be none."""
+        self.__pending.append((key, md5))
+        self.__pending_md5s.add(md5)
+        if len(self.__pending) >= self.batch_size:
+            self.__submit()
+        return self.__collect(block=False)
+
+
+    def wait_for(self, md5:str) -> list[tuple[any, str, list[dict] | None]]:
+        """Resolves batches up to and including the one holding md5."""
+        if md5 in self.__pending_md5s:
+            self.__submit()
+        results = []
+        while self.is_pending(md5):
+            results.extend(self.__in_flight.popleft()[1].result())
+        return results
+
+
+    def flush(self) -> list[tuple[any, str, list[dict] | None]]:
+        """Resolves everything queued. Returns (key, md5, posts) in the order files were added, posts is empty if nothing was found."""
+        self.__submit()
+        return self.__collect(block=True)
+
+
+    def __submit(self):
+        if not any(self.__pending):
+            return
+
+        batch = self.__pending
+        md5s = self.__pending_md5s
+        self.__pending = []
+        self.__pending_md5s = set()
+        if self.__pool is not None:
+            future = self.__pool.submit(self.__resolve, batch)
+        else:
+            future = Future()
+            future.set_result(self.__resolve(batch))
+        self.__in_flight.append((md5s, future))
+
+
+    def __collect(self, block:bool) -> list[tuple[any, str, list[dict] | None]]:
+        # Don't let lookups pile up past a couple per worker, the caller waits on the oldest instead.
+        results = []
+        while self.__in_flight and (block or self.__in_flight[0][1].done() or len(self.__in_flight) > self.workers * 2):
+            results.extend(self.__in_flight.popleft()[1].result())
+        return results
+
+
+    def __resolve(self, batch:list[tuple[any, str]]) -> list[tuple[any, str, list[dict] | None]]:
+        passed = [self.precheck is None or self.precheck(key) for key, _ in batch]
+        md5s = list(dict.fromkeys(md5 for (_, md5), ok in zip(batch, passed) if ok))
+        found, calls = lookup_md5s(self.api, md5s) if any(md5s) else ({}, 0)
+        with self.__lock:
+            self.stats.files += sum(passed)
+            self.stats.calls += calls
+
+        return [(key, md5, found.get(md5, []) if ok else None) for (key, md5), ok in zip(batch, passed)]
@@ -0,0 +1,30 @@
+import os
+import sys
+
+if sys.platform == "linux":
+    sys.path.append(os.path.expanduser("~/pCloudDrive/repos/DanbooruAPI/"))
+elif sys.platform == "win32":
+    sys.path.append("P:/repos/DanbooruAPI/")
+
+
+def create_api() -> "danbooru.API":
+    """Danbooru client that shares the app's HTTP session, so its requests reuse the same pooled connections and
+    timeouts. Failed connections aren't retried for it, the danbooru package calls the session directly."""
+    import danbooru
+    import src.transport as transport
+    api = danbooru.API()
+    transport.shared().attach(api)
+    return api
+
+
+class LazyAPI:
+    """Stands in for the client until it's first used, so importing a module that keeps one around costs nothing."""
+    def __init__(self, factory = create_api):
+        self.__factory = factory
+        self.__api = None
+
+
+    def __getattr__(self, name):
+        if self.__api is None:
+            self.__api = self.__factory()
+        return getattr(self.__api, name)
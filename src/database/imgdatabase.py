@@ -1,149 +1,186 @@
+import atexit
 import sqlite3
+import threading
+from collections.abc import Iterable, Iterator
+from itertools import islice
+from contextlib import contextmanager
 from sqlite3 import Error
 import src.saucenaoconfig as saucenaoconfig
+import src.database.migrations as migrations
+import src.metrics as metrics
 from enum import Enum
 
 config = saucenaoconfig.config
 
 
 class __database():
-    def __init__(self):
-        self.db_instance = config.settings["IMG_DATABASE"] if not saucenaoconfig.IS_DEBUG else config.settings["TEST_IMG_DATABASE"]
+    # The repos build their SQL from Parameter lists so there are more distinct statements than it looks like,
+    # keep enough of them prepared that a scan never has to re-parse a query.
+    __CACHED_STATEMENTS = 256
+
+    def __init__(self, db_instance:str = None):
+        self.db_instance = db_instance or (config.settings["IMG_DATABASE"] if not saucenaoconfig.IS_DEBUG else config.settings["TEST_IMG_DATABASE"])
+        self.__local = threading.local()
+        self.__connections:list[sqlite3.Connection] = []
+        self.__lock = threading.Lock()
+        atexit.register(self.close)
         self.init_setup()
 
 
+    def get_connection(self) -> sqlite3.Connection:
+        """Returns the connection owned by the calling thread, opening and configuring it on first use."""
+        conn = getattr(self.__local, "conn", None)
+        if conn is None:
+            # Autocommit mode, transactions are only ever opened explicitly through transaction().
+            conn = sqlite3.connect(self.db_instance, isolation_level=None, check_same_thread=False,
+                                   cached_statements=self.__CACHED_STATEMENTS)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL;")
+            conn.execute("PRAGMA foreign_keys=ON;")
+            conn.execute("PRAGMA busy_timeout=5000;")
+            self.__local.conn = conn
+            self.__local.depth = 0
+            with self.__lock:
+                self.__connections.append(conn)
+        return conn
+
+
+    def close(self):
+        """Closes every connection opened by any thread. A new one will be opened if the handler is used again."""
+        with self.__lock:
+            for conn in self.__connections:
+                conn.close()
+            self.__connections.clear()
+        self.__local = threading.local()
+
+
+    @contextmanager
+    def transaction(self):
+        """Runs everything executed on this thread inside the block as a single transaction.
+
+        Scopes can be nested, inner scopes become savepoints so a repo function can open its own scope
+        without caring whether the caller already did.
+        """
+        conn = self.get_connection()
+        depth = self.__local.depth
+        savepoint = f"sp_{depth}"
+        conn.execute("BEGIN IMMEDIATE;" if depth == 0 else f"SAVEPOINT {savepoint};")
+        self.__local.depth += 1
+        try:
+            yield conn
+        except BaseException:
+            self.__local.depth -= 1
+            if depth == 0:
+                conn.execute("ROLLBACK;")
+            else:
+                conn.execute(f"ROLLBACK TO {savepoint};")
+                conn.execute(f"RELEASE {savepoint};")
+            raise
+        else:
+            self.__local.depth -= 1
+            conn.execute("COMMIT;" if depth == 0 else f"RELEASE {savepoint};")
+
+
     def execute_nonquery(self, query, params = ()) -> bool:
-        with sqlite3.connect(self.db_instance) as conn:
-            try:
-                cursor = conn.cursor()
-                cursor.execute("PRAGMA foreign_keys=ON;")
-                cursor.execute(query, params)
-            except Error as e:
-                raise Exception(f"Error:{e}\nQuery:{query}\nParmas:{params}")
-                    
-            return True
+        try:
+            self.get_connection().execute(query, params)
+        except Error as e:
+            raise Exception(f"Error:{e}\nQuery:{query}\nParmas:{params}")
+
+        return True
+
 
-                
     def execute_query(self, query, params = ()) -> list[any]:
-        with sqlite3.connect(self.db_instance) as conn:
-            results = None
-            try:
-                conn.row_factory = sqlite3.Row
-                cursor = conn.cursor()
-                cursor.execute("PRAGMA foreign_keys=ON;")
-                cursor.execute(query, params)
-                results = cursor.fetchall()
-            except Error as e:
-                raise Exception(f"Error:{e}\nQuery:{query}\nParmas:{params}")
-                    
-            return results
+        try:
+            if not metrics.enabled:
+                return self.get_connection().execute(query, params).fetchall()
+            with metrics.timed("db_lookup"):
+                return self.get_connection().execute(query, params).fetchall()
+        except Error as e:
+            raise Exception(f"Error:{e}\nQuery:{query}\nParmas:{params}")
+
+
+    def execute_stream(self, query, params = (), batch_size:int = 256) -> Iterator[any]:
+        """Same as execute_query, but yields rows as they're read instead of loading them all at once.
+        NOTE: Writes made on the same thread while the rows are still being read may or may not show up in them. Read on another 
+        thread (a separate connection) to get a consistent snapshot instead."""
+        try:
+            cursor = self.get_connection().execute(query, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not any(rows):
+                    break
+                yield from rows
+        except Error as e:
+            raise Exception(f"Error:{e}\nQuery:{query}\nParmas:{params}")
 
 
     def execute_change(self, query, params = ()) -> int:
-        with sqlite3.connect(self.db_instance) as conn:
-            results = None
-            try:
-                cursor = conn.cursor()
-                cursor.execute("PRAGMA foreign_keys=ON;")
-                cursor.execute(query, params)
-                conn.commit()
-                result = cursor.lastrowid
-            except Error as e:
-                if conn:
-                    conn.rollback()
-                raise Exception(f"Error:{e}\nQuery:{query}\nParmas:{params}")
-                    
-            return result
+        # Outside of a transaction scope the statement commits on its own, inside one it's committed with the scope.
+        try:
+            if not metrics.enabled:
+                return self.get_connection().execute(query, params).lastrowid
+            with metrics.timed("db_write"):
+                return self.get_connection().execute(query, params).lastrowid
+        except Error as e:
+            raise Exception(f"Error:{e}\nQuery:{query}\nParmas:{params}")
 
 
     def execute_mass_transaction(self, queries:str | list[str], params = ()):
         """Used for larged scaled queries, such as large data transfers.
 
         Args:
-            queries (list[str]): List of all queries to be provided
+            queries (str | list[str]): A single query run once for each set of params, or a list of queries that are each run with params.
         """
-        with sqlite3.connect(self.db_instance) as conn:
-            try:
+        query = None
+        try:
+            with metrics.timed("db_write"), self.transaction() as conn:
                 cursor = conn.cursor()
-                cursor.execute("PRAGMA foreign_keys=ON;")
-                cursor.execute("BEGIN TRANSACTION")
-
-                if queries is str:
+                if isinstance(queries, str):
+                    query = queries
                     cursor.executemany(queries, params)
                 else:
                     for query in queries:
                         cursor.execute(query, params)
-
-                cursor.execute("END TRANSACTION")
-                conn.commit()
+        except Error as e:
+            raise Exception(f"Error:{e}\nQuery:{query}\nParmas:{params}")
+
+
+    def execute_many(self, query:str, rows:Iterable, chunk_size:int = 1000) -> tuple[int, int]:
+        """Runs the query once for every row, committing every chunk_size rows. Rows are pulled from the iterable a chunk at a 
+        time, so a huge import never has to be held in memory. Returns how many rows were run and how many rows of the table
+        they changed, rows an ON CONFLICT clause skipped aren't counted in the latter.
+        NOTE: Chunks already committed stay committed if a later one fails."""
+        total = 0
+        changed = 0
+        rows = iter(rows)
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                return total, changed
+            try:
+                with metrics.timed("db_write"), self.transaction() as conn:
+                    before = conn.total_changes
+                    conn.executemany(query, chunk)
+                    changed += conn.total_changes - before
             except Error as e:
-                if conn:
-                    conn.rollback()
-                raise Exception(f"Error:{e}\nQuery:{query}\nParmas:{params}")
+                raise Exception(f"Error:{e}\nQuery:{query}\nRows:{total}-{total + len(chunk)}")
+            total += len(chunk)
 
 
     def init_setup(self):
-        for x in ["Saucenao_Results", "Images"]:
-            self.execute_nonquery(f"""
-                CREATE TABLE IF NOT EXISTS Status_{x} (
-                    status          INTEGER     PRIMARY KEY,
-                    status_type     TEXT
-                )
-            """)
-        if not self.execute_query("SELECT * FROM Status_Saucenao_Results"):
-            self.execute_change("""
-                INSERT INTO Status_Saucenao_Results VALUES
-                (0, "Unknown"),
-                (1, "No Match")
-            """)
-        if not self.execute_query("SELECT * FROM Status_Images"):
-            self.execute_change("""
-                INSERT INTO Status_Images VALUES
-                (1, "Full Scan"),
-                (2, "MD5 Only Scan"),
-                (3, "Banned Artist")
-            """)
-
-        self.execute_nonquery("""
-            CREATE TABLE IF NOT EXISTS Images (
-                image_uid INTEGER PRIMARY KEY,
-                file_name TEXT,
-                full_path TEXT    UNIQUE
-                                  NOT NULL,
-                ext       TEXT,
-                md5       TEXT    UNIQUE
-                                  NOT NULL,
-                status    INTEGER DEFAULT 1,
-                FOREIGN KEY (status)
-                    REFERENCES Status_Images(status)
-            )
-        """)
-        self.execute_nonquery("""
-            CREATE TABLE IF NOT EXISTS Saucenao_Results (
-                result_uid  INTEGER     PRIMARY KEY,
-                image_uid   INTEGER,
-                site_flag   INTEGER,
-                site_id     INTEGER,
-                similarity  REAL,
-                status      INTEGER,
-                FOREIGN KEY (image_uid)
-                    REFERENCES Images(image_uid) ON DELETE CASCADE,
-                FOREIGN KEY (status)
-                    REFERENCES Status_Saucenao_Results(status)
-            )
-        """)
-        # Maybe add this later, but for now we're only using danbooru
-        #FOREIGN KEY (site_flag)
-        #    REFERENCES Websites (site_flag)
-        #websites_table_query = """
-        #    CREATE TABLE IF NOT EXISTS Websites (
-        #        site_flag      INTEGER     PRIMARY KEY,
-        #        hostname       TEXT,
-        #    )
-        #"""
-
-
-db_handler = __database()
+        """Brings the schema up to date, see migrations.py. Costs a single PRAGMA once the database is current."""
+        migrations.migrate(self)
+
+
+def __getattr__(name:str):
+    # The handler is only created the first time something asks for it, so commands that never touch the DB (i.e. --help) 
+    # don't open it or run migrations. After that it's a plain module attribute and this isn't called again.
+    if name == "db_handler":
+        global db_handler
+        db_handler = __database()
+        return db_handler
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 class Parameter():
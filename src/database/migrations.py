@@ -0,0 +1,165 @@
+import sqlite3
+from collections.abc import Callable
+
+# Schema changes, applied in order and each only once. The database's PRAGMA user_version is how many have been applied, so
+# a database that's up to date is settled with one PRAGMA and no DDL at all.
+# NOTE: Only ever add to the end of the list. A migration that's been released must never change, write a new one instead.
+
+
+def __baseline(conn:sqlite3.Connection):
+    """Everything init_setup used to create on every start. Written to be safe on a database made by any version before
+    migrations existed, those all report user_version 0."""
+    for x in ["Saucenao_Results", "Images"]:
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS Status_{x} (
+                status          INTEGER     PRIMARY KEY,
+                status_type     TEXT
+            )
+        """)
+    conn.execute("""
+        INSERT OR IGNORE INTO Status_Saucenao_Results VALUES
+        (0, "Unknown"),
+        (1, "No Match")
+    """)
+    conn.execute("""
+        INSERT OR IGNORE INTO Status_Images VALUES
+        (1, "Full Scan"),
+        (2, "MD5 Only Scan"),
+        (3, "Banned Artist")
+    """)
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS Images (
+            image_uid INTEGER PRIMARY KEY,
+            file_name TEXT,
+            full_path TEXT    UNIQUE
+                              NOT NULL,
+            ext       TEXT,
+            md5       TEXT    UNIQUE
+                              NOT NULL,
+            status    INTEGER DEFAULT 1,
+            size      INTEGER,
+            mtime_ns  INTEGER,
+            inode     INTEGER,
+            phash     TEXT,
+            FOREIGN KEY (status)
+                REFERENCES Status_Images(status)
+        )
+    """)
+    # Fingerprint and perceptual hash columns were added after the table was first created, older databases need them added on.
+    image_columns = [c[1] for c in conn.execute("PRAGMA table_info(Images)")]
+    for column, col_type in {"size": "INTEGER", "mtime_ns": "INTEGER", "inode": "INTEGER", "phash": "TEXT"}.items():
+        if column not in image_columns:
+            conn.execute(f"ALTER TABLE Images ADD COLUMN {column} {col_type}")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS Saucenao_Results (
+            result_uid  INTEGER     PRIMARY KEY,
+            image_uid   INTEGER,
+            site_flag   INTEGER,
+            site_id     INTEGER,
+            similarity  REAL,
+            status      INTEGER,
+            FOREIGN KEY (image_uid)
+                REFERENCES Images(image_uid) ON DELETE CASCADE,
+            FOREIGN KEY (status)
+                REFERENCES Status_Saucenao_Results(status)
+        )
+    """)
+    # Perceptual hashes of images that were confidently matched and favorited. The image record itself is deleted once
+    # it's favorited, this is what lets re-encoded or resized copies be matched without spending another search.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS Perceptual_Matches (
+            match_uid   INTEGER     PRIMARY KEY,
+            phash       TEXT        NOT NULL,
+            site_flag   INTEGER,
+            site_id     INTEGER,
+            similarity  REAL
+        )
+    """)
+    # Raw responses from SauceNAO, zlib compressed JSON. Lets results be reprocessed with new thresholds without another search.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS Saucenao_Responses (
+            md5         TEXT        NOT NULL,
+            dbmask      INTEGER     NOT NULL,
+            fetched_at  REAL        NOT NULL,
+            response    BLOB        NOT NULL,
+            PRIMARY KEY (md5, dbmask)
+        )
+    """)
+    # The few fields we use off Danbooru posts, so popular posts aren't fetched again for every image that matches them.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS Danbooru_Posts (
+            post_id         INTEGER     PRIMARY KEY,
+            is_banned       INTEGER     NOT NULL,
+            image_width     INTEGER     NOT NULL,
+            image_height    INTEGER     NOT NULL,
+            expires_at      REAL        NOT NULL
+        )
+    """)
+    # Every search sent to SauceNAO along with the quota it reported back, used to work out when the next run should be.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS Quota_Ledger (
+            ledger_uid      INTEGER     PRIMARY KEY,
+            requested_at    REAL        NOT NULL,
+            status_code     INTEGER,
+            short_limit     INTEGER,
+            short_remaining INTEGER,
+            long_limit      INTEGER,
+            long_remaining  INTEGER
+        )
+    """)
+    # Maybe add this later, but for now we're only using danbooru
+    #FOREIGN KEY (site_flag)
+    #    REFERENCES Websites (site_flag)
+    #websites_table_query = """
+    #    CREATE TABLE IF NOT EXISTS Websites (
+    #        site_flag      INTEGER     PRIMARY KEY,
+    #        hostname       TEXT,
+    #    )
+    #"""
+
+
+def __query_indexes(conn:sqlite3.Connection):
+    """Indexes for the queries the repos actually run, tests/test_migrations.py checks SQLite uses them, add to it along with either."""
+    # Results by image, for check-results' join, reprocess and the cascade when an image is deleted. Holds every column so
+    # SELECT * by image never has to touch the table.
+    conn.execute("CREATE INDEX IF NOT EXISTS Saucenao_Results_image ON Saucenao_Results (image_uid, status, similarity, site_flag, site_id)")
+    # Pending results over a threshold, for warming the post cache before check-results.
+    conn.execute("CREATE INDEX IF NOT EXISTS Saucenao_Results_pending ON Saucenao_Results (status, similarity, image_uid, site_flag, site_id)")
+    # Images by status, already in image_uid order within each status so check-results' ORDER BY comes for free.
+    conn.execute("CREATE INDEX IF NOT EXISTS Images_status ON Images (status)")
+    # The last 24 hours of the quota ledger.
+    conn.execute("CREATE INDEX IF NOT EXISTS Quota_Ledger_requested_at ON Quota_Ledger (requested_at)")
+
+
+MIGRATIONS:list[Callable[[sqlite3.Connection], None]] = [
+    __baseline,
+    __query_indexes,
+]
+
+
+def version(conn:sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(handler) -> int:
+    """Applies whatever migrations the database is missing, each in its own transaction along with the version bump.
+    Returns how many were applied.
+
+    Args:
+        handler: The database handler, migrations run on its connection for this thread.
+    """
+    conn = handler.get_connection()
+    if version(conn) >= len(MIGRATIONS):
+        return 0
+
+    applied = 0
+    while True:
+        with handler.transaction():
+            # Check again now that we hold the write lock, another process may have just done it.
+            current = version(conn)
+            if current >= len(MIGRATIONS):
+                return applied
+            MIGRATIONS[current](conn)
+            conn.execute(f"PRAGMA user_version = {current + 1}")
+        applied += 1
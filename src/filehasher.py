@@ -0,0 +1,116 @@
+import os
+import mmap
+import time
+import threading
+import hashlib
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor, Future
+import src.metrics as metrics
+
+
+# Files at least this big are mapped instead of read, saves copying every chunk into a buffer.
+MMAP_THRESHOLD = 64 * 1024 * 1024
+
+
+def md5_file(full_path:str, chunk_size:int = 1024 * 1024) -> tuple[str, int]:
+    """Returns the md5 and size of the file. Memory use is bounded by chunk_size no matter how big the file is."""
+    md5 = hashlib.md5()
+    with open(full_path, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        if size >= MMAP_THRESHOLD:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+                for offset in range(0, size, chunk_size):
+                    md5.update(view[offset:offset+chunk_size])
+        else:
+            buffer = bytearray(chunk_size)
+            with memoryview(buffer) as view:
+                while read := file.readinto(buffer):
+                    md5.update(view[:read])
+
+    return md5.hexdigest(), size
+
+
+class HashStats:
+    """Throughput is measured over the time at least one file was being hashed, so time the caller spends
+    on other work between results isn't counted against it."""
+    def __init__(self):
+        self.files = 0
+        self.cached = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+
+    @property
+    def mb_per_sec(self) -> float:
+        return (self.bytes / (1024 * 1024)) / self.seconds if self.seconds else 0.0
+
+
+    def __str__(self):
+        return f"Hashed {self.files} files ({self.bytes / (1024 * 1024):.1f} MB, {self.cached} unchanged skipped) at {self.mb_per_sec:.1f} MB/s"
+
+
+class FileHasher:
+    """Hashes files across a thread pool. hashlib releases the GIL while hashing so the threads run in parallel."""
+    def __init__(self, workers:int = 4, chunk_size:int = 1024 * 1024):
+        self.workers = max(1, workers)
+        self.chunk_size = chunk_size
+        self.stats = HashStats()
+        self.__active = 0
+        self.__busy_since = 0.0
+        self.__lock = threading.Lock()
+
+
+    def hash_files(self, items:Iterable, known:Callable[[any], str | None] = None) -> Iterator[tuple[any, str]]:
+        """Yields (item, md5) in the same order the items came in. Items are paths, or anything os.fspath accepts.
+
+        Args:
+            items (Iterable): Files to hash, consumed lazily.
+            known (Callable, optional): Returns an md5 for an item that doesn't need hashing, or None if it does.
+        """
+        # Only keep a couple of files per worker in flight so memory stays flat on huge directories.
+        window = self.workers * 2
+        pending:deque[tuple[any, Future | str]] = deque()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="hasher") as pool:
+            try:
+                for item in items:
+                    md5 = known(item) if known is not None else None
+                    if md5 is not None:
+                        self.stats.cached += 1
+                        pending.append((item, md5))
+                    else:
+                        pending.append((item, pool.submit(self.__timed_md5, os.fspath(item))))
+
+                    while len(pending) > window or (pending and isinstance(pending[0][1], str)):
+                        yield self.__result(*pending.popleft())
+
+                while pending:
+                    yield self.__result(*pending.popleft())
+            finally:
+                for _, result in pending:
+                    if isinstance(result, Future):
+                        result.cancel()
+
+
+    def __timed_md5(self, full_path:str) -> tuple[str, int]:
+        with self.__lock:
+            if self.__active == 0:
+                self.__busy_since = time.perf_counter()
+            self.__active += 1
+        try:
+            with metrics.timed("hash"):
+                return md5_file(full_path, self.chunk_size)
+        finally:
+            with self.__lock:
+                self.__active -= 1
+                if self.__active == 0:
+                    self.stats.seconds += time.perf_counter() - self.__busy_since
+
+
+    def __result(self, item, result:Future | str) -> tuple[any, str]:
+        if isinstance(result, str):
+            return item, result
+        md5, size = result.result()
+        self.stats.files += 1
+        self.stats.bytes += size
+        return item, md5
@@ -0,0 +1,40 @@
+import os
+from collections.abc import Iterator
+
+
+def walk_files(directory:str, recursive:bool, extensions:set[str] = None, blacklisted_terms:list[str] = ()) -> Iterator[os.DirEntry]:
+    """Yields files as the directory is read rather than after the whole tree has been listed.
+
+    Entries are filtered by extension and blacklisted terms here, before anything downstream stats or opens them.
+    DirEntry objects are yielded so callers can reuse their cached stat() instead of hitting the filesystem again.
+    Walks the tree in the same order as a top-down os.walk and, like it, doesn't follow symlinked directories.
+
+    Args:
+        directory (str): Directory to start from.
+        recursive (bool): Include all sub-directories.
+        extensions (set[str], optional): Only yield files with one of these extensions. Defaults to all files.
+        blacklisted_terms (list[str], optional): Skip anything whose path contains one of these.
+    """
+    # Only directories still to be read are held on to, so memory doesn't grow with the number of files.
+    pending = [directory]
+    while pending:
+        try:
+            scanner = os.scandir(pending.pop())
+        except OSError:
+            continue
+
+        sub_directories = []
+        with scanner:
+            for entry in scanner:
+                if any(bl in entry.path for bl in blacklisted_terms):
+                    continue
+                try:
+                    if entry.is_dir():
+                        if recursive and not entry.is_symlink():
+                            sub_directories.append(entry.path)
+                    elif (entry.is_file() and 
+                          (extensions is None or os.path.splitext(entry.name)[1] in extensions)):
+                        yield entry
+                except OSError:
+                    continue
+        pending.extend(reversed(sub_directories))
@@ -0,0 +1,195 @@
+import os
+import json
+import time
+import threading
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager, nullcontext
+
+# Timers and counters for a run, only collected when the command is run with --profile. Until enable() is called every
+# function here returns straight away, so the calls can be left in anything that does I/O for next to nothing. Paths hot enough
+# that even a function call shows (every DB statement) check `enabled` first instead.
+#
+# Timers are named after the stage they cover:
+#   enumerate           walking the directory
+#   hash                md5 of a file, on the hashing threads
+#   db_lookup           a SELECT
+#   db_write            a write, or a unit of work flush
+#   danbooru            a Danbooru API call
+#   danbooru_throttle   waiting on DANBOORU_REQUESTS_PER_SECOND before one
+#   thumbnail           the scan waiting on an upload payload, built or prefetched
+#   saucenao            a SauceNAO search
+# Stages run on different threads at once, so their times add up to more than the run took.
+
+PREFIX = "saucenao"
+
+
+class Timer:
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.max = 0.0
+
+
+class Metrics:
+    def __init__(self, command:str):
+        self.command = command
+        self.started = time.time()
+        self.finished:float = None
+        self.timers:dict[str, Timer] = {}
+        self.counters:dict[str, int] = {}
+        self.gauges:dict[str, float] = {}
+        self.__lock = threading.Lock()
+
+
+    def observe(self, name:str, seconds:float):
+        with self.__lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                timer = self.timers[name] = Timer()
+            timer.calls += 1
+            timer.seconds += seconds
+            timer.max = max(timer.max, seconds)
+
+
+    @contextmanager
+    def time(self, name:str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+
+    def count(self, name:str, n:int = 1):
+        with self.__lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+
+    def gauge(self, name:str, value:float):
+        with self.__lock:
+            self.gauges[name] = value
+
+
+    @property
+    def duration(self) -> float:
+        return (self.finished or time.time()) - self.started
+
+
+    def summary(self) -> dict:
+        with self.__lock:
+            return {
+                "command": self.command,
+                "started": self.started,
+                "duration": self.duration,
+                "timers": {name: {"calls": t.calls, "seconds": t.seconds, "max": t.max} for name, t in sorted(self.timers.items())},
+                "counters": dict(sorted(self.counters.items())),
+                "gauges": dict(sorted(self.gauges.items())),
+            }
+
+
+    def textfile(self) -> str:
+        """The summary in Prometheus' text format, for node_exporter's textfile collector. Every value is from this run
+        alone, so they're all gauges, a dashboard sees each run's numbers as they come in."""
+        summary = self.summary()
+        labels = f'command="{self.command}"'
+        lines = []
+        def metric(name:str, help:str, samples:list[tuple[str, float]]):
+            lines.append(f"# HELP {PREFIX}_{name} {help}")
+            lines.append(f"# TYPE {PREFIX}_{name} gauge")
+            lines.extend(f"{PREFIX}_{name}{{{labels}{extra}}} {value}" for extra, value in samples)
+
+        metric("run_timestamp_seconds", "When the last run started.", [("", summary["started"])])
+        metric("run_duration_seconds", "How long the last run took.", [("", summary["duration"])])
+        timers = summary["timers"].items()
+        metric("stage_seconds", "Time spent in each stage of the last run.", [(f',stage="{n}"', t["seconds"]) for n, t in timers])
+        metric("stage_calls", "Times each stage ran in the last run.", [(f',stage="{n}"', t["calls"]) for n, t in timers])
+        metric("stage_max_seconds", "Longest single call of each stage in the last run.", [(f',stage="{n}"', t["max"]) for n, t in timers])
+        for name, value in summary["counters"].items():
+            metric(name, f"{name.replace('_', ' ').capitalize()} in the last run.", [("", value)])
+        for name, value in summary["gauges"].items():
+            metric(name, f"{name.replace('_', ' ').capitalize()} at the end of the last run.", [("", value)])
+        return "\n".join(lines) + "\n"
+
+
+    def __str__(self):
+        lines = [f"Profile ({self.command}, {self.duration:.1f}s):"]
+        for name, t in sorted(self.timers.items(), key=lambda i: i[1].seconds, reverse=True):
+            lines.append(f"  {name:<12}{t.calls:>8} calls {t.seconds:>9.3f}s total {t.seconds / t.calls * 1000:>9.2f}ms avg {t.max * 1000:>9.2f}ms max")
+        for name, value in sorted({**self.counters, **self.gauges}.items()):
+            lines.append(f"  {name:<32}{value:>10}")
+        return "\n".join(lines)
+
+
+def write_atomic(path:str, content:str):
+    """node_exporter could otherwise read the file half written."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temp = f"{path}.{os.getpid()}.tmp"
+    with open(temp, "w") as f:
+        f.write(content)
+    os.replace(temp, path)
+
+
+__active:Metrics = None
+__OFF = nullcontext()
+enabled = False
+
+
+def enable(command:str) -> Metrics:
+    global __active, enabled
+    __active = Metrics(command)
+    enabled = True
+    return __active
+
+
+def active() -> Metrics | None:
+    return __active
+
+
+def timed(name:str):
+    """Context manager timing the block under name, or doing nothing if metrics aren't enabled."""
+    return __OFF if __active is None else __active.time(name)
+
+
+def count(name:str, n:int = 1):
+    if __active is not None:
+        __active.count(name, n)
+
+
+def gauge(name:str, value:float):
+    if __active is not None:
+        __active.gauge(name, value)
+
+
+def timed_iter(name:str, items:Iterable) -> Iterable:
+    """Times how long each item takes to come out of items. Hands items straight back if metrics aren't enabled."""
+    if __active is None:
+        return items
+    return __timed_iter(__active, name, iter(items))
+
+
+def __timed_iter(metrics:Metrics, name:str, items:Iterator) -> Iterator:
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(items)
+        except StopIteration:
+            return
+        metrics.observe(name, time.perf_counter() - start)
+        yield item
+
+
+def finish(json_path:str = None, textfile_path:str = None) -> Metrics | None:
+    """Stops the clock and writes the summary out to whichever paths are given. Returns the metrics, or None if they
+    weren't enabled."""
+    global __active, enabled
+    metrics, __active = __active, None
+    enabled = False
+    if metrics is None:
+        return None
+
+    metrics.finished = time.time()
+    if json_path:
+        write_atomic(json_path, json.dumps(metrics.summary(), indent=4))
+    if textfile_path:
+        write_atomic(textfile_path, metrics.textfile())
+    return metrics
@@ -4,7 +4,12 @@ class Image:
         self.file_name = datarow['file_name']
         self.full_path = datarow['full_path']
         self.ext = datarow['ext']
+        self.md5 = datarow['md5']
         self.status = datarow['status']
+        self.size = datarow['size']
+        self.mtime_ns = datarow['mtime_ns']
+        self.inode = datarow['inode']
+        self.phash = datarow['phash']
 
 class Saucenao_Result:
     def __init__(self, datarow):
@@ -14,3 +19,29 @@ class Saucenao_Result:
         self.site_id = datarow['site_id']
         self.similarity = datarow['similarity']
         self.status = datarow['status']
+
+class Perceptual_Match:
+    def __init__(self, datarow):
+        self.match_uid = datarow['match_uid']
+        self.phash = datarow['phash']
+        self.site_flag = datarow['site_flag']
+        self.site_id = datarow['site_id']
+        self.similarity = datarow['similarity']
+
+class Quota_Entry:
+    def __init__(self, datarow):
+        self.ledger_uid = datarow['ledger_uid']
+        self.requested_at = datarow['requested_at']
+        self.status_code = datarow['status_code']
+        self.short_limit = datarow['short_limit']
+        self.short_remaining = datarow['short_remaining']
+        self.long_limit = datarow['long_limit']
+        self.long_remaining = datarow['long_remaining']
+
+class Danbooru_Post:
+    def __init__(self, datarow):
+        self.post_id = datarow['post_id']
+        self.is_banned = bool(datarow['is_banned'])
+        self.image_width = datarow['image_width']
+        self.image_height = datarow['image_height']
+        self.expires_at = datarow['expires_at']
@@ -0,0 +1,95 @@
+import time
+import sqlite3
+import threading
+import src.saucenaoconfig as saucenaoconfig
+import src.thumbnail as thumbnail
+
+config = saucenaoconfig.config
+
+
+class PayloadCache:
+    """Encoded thumbnails keyed by the md5 of the file they came from, kept in their own small SQLite file.
+
+    Least recently used payloads are evicted once the cache grows past max_bytes. Since it's keyed by content a
+    retry, a rescan after a crash or a moved file never has to decode the image again.
+    """
+    def __init__(self, path:str, max_bytes:int):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.__lock = threading.Lock()
+        self.__conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.__conn.execute("PRAGMA journal_mode=WAL;")
+        self.__conn.execute("""
+            CREATE TABLE IF NOT EXISTS Payloads (
+                md5         TEXT    PRIMARY KEY,
+                payload     BLOB    NOT NULL,
+                size        INTEGER NOT NULL,
+                last_used   REAL    NOT NULL
+            )
+        """)
+        self.__conn.execute("CREATE INDEX IF NOT EXISTS Payloads_last_used ON Payloads (last_used)")
+        self.__total = self.__conn.execute("SELECT COALESCE(SUM(size), 0) FROM Payloads").fetchone()[0]
+
+
+    def close(self):
+        with self.__lock:
+            self.__conn.close()
+
+
+    def contains(self, md5:str) -> bool:
+        with self.__lock:
+            return self.__conn.execute("SELECT 1 FROM Payloads WHERE md5 = ?", [md5]).fetchone() is not None
+
+
+    def get(self, md5:str) -> bytes | None:
+        with self.__lock:
+            row = self.__conn.execute("SELECT payload FROM Payloads WHERE md5 = ?", [md5]).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.__conn.execute("UPDATE Payloads SET last_used = ? WHERE md5 = ?", [time.time(), md5])
+            return row[0]
+
+
+    def put(self, md5:str, payload:bytes):
+        with self.__lock:
+            old = self.__conn.execute("SELECT size FROM Payloads WHERE md5 = ?", [md5]).fetchone()
+            self.__conn.execute("INSERT OR REPLACE INTO Payloads (md5, payload, size, last_used) VALUES (?, ?, ?, ?)", 
+                                [md5, payload, len(payload), time.time()])
+            self.__total += len(payload) - (old[0] if old else 0)
+            self.__evict()
+
+
+    def get_or_build(self, md5:str, full_path:str) -> bytes:
+        payload = self.get(md5)
+        if payload is None:
+            payload = thumbnail.build_payload(full_path)
+            self.put(md5, payload)
+        return payload
+
+
+    def __evict(self):
+        while self.__total > self.max_bytes:
+            rows = self.__conn.execute("SELECT md5, size FROM Payloads ORDER BY last_used LIMIT 32").fetchall()
+            if not any(rows):
+                self.__total = 0
+                return
+            evicted = []
+            for md5, size in rows:
+                if self.__total <= self.max_bytes:
+                    break
+                evicted.append([md5])
+                self.__total -= size
+            self.__conn.executemany("DELETE FROM Payloads WHERE md5 = ?", evicted)
+
+
+__shared:PayloadCache = None
+
+
+def shared() -> PayloadCache:
+    global __shared
+    if __shared is None:
+        __shared = PayloadCache(config.settings["THUMBNAIL_CACHE"], config.settings["THUMBNAIL_CACHE_MB"] * 1024 * 1024)
+    return __shared
@@ -0,0 +1,118 @@
+import io
+from statistics import pvariance
+from PIL import Image
+import src.repos.perceptualrepo as perceptualrepo
+from src.modules.imgmodule import Perceptual_Match
+
+
+# dHash compares each pixel of a 9x8 grayscale image to its neighbour, giving one bit per comparison.
+HASH_SIZE = 8
+# Below this the 9x8 image is flat, its bits are down to rounding and every flat image (blank pages, solid fills) would match.
+MIN_VARIANCE = 4.0
+
+
+def dhash(payload:bytes) -> int | None:
+    """Difference hash of an encoded image. Takes the thumbnail payload since it's already been built by the time it's needed.
+    Returns None for an image too flat to hash, see degenerate()."""
+    with Image.open(io.BytesIO(payload)) as image:
+        pixels = list(image.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.LANCZOS).getdata())
+    if pvariance(pixels) < MIN_VARIANCE:
+        return None
+
+    value = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            left = pixels[row * (HASH_SIZE + 1) + col]
+            right = pixels[row * (HASH_SIZE + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value if not degenerate(value) else None
+
+
+def degenerate(value:int) -> bool:
+    """All bits the same, i.e. the image only ever gets lighter (or darker) left to right. Says nothing about what's in
+    it, so it's neither indexed nor matched."""
+    return value.bit_count() in (0, HASH_SIZE * HASH_SIZE)
+
+
+def to_hex(value:int) -> str:
+    return f"{value:016x}"
+
+
+def distance(a:int, b:int) -> int:
+    return (a ^ b).bit_count()
+
+
+def similarity(distance:int) -> float:
+    """Share of the hash's bits that agree, as a percentage. Not comparable to Saucenao's similarity, only to other hashes."""
+    return round(100 * (1 - distance / (HASH_SIZE * HASH_SIZE)), 2)
+
+
+class BKTree:
+    """Metric tree over Hamming distance, a search only visits the branches that could hold something within range."""
+    def __init__(self):
+        self.__root = None
+
+
+    def add(self, value:int, item):
+        if self.__root is None:
+            self.__root = (value, [item], {})
+            return
+
+        node = self.__root
+        while True:
+            d = distance(value, node[0])
+            if d == 0:
+                node[1].append(item)
+                return
+            if not d in node[2]:
+                node[2][d] = (value, [item], {})
+                return
+            node = node[2][d]
+
+
+    def search(self, value:int, max_distance:int) -> list[tuple[int, any]]:
+        """Returns (distance, item) for everything within max_distance, closest first."""
+        found = []
+        pending = [self.__root] if self.__root is not None else []
+        while pending:
+            node_value, items, children = pending.pop()
+            d = distance(value, node_value)
+            if d <= max_distance:
+                found.extend((d, item) for item in items)
+            for child_d, child in children.items():
+                if d - max_distance <= child_d <= d + max_distance:
+                    pending.append(child)
+        return sorted(found, key=lambda f: f[0])
+
+
+class PerceptualIndex:
+    """Perceptual hashes of every confident match made so far, loaded once per scan and written through on add."""
+    def __init__(self, max_distance:int):
+        self.max_distance = max_distance
+        self.__tree = BKTree()
+        for match in perceptualrepo.get_matches():
+            # Recorded before degenerate hashes were left out.
+            if not degenerate(int(match.phash, 16)):
+                self.__tree.add(int(match.phash, 16), match)
+
+
+    def find(self, phash:int) -> tuple[int, Perceptual_Match] | None:
+        """Closest confident match within max_distance bits, as (distance, match)."""
+        if degenerate(phash):
+            return None
+        found = self.__tree.search(phash, self.max_distance)
+        return found[0] if any(found) else None
+
+
+    def add(self, phash:int, site_flag:int, site_id:int, similarity:float):
+        if degenerate(phash):
+            return
+        # match_uid isn't known until the insert is committed, nothing looks matches up by it during a scan anyway.
+        perceptualrepo.insert_match(to_hex(phash), site_flag, site_id, similarity)
+        self.__tree.add(phash, Perceptual_Match({
+            "match_uid": None,
+            "phash": to_hex(phash),
+            "site_flag": site_flag,
+            "site_id": site_id,
+            "similarity": similarity,
+        }))
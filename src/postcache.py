@@ -0,0 +1,141 @@
+import time
+import threading
+from collections import OrderedDict
+from collections.abc import Callable
+from src.database.imgdatabase import Parameter
+from src.danboorubatch import BATCH_SIZE
+import src.repos.postrepo as postrepo
+import src.repos.saucenaoresultrepo as saucenaoresultrepo
+import src.saucenaoconfig as saucenaoconfig
+
+config = saucenaoconfig.config
+
+
+class PostStats:
+    def __init__(self):
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+
+    @property
+    def lookups(self) -> int:
+        return self.memory_hits + self.db_hits + self.misses
+
+
+    @property
+    def hit_rate(self) -> float:
+        return (self.memory_hits + self.db_hits) / self.lookups if self.lookups > 0 else 0.0
+
+
+    def __str__(self):
+        return f"Danbooru post cache: {self.lookups} lookups, {self.hit_rate:.0%} hit ({self.memory_hits} memory, {self.db_hits} DB, {self.misses} fetched)"
+
+
+class PostCache:
+    """Danbooru posts by id, checked in memory first, then the Danbooru_Posts table, then Danbooru itself.
+
+    Only the fields the app uses (id, is_banned, image_width, image_height) are kept, and each entry expires `ttl` seconds
+    after it was fetched so a post that's since been banned or replaced gets picked up. The table is shared by every
+    command, so posts looked up during a scan are already there by the time their results come up in check-results.
+    """
+    def __init__(self, api, capacity:int = None, ttl:float = None, clock:Callable[[], float] = time.time):
+        """
+        Args:
+            api: Danbooru client, anything with get_post(id) and get_posts(params) methods.
+            capacity (int, optional): Posts kept in memory. Defaults to POST_CACHE_SIZE in config.json.
+            ttl (float, optional): Seconds an entry is good for. Defaults to POST_CACHE_TTL_DAYS in config.json.
+            clock (optional): Swappable for a fake clock when testing. Wall clock time, the expiry is kept in the table.
+        """
+        self.api = api
+        self.clock = clock
+        self.capacity = capacity or config.settings["POST_CACHE_SIZE"]
+        self.ttl = ttl if ttl is not None else config.settings["POST_CACHE_TTL_DAYS"] * 24 * 60 * 60
+        # Lookups come from the scan thread and the pipeline's danbooru stage at once, so counts go through __lock too.
+        self.stats = PostStats()
+        self.__posts:OrderedDict[int, tuple[float, dict]] = OrderedDict()
+        self.__lock = threading.Lock()
+
+
+    def __remember(self, post:dict, expires_at:float):
+        with self.__lock:
+            self.__posts[post["id"]] = (expires_at, post)
+            self.__posts.move_to_end(post["id"])
+            while len(self.__posts) > self.capacity:
+                self.__posts.popitem(last=False)
+
+
+    def __count(self, stat:str):
+        with self.__lock:
+            setattr(self.stats, stat, getattr(self.stats, stat) + 1)
+
+
+    def __recall(self, post_id:int, now:float) -> dict | None:
+        with self.__lock:
+            entry = self.__posts.get(post_id)
+            if entry is None:
+                return None
+            if entry[0] <= now:
+                del self.__posts[post_id]
+                return None
+            self.__posts.move_to_end(post_id)
+            return entry[1]
+
+
+    def __load(self, post_ids:list[int], now:float) -> dict[int, dict]:
+        """Pulls whatever's still good out of the table into memory."""
+        found = {}
+        for i in range(0, len(post_ids), 500):
+            for row in postrepo.get_posts([Parameter("post_id", post_ids[i:i+500]), Parameter("expires_at", now, Parameter.Condition.GREATER)]):
+                post = {"id": row.post_id, "is_banned": row.is_banned, "image_width": row.image_width, "image_height": row.image_height}
+                self.__remember(post, row.expires_at)
+                found[row.post_id] = post
+        return found
+
+
+    def __store(self, posts:list[dict], now:float):
+        posts = [{"id": p["id"], "is_banned": p["is_banned"], "image_width": p["image_width"], "image_height": p["image_height"]} for p in posts]
+        postrepo.upsert_posts(posts, now + self.ttl)
+        for post in posts:
+            self.__remember(post, now + self.ttl)
+        return posts
+
+
+    def get_post(self, post_id:int) -> dict:
+        """Drop in for the client's get_post, returning only the cached fields."""
+        post_id = int(post_id)
+        now = self.clock()
+        post = self.__recall(post_id, now)
+        if post is not None:
+            self.__count("memory_hits")
+            return post
+
+        post = self.__load([post_id], now).get(post_id)
+        if post is not None:
+            self.__count("db_hits")
+            return post
+
+        self.__count("misses")
+        return self.__store([self.api.get_post(post_id)], now)[0]
+
+
+    def warm(self, post_ids) -> int:
+        """Loads the posts into memory, fetching any that aren't cached from Danbooru a batch at a time. Returns how many were fetched.
+        Posts Danbooru doesn't return (i.e. deleted) are skipped, get_post will look them up one by one if they're ever needed."""
+        now = self.clock()
+        missing = [post_id for post_id in set(int(i) for i in post_ids) if self.__recall(post_id, now) is None]
+        loaded = self.__load(missing, now)
+        missing = [post_id for post_id in missing if not post_id in loaded]
+
+        fetched = 0
+        for i in range(0, len(missing), BATCH_SIZE):
+            batch = missing[i:i+BATCH_SIZE]
+            posts = self.api.get_posts({"tags": f"id:{','.join(str(post_id) for post_id in batch)}", "limit": len(batch)})
+            fetched += len(self.__store(posts, now))
+        return fetched
+
+
+    def warm_from_results(self, params:list[Parameter] = None) -> int:
+        """Warms the cache with the posts of results still waiting on check-results, or whichever results params picks out."""
+        results = saucenaoresultrepo.get_results(params if params is not None else [Parameter("status", 0)])
+        return self.warm(r.site_id for r in results)
@@ -0,0 +1,68 @@
+import time
+import datetime
+import src.repos.quotarepo as quotarepo
+import src.saucenaoconfig as saucenaoconfig
+from src.database.imgdatabase import Parameter
+from src.modules.imgmodule import Quota_Entry
+from src.ratelimit import QuotaScheduler, SHORT_WINDOW, LONG_WINDOW
+
+
+def record(status_code:int, header:dict[str:any] = None):
+    quotarepo.insert_entry(time.time(), status_code, header)
+
+
+def window_state(entries:list[Quota_Entry], window:float, short:bool, now:float) -> tuple[int, int, list[float]] | None:
+    """Works out a window's quota at `now` from the ledger.
+
+    The latest response is taken as the truth for how many searches were outstanding when it was sent. Each of those
+    comes back `window` seconds after it was made. Searches SauceNAO counted that aren't in the ledger (made from
+    somewhere else) are assumed to have been made right then, since there's no way to know better.
+
+    Returns:
+        tuple[int, int, list[float]] | None: Limit, remaining searches and when each outstanding search expires, soonest first.
+            None if the ledger has nothing to go off of.
+    """
+    limit_of = (lambda e: e.short_limit) if short else (lambda e: e.long_limit)
+    remaining_of = (lambda e: e.short_remaining) if short else (lambda e: e.long_remaining)
+    latest = next((e for e in reversed(entries) if remaining_of(e) is not None), None)
+    if latest is None:
+        return None
+
+    limit = limit_of(latest)
+    outstanding = max(0, limit - remaining_of(latest))
+    expiries = sorted(e.requested_at + window for e in entries 
+                      if e.status_code == 200 and latest.requested_at - window < e.requested_at <= latest.requested_at)
+    expiries = expiries[max(0, len(expiries) - outstanding):] if outstanding else []
+    expiries = sorted(expiries + [latest.requested_at + window] * (outstanding - len(expiries)))
+    expiries = [x for x in expiries if x > now]
+
+    return limit, limit - len(expiries), expiries
+
+
+def get_entries(now:float) -> list[Quota_Entry]:
+    return quotarepo.get_entries([Parameter("requested_at", now - LONG_WINDOW, Parameter.Condition.GREATER)])
+
+
+def next_run(min_searches:int = None) -> datetime.datetime:
+    """The soonest time there will be enough of the daily quota back to make a run worthwhile."""
+    min_searches = min_searches or saucenaoconfig.config.settings["MIN_SEARCHES_PER_RUN"]
+    now = time.time()
+    state = window_state(get_entries(now), LONG_WINDOW, short=False, now=now)
+    if state is None:
+        return datetime.datetime.fromtimestamp(now)
+
+    limit, remaining, expiries = state
+    needed = min(min_searches, limit) - remaining
+    at = expiries[needed - 1] if needed > 0 else now
+    return datetime.datetime.fromtimestamp(at)
+
+
+def seed(scheduler:QuotaScheduler):
+    """Starts the scheduler off from the ledger so a run doesn't assume it has a full quota when it doesn't."""
+    now = time.time()
+    entries = get_entries(now)
+    for bucket, window, short in [(scheduler.short, SHORT_WINDOW, True), (scheduler.long, LONG_WINDOW, False)]:
+        state = window_state(entries, window, short, now)
+        if state is not None:
+            limit, remaining, expiries = state
+            bucket.seed(limit, remaining, [now - (x - window) for x in expiries])
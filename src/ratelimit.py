@@ -0,0 +1,240 @@
+import time
+import random
+import threading
+from collections import deque
+from collections.abc import Callable
+import src.metrics as metrics
+
+
+# SauceNAO's limits, the actual counts come back in every response header.
+SHORT_WINDOW = 30
+LONG_WINDOW = 24 * 60 * 60
+
+
+class TokenBucket:
+    """Allows `capacity` requests per `period` seconds, refilling continuously. Safe to share between threads.
+
+    Tokens are reserved up front and the balance is allowed to go negative, so callers queue up behind each other
+    in the order they asked instead of racing for the next token.
+    """
+    def __init__(self, capacity:float, period:float, tokens:float = None, 
+                 clock:Callable[[], float] = time.monotonic, sleep:Callable[[float], None] = time.sleep):
+        self.capacity = capacity
+        self.period = period
+        self.tokens = capacity if tokens is None else tokens
+        self.clock = clock
+        self.sleep = sleep
+        self.__updated = clock()
+        self.__lock = threading.Lock()
+
+
+    @property
+    def rate(self) -> float:
+        """Tokens regained per second."""
+        return self.capacity / self.period
+
+
+    def __refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.__updated) * self.rate)
+        self.__updated = now
+
+
+    def available(self) -> float:
+        with self.__lock:
+            self.__refill()
+            return self.tokens
+
+
+    def reserve(self, count:float = 1) -> float:
+        """Takes tokens and returns how many seconds the caller has to wait before they're good to use."""
+        with self.__lock:
+            self.__refill()
+            self.tokens -= count
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+    def acquire(self, count:float = 1):
+        """Takes tokens, sleeping until they're available."""
+        delay = self.reserve(count)
+        if delay > 0:
+            self.sleep(delay)
+
+
+class WindowBucket:
+    """Token bucket where each token comes back `period` seconds after it was spent, rather than trickling back in.
+
+    A continuously refilling bucket lets through up to twice its capacity inside one window (a full burst, then a
+    window's worth of refill), which is enough to trip a server counting requests over a rolling window. This never does.
+    """
+    def __init__(self, capacity:int, period:float, clock:Callable[[], float] = time.monotonic, sleep:Callable[[float], None] = time.sleep):
+        self.capacity = capacity
+        self.period = period
+        self.clock = clock
+        self.sleep = sleep
+        self.__spent:deque[float] = deque()
+        self.__lock = threading.Lock()
+
+
+    def __expire(self, now:float):
+        while self.__spent and self.__spent[0] + self.period <= now:
+            self.__spent.popleft()
+
+
+    @property
+    def tokens(self) -> int:
+        with self.__lock:
+            self.__expire(self.clock())
+            return self.capacity - len(self.__spent)
+
+
+    def available(self) -> int:
+        return self.tokens
+
+
+    def next_token_in(self) -> float:
+        """Seconds until a token is free, 0 if one is free now."""
+        with self.__lock:
+            now = self.clock()
+            self.__expire(now)
+            if len(self.__spent) < self.capacity:
+                return 0.0
+            return self.__spent[len(self.__spent) - self.capacity] + self.period - now
+
+
+    def reserve(self, count:int = 1) -> float:
+        """Takes tokens and returns how many seconds the caller has to wait before they're good to use."""
+        with self.__lock:
+            now = self.clock()
+            self.__expire(now)
+            outstanding = len(self.__spent) + count
+            start = now if outstanding <= self.capacity else self.__spent[outstanding - self.capacity - 1] + self.period
+            self.__spent.extend([start] * count)
+            return max(0.0, start - now)
+
+
+    def acquire(self, count:int = 1):
+        delay = self.reserve(count)
+        if delay > 0:
+            self.sleep(delay)
+
+
+    def seed(self, capacity:int, remaining:int, spent_ago:list[float] = None):
+        """Syncs the bucket with what the server reports. The server's count always wins over ours.
+
+        Args:
+            capacity (int): Tokens per window.
+            remaining (int): Tokens the server says are left.
+            spent_ago (list[float], optional): How many seconds ago each outstanding token was spent, if known (i.e. from
+                the quota ledger). Spends we don't know about are assumed to have just happened, so they're held for a full window.
+        """
+        with self.__lock:
+            now = self.clock()
+            self.capacity = capacity
+            if spent_ago is not None:
+                self.__spent = deque(sorted(now - ago for ago in spent_ago))
+            self.__expire(now)
+            outstanding = max(0, capacity - remaining)
+            while len(self.__spent) > outstanding:
+                self.__spent.popleft()
+            while len(self.__spent) < outstanding:
+                self.__spent.append(now)
+
+
+class QuotaScheduler:
+    """Paces SauceNAO searches against both the 30 second and 24 hour limits.
+
+    Starts from the account's default limits and is re-seeded from the limits/remaining counts SauceNAO returns
+    with every search, so sends are spaced to use the whole short window without going over it.
+    """
+    def __init__(self, short_limit:int = 4, long_limit:int = 100, max_attempts:int = 3, base_backoff:float = 30, max_backoff:float = 600,
+                 clock:Callable[[], float] = time.monotonic, sleep:Callable[[float], None] = time.sleep, jitter:Callable[[], float] = random.random):
+        """
+        Args:
+            short_limit (int, optional): Searches per 30 seconds until the first response says otherwise.
+            long_limit (int, optional): Searches per 24 hours until the first response says otherwise.
+            max_attempts (int, optional): Sends to try on a server error before giving up.
+            base_backoff (float, optional): Wait after the first server error, doubled for each one after.
+            max_backoff (float, optional): Longest wait between attempts.
+            clock, sleep, jitter (optional): Swappable for a fake clock when testing.
+        """
+        self.short = WindowBucket(short_limit, SHORT_WINDOW, clock, sleep)
+        self.long = WindowBucket(long_limit, LONG_WINDOW, clock, sleep)
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.sleep = sleep
+        self.jitter = jitter
+
+
+    def update(self, header:dict):
+        """Re-seeds both windows from a SauceNAO response header."""
+        self.short.seed(int(header["short_limit"]), int(header["short_remaining"]))
+        self.long.seed(int(header["long_limit"]), int(header["long_remaining"]))
+
+
+    def can_continue(self) -> bool:
+        return self.long.available() > 0
+
+
+    def reserve(self) -> float:
+        """Counts a search against both windows and returns how many seconds to hold it so it doesn't go over the 30 second 
+        limit. For callers that can't block, i.e. sleeping on it with asyncio instead."""
+        self.long.reserve()
+        return self.short.reserve()
+
+
+    def wait(self):
+        """Blocks until a search can be sent without going over the 30 second limit, then counts it against both windows."""
+        delay = self.reserve()
+        if delay > 0:
+            self.sleep(delay)
+
+
+    def backoff(self, attempt:int) -> float | None:
+        """Seconds to wait after a server error on the given attempt (starting at 1), or None if it's time to give up.
+
+        Exponential with equal jitter: never less than half the step, so a struggling server always gets some breathing room.
+        """
+        if attempt >= self.max_attempts:
+            return None
+        step = min(self.max_backoff, self.base_backoff * 2 ** (attempt - 1))
+        return step / 2 + self.jitter() * step / 2
+
+
+    def state(self) -> dict[str, any]:
+        return {
+            "short_limit": self.short.capacity,
+            "short_remaining": self.short.available(),
+            "long_limit": self.long.capacity,
+            "long_remaining": self.long.available(),
+            "next_search_in": self.short.next_token_in(),
+        }
+
+
+class ThrottledClient:
+    """Wraps an API client so every method call takes a token from the bucket first."""
+    def __init__(self, client, bucket:TokenBucket, name:str = "api"):
+        """
+        Args:
+            client: API client to wrap.
+            bucket (TokenBucket): Bucket every call takes a token from.
+            name (str, optional): Timer the calls are profiled under, waiting on the bucket goes under name_throttle.
+        """
+        self.__client = client
+        self.__bucket = bucket
+        self.__name = name
+        self.__throttle_name = f"{name}_throttle"
+
+
+    def __getattr__(self, name):
+        attr = getattr(self.__client, name)
+        if not callable(attr):
+            return attr
+
+        def throttled(*args, **kwargs):
+            with metrics.timed(self.__throttle_name):
+                self.__bucket.acquire()
+            with metrics.timed(self.__name):
+                return attr(*args, **kwargs)
+        return throttled
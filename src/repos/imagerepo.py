@@ -1,5 +1,8 @@
 import os
+import time
+from collections.abc import Iterable
 import src.repos.repohelper as repohelper
+import src.repos.unitofwork as unitofwork
 import src.database.imgdatabase as imgdatabase
 from src.database.imgdatabase import Parameter
 from src.modules.imgmodule import Image
@@ -16,7 +19,30 @@ class file_status(IntEnum):
     OK = 0
     Duplicate = 1
     Changed = 2
-    
+
+
+class IngestStats:
+    def __init__(self):
+        self.rows = 0
+        self.written = 0
+        self.seconds = 0.0
+
+
+    @property
+    def skipped(self) -> int:
+        """Rows that ran into an image already recorded under another path, i.e. a copy of a file."""
+        return self.rows - self.written
+
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.rows / self.seconds if self.seconds > 0 else 0.0
+
+
+    def __str__(self):
+        return f"Imported {self.written} images in {self.seconds:.1f}s ({self.rows_per_sec:,.0f} rows/sec), {self.skipped} already recorded"
+
+
     
 def get_images(params:list[Parameter] = ()) -> list[Image]:
     query, param_list = repohelper.get_where("SELECT * FROM Images WHERE 1=1", params)
@@ -33,43 +59,80 @@ def update_image(update_params:list[Parameter], where_params:list[Parameter]):
     where_set = repohelper.get_where(" WHERE 1=1", where_params)
     query += where_set[0]
     param_list.extend(where_set[1])
-    imgdatabase.db_handler.execute_change(query, param_list)
+    unitofwork.execute_change(query, param_list)
 
 
 def delete_image(image_uid):
-    imgdatabase.db_handler.execute_change("DELETE FROM Images WHERE image_uid=?", [image_uid])
+    unitofwork.execute_change("DELETE FROM Images WHERE image_uid=?", [image_uid])
 
 
-def insert_image(full_path:str, md5:str, status:image_scan_status = image_scan_status.full_scan) -> int | None:
+def get_fingerprint(full_path:str, stat:os.stat_result = None) -> tuple[int, int, int] | tuple[None, None, None]:
+    """Size, mtime and inode of a file. Used to tell if a file has changed since it was recorded without reading it."""
+    try:
+        stat = stat or os.stat(full_path)
+    except OSError:
+        return (None, None, None)
+    return (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+
+def insert_image(full_path:str, md5:str, status:image_scan_status = image_scan_status.full_scan, stat:os.stat_result = None) -> int | unitofwork.RowId:
+    """Returns the new image_uid, a RowId if the insert is held by the active unit of work."""
     file_name, ext = os.path.splitext(os.path.split(full_path)[1])
-    img_qry, img_params = ("INSERT INTO Images (full_path, file_name, ext, md5, status) VALUES (?, ?, ?, ?, ?);", [full_path, file_name, ext, md5, status])
-    return imgdatabase.db_handler.execute_change(img_qry, img_params)
-
-
-def mass_insert_image(query:str|list[str], params = ()):
-    imgdatabase.db_handler.execute_mass_transaction(query, params)
-
-
-def check_existing_file(full_path, md5):
-    """Check the MD5 value to ensure the file hasn't been moved, renamed, or is a duplicate."""
-    response = {"status": file_status.OK, "msg": None} 
-    images = get_images([Parameter("md5", md5)])
-    if any(images):
-        file_name = os.path.splitext(os.path.basename(full_path))[0]
-        image = images[0]
-        # If the file doesn't match the full path then either it's been changed or is a dupe
-        if full_path != image.full_path:
-            # Original still exists confirming this is a dupe.
-            if os.path.exists(image.full_path):
-                response["status"] = file_status.Duplicate 
-                response["msg"] = f"{full_path} is a duplicate file. File with same MD5 already exists: {image.full_path}" 
-            # Otherwise the file has been moved or renamed, update the database to reflect.
-            else:
-                response["status"] = file_status.Changed
-                response["msg"] = f"""File has been moved/renamed.\nOriginal Path: {image.full_path}\n     New Path: {full_path}"""
-                update_image(
-                    update_params=[Parameter("file_name", file_name), Parameter("full_path", full_path)],
-                    where_params=[Parameter("image_uid", image.image_uid)]
-                )
-                
-    return response
\ No newline at end of file
+    size, mtime_ns, inode = get_fingerprint(full_path, stat)
+    img_qry, img_params = ("INSERT INTO Images (full_path, file_name, ext, md5, status, size, mtime_ns, inode) VALUES (?, ?, ?, ?, ?, ?, ?, ?);", 
+                           [full_path, file_name, ext, md5, status, size, mtime_ns, inode])
+    return unitofwork.execute_insert(img_qry, img_params)
+
+
+def update_fingerprint(image_uid:int, full_path:str, stat:os.stat_result = None):
+    size, mtime_ns, inode = get_fingerprint(full_path, stat)
+    update_image(
+        update_params=[Parameter("size", size), Parameter("mtime_ns", mtime_ns), Parameter("inode", inode)],
+        where_params=[Parameter("image_uid", image_uid)]
+    )
+
+
+def path_exists(full_path:str) -> bool:
+    return any(imgdatabase.db_handler.execute_query("SELECT 1 FROM Images WHERE full_path = ?", [full_path]))
+
+
+def bulk_insert_images(rows:Iterable[tuple[str, str, image_scan_status, os.stat_result | None]], chunk_size:int = 1000) -> IngestStats:
+    """Streams rows of (full_path, md5, status, stat) into Images, a chunk per transaction, so memory use doesn't grow with the import.
+    A row whose path is already recorded has its md5, status and fingerprint refreshed, the file was changed in place.
+    One whose md5 is already recorded under another path is a copy and is skipped, and counted as such in the stats.
+
+    Args:
+        rows (Iterable): Rows to insert, consumed lazily. stat can be None, it's looked up if so.
+        chunk_size (int, optional): Rows per transaction. Defaults to 1000.
+    """
+    # A single upsert can only resolve one of the two unique columns, the WHERE keeps the update from running into the other.
+    query = """INSERT INTO Images (full_path, file_name, ext, md5, status, size, mtime_ns, inode) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT (full_path) DO UPDATE SET md5 = excluded.md5, status = excluded.status, size = excluded.size, 
+                   mtime_ns = excluded.mtime_ns, inode = excluded.inode
+                   WHERE NOT EXISTS (SELECT 1 FROM Images WHERE md5 = excluded.md5 AND full_path != excluded.full_path)
+               ON CONFLICT DO NOTHING"""
+
+    def params():
+        for full_path, md5, status, stat in rows:
+            file_name, ext = os.path.splitext(os.path.basename(full_path))
+            yield [full_path, file_name, ext, md5, int(status), *get_fingerprint(full_path, stat)]
+
+    stats = IngestStats()
+    start = time.perf_counter()
+    stats.rows, stats.written = imgdatabase.db_handler.execute_many(query, params(), chunk_size)
+    stats.seconds = time.perf_counter() - start
+    return stats
+
+
+def fingerprint_matches(image:Image, stat:os.stat_result) -> bool:
+    """File hasn't been modified since it was recorded, so the stored md5 is still good."""
+    return (image.size is not None and 
+            (image.size, image.mtime_ns, image.inode) == (stat.st_size, stat.st_mtime_ns, stat.st_ino))
+
+
+def was_moved(image:Image, stat:os.stat_result) -> bool:
+    """Same inode and size as the recorded image means it's the same file under a new path. 
+    Hard links share an inode while both paths still exist, so those can't be decided this way."""
+    return (stat is not None and image.inode is not None and stat.st_nlink == 1 and
+            image.inode == stat.st_ino and image.size == stat.st_size)
+
@@ -0,0 +1,18 @@
+import src.repos.repohelper as repohelper
+import src.repos.unitofwork as unitofwork
+from src.modules.imgmodule import Perceptual_Match
+from src.database.imgdatabase import Parameter
+import src.database.imgdatabase as imgdatabase
+
+
+def get_matches(params:list[Parameter] = ()) -> list[Perceptual_Match]:
+    query, param_list = repohelper.get_where("SELECT * FROM Perceptual_Matches WHERE 1=1", params)
+
+    results = imgdatabase.db_handler.execute_query(query, param_list)
+    return [Perceptual_Match(dr) for dr in results]
+
+
+def insert_match(phash:str, site_flag:int, site_id:int, similarity:float):
+    qry, params = ("INSERT INTO Perceptual_Matches (phash, site_flag, site_id, similarity) VALUES (?, ?, ?, ?);",
+                   [phash, site_flag, site_id, similarity])
+    unitofwork.execute_change(qry, params)
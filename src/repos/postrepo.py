@@ -0,0 +1,21 @@
+import src.repos.repohelper as repohelper
+from src.modules.imgmodule import Danbooru_Post
+from src.database.imgdatabase import Parameter
+import src.database.imgdatabase as imgdatabase
+
+
+def get_posts(params:list[Parameter] = ()) -> list[Danbooru_Post]:
+    query, param_list = repohelper.get_where("SELECT * FROM Danbooru_Posts WHERE 1=1", params)
+
+    results = imgdatabase.db_handler.execute_query(query, param_list)
+    return [Danbooru_Post(dr) for dr in results]
+
+
+def upsert_posts(posts:list[dict[str:any]], expires_at:float):
+    """Posts are in the shape Danbooru returns them, only the fields kept in the table are used."""
+    qry = """
+        INSERT INTO Danbooru_Posts (post_id, is_banned, image_width, image_height, expires_at) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (post_id) DO UPDATE SET is_banned = excluded.is_banned, image_width = excluded.image_width, 
+            image_height = excluded.image_height, expires_at = excluded.expires_at;
+    """
+    imgdatabase.db_handler.execute_many(qry, ([p["id"], int(p["is_banned"]), p["image_width"], p["image_height"], expires_at] for p in posts))
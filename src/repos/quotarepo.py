@@ -0,0 +1,20 @@
+import src.repos.repohelper as repohelper
+from src.modules.imgmodule import Quota_Entry
+from src.database.imgdatabase import Parameter
+import src.database.imgdatabase as imgdatabase
+
+
+def get_entries(params:list[Parameter] = ()) -> list[Quota_Entry]:
+    query, param_list = repohelper.get_where("SELECT * FROM Quota_Ledger WHERE 1=1", params)
+    query += " ORDER BY requested_at"
+
+    results = imgdatabase.db_handler.execute_query(query, param_list)
+    return [Quota_Entry(dr) for dr in results]
+
+
+def insert_entry(requested_at:float, status_code:int, header:dict[str:any] = None) -> int:
+    """Header is the one returned with a successful search, failed searches don't get one."""
+    header = header or {}
+    qry, params = ("INSERT INTO Quota_Ledger (requested_at, status_code, short_limit, short_remaining, long_limit, long_remaining) VALUES (?, ?, ?, ?, ?, ?);",
+                   [requested_at, status_code, header.get("short_limit"), header.get("short_remaining"), header.get("long_limit"), header.get("long_remaining")])
+    return imgdatabase.db_handler.execute_change(qry, params)
@@ -0,0 +1,14 @@
+import src.database.imgdatabase as imgdatabase
+
+
+def get_response(md5:str, dbmask:int, fetched_after:float = 0) -> bytes | None:
+    results = imgdatabase.db_handler.execute_query("SELECT response FROM Saucenao_Responses WHERE md5 = ? AND dbmask = ? AND fetched_at > ?", 
+                                                   [md5, dbmask, fetched_after])
+    return results[0]["response"] if any(results) else None
+
+
+def upsert_response(md5:str, dbmask:int, fetched_at:float, response:bytes):
+    imgdatabase.db_handler.execute_change("""
+        INSERT INTO Saucenao_Responses (md5, dbmask, fetched_at, response) VALUES (?, ?, ?, ?)
+        ON CONFLICT (md5, dbmask) DO UPDATE SET fetched_at = excluded.fetched_at, response = excluded.response;
+    """, [md5, dbmask, fetched_at, response])
@@ -1,5 +1,7 @@
+from collections.abc import Iterator
 import src.repos.repohelper as repohelper
-from src.modules.imgmodule import Saucenao_Result
+import src.repos.unitofwork as unitofwork
+from src.modules.imgmodule import Image, Saucenao_Result
 from src.database.imgdatabase import Parameter
 import src.database.imgdatabase as imgdatabase
 
@@ -16,7 +18,7 @@ def get_results(params:list[Parameter] = ()) -> list[Saucenao_Result]:
 def insert_result(image_uid:int, site_flag:int, illust_id:int, similarity:float):
     rst_qry, rst_params = ("INSERT INTO Saucenao_Results (image_uid, site_flag, site_id, similarity, status) VALUES (?, ?, ?, ?, 0);", 
                            [image_uid, site_flag, illust_id, similarity])
-    imgdatabase.db_handler.execute_change(rst_qry, rst_params)
+    unitofwork.execute_change(rst_qry, rst_params)
 
 
 def update_results(update_params:list[Parameter], where_params:list[Parameter]):
@@ -25,4 +27,33 @@ def update_results(update_params:list[Parameter], where_params:list[Parameter]):
     where_set = repohelper.get_where(" WHERE 1=1", where_params)
     query += where_set[0]
     param_list.extend(where_set[1])
-    imgdatabase.db_handler.execute_change(query, param_list)
+    unitofwork.execute_change(query, param_list)
+
+
+def delete_results(where_params:list[Parameter]):
+    query, param_list = repohelper.get_where("DELETE FROM Saucenao_Results WHERE 1=1", where_params)
+    unitofwork.execute_change(query, param_list)
+
+
+def get_pending_reviews(threshold:float) -> Iterator[tuple[Image, list[Saucenao_Result]]]:
+    """Streams every fully scanned image along with its results waiting on review at or above the threshold, in one query.
+    Images without any such results still come through with an empty list."""
+    query = """
+        SELECT i.*, r.result_uid, r.site_flag, r.site_id, r.similarity, r.status AS result_status
+        FROM Images i
+        LEFT JOIN Saucenao_Results r ON r.image_uid = i.image_uid AND r.status = 0 AND r.similarity >= ?
+        WHERE i.status = 1
+        ORDER BY i.image_uid, r.result_uid
+    """
+    image:Image = None
+    results:list[Saucenao_Result] = []
+    for dr in imgdatabase.db_handler.execute_stream(query, [threshold]):
+        if image is None or image.image_uid != dr["image_uid"]:
+            if image is not None:
+                yield image, results
+            image, results = Image(dr), []
+        if dr["result_uid"] is not None:
+            results.append(Saucenao_Result({**dict(dr), "status": dr["result_status"]}))
+
+    if image is not None:
+        yield image, results
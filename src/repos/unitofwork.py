@@ -0,0 +1,225 @@
+import time
+import sqlite3
+from collections.abc import Callable
+from contextlib import contextmanager
+from itertools import groupby
+import src.database.imgdatabase as imgdatabase
+import src.metrics as metrics
+import src.saucenaoconfig as saucenaoconfig
+
+config = saucenaoconfig.config
+
+
+class RowId:
+    """Id of a row whose insert is still held by a unit of work. SQLite assigns it when the insert is flushed, until then
+    it can be passed to later writes in place of the id, it's bound as the real one by the time they run."""
+    def __init__(self):
+        self.value:int = None
+
+
+    def __repr__(self):
+        return f"RowId({self.value})"
+
+
+def __adapt_row_id(row_id:RowId) -> int:
+    if row_id.value is None:
+        raise ValueError("Row hasn't been inserted yet")
+    return row_id.value
+
+
+sqlite3.register_adapter(RowId, __adapt_row_id)
+
+
+class _Group:
+    def __init__(self, name:str = None):
+        self.name = name
+        self.writes:list[tuple[str, list, RowId | None]] = []
+        self.after:list[Callable[[], None]] = []
+
+
+class UnitOfWork:
+    """Holds the repos' writes and commits them together, rather than each write being its own commit (and its own fsync).
+
+    Writes are flushed in the order they were made, runs of the same statement going through executemany, all in one
+    transaction. Anything that can't be undone, like removing a file, is held with after_commit() and only done once
+    the writes made before it are committed, so a crash can never leave a file deleted that the DB still needs.
+    Writes can be split into groups (see group(), a scan starts one per file) that each get a savepoint, so a write that
+    fails only takes its own group's writes and after_commit()s with it.
+    """
+    def __init__(self, max_writes:int = None, max_seconds:float = None, clock:Callable[[], float] = time.monotonic,
+                 on_failure:Callable[[str, Exception], None] = None):
+        """
+        Args:
+            max_writes (int, optional): Flush once this many writes are held. Defaults to UOW_FLUSH_WRITES in config.json.
+            max_seconds (float, optional): Flush once the oldest write has been held this long. Defaults to UOW_FLUSH_SECONDS in config.json.
+            clock (optional): Swappable for a fake clock when testing.
+            on_failure (optional): Called with the group's name and the error for every group that couldn't be committed.
+                Without it the first error is raised, once the groups that could be committed are.
+        """
+        self.max_writes = max_writes or config.settings["UOW_FLUSH_WRITES"]
+        self.max_seconds = max_seconds if max_seconds is not None else config.settings["UOW_FLUSH_SECONDS"]
+        self.clock = clock
+        self.on_failure = on_failure
+        self.writes = 0
+        self.commits = 0
+        self.failures = 0
+        self.__groups:list[_Group] = [_Group()]
+        self.__held_writes = 0
+        self.__since:float = None
+
+
+    def __str__(self):
+        return f"Database: {self.writes} writes in {self.commits} commits" + (f", {self.failures} failed" if self.failures else "")
+
+
+    def __hold(self):
+        if self.__since is None:
+            self.__since = self.clock()
+        self.tick()
+
+
+    def tick(self):
+        """Flushes if enough writes are held or the oldest has been held long enough. Checked on every write, and worth
+        calling from a loop that can go a while between them."""
+        if self.__since is None:
+            return
+        if self.__held_writes >= self.max_writes or self.clock() - self.__since >= self.max_seconds:
+            self.flush()
+
+
+    def group(self, name:str):
+        """Writes from here on are committed or rolled back together, apart from the groups before and after."""
+        if any(self.__groups[-1].writes) or any(self.__groups[-1].after):
+            self.__groups.append(_Group(name))
+        else:
+            self.__groups[-1].name = name
+        self.tick()
+
+
+    def add(self, query:str, params = ()):
+        self.__groups[-1].writes.append((query, list(params), None))
+        self.writes += 1
+        self.__held_writes += 1
+        self.__hold()
+
+
+    def insert(self, query:str, params = ()) -> RowId:
+        """Holds an insert, returning the id the row will get once it's flushed."""
+        row_id = RowId()
+        self.__groups[-1].writes.append((query, list(params), row_id))
+        self.writes += 1
+        self.__held_writes += 1
+        self.__hold()
+        return row_id
+
+
+    def after_commit(self, fn:Callable[[], None]):
+        """Runs fn once everything added before it has been committed."""
+        self.__groups[-1].after.append(fn)
+        self.__hold()
+
+
+    def flush(self):
+        groups = self.__groups
+        # Anything added after this is still part of the group that was open, it's just committed separately.
+        self.__groups = [_Group(groups[-1].name)]
+        self.__held_writes = 0
+        self.__since = None
+        failed:list[tuple[_Group, Exception]] = []
+        if any(any(g.writes) for g in groups):
+            with metrics.timed("db_write"), imgdatabase.db_handler.transaction() as conn:
+                for group in groups:
+                    try:
+                        # Nested, so it's a savepoint that's rolled back on its own.
+                        with imgdatabase.db_handler.transaction():
+                            UnitOfWork.__run(conn, group.writes)
+                    except sqlite3.Error as e:
+                        for _, _, row_id in group.writes:
+                            if row_id is not None:
+                                row_id.value = None
+                        failed.append((group, e))
+            self.commits += 1
+
+        for group in groups:
+            if any(group is g for g, _ in failed):
+                continue
+            for fn in group.after:
+                fn()
+
+        self.failures += len(failed)
+        for group, e in failed:
+            if self.on_failure is None:
+                raise e
+            self.on_failure(group.name, e)
+
+
+    @staticmethod
+    def __run(conn:sqlite3.Connection, writes:list[tuple[str, list, RowId | None]]):
+        for (query, inserting), run in groupby(writes, key=lambda w: (w[0], w[2] is not None)):
+            if not inserting:
+                conn.executemany(query, [params for _, params, _ in run])
+                continue
+            # Each one's id is needed, so these go one at a time. Still the same transaction, so it's no extra fsync.
+            for _, params, row_id in run:
+                row_id.value = conn.execute(query, params).lastrowid
+
+
+__active:UnitOfWork = None
+
+
+def active() -> UnitOfWork | None:
+    return __active
+
+
+def execute_change(query:str, params = ()):
+    """Held by the active unit of work if there is one, otherwise committed right away."""
+    if __active is not None:
+        __active.add(query, params)
+    else:
+        imgdatabase.db_handler.execute_change(query, params)
+
+
+def execute_insert(query:str, params = ()) -> int | RowId:
+    """Same as execute_change, returning the new row's id. SQLite assigns it, so it can't run into a row another process
+    added. Held by the active unit of work it's a RowId, see above."""
+    if __active is not None:
+        return __active.insert(query, params)
+    return imgdatabase.db_handler.execute_change(query, params)
+
+
+def after_commit(fn:Callable[[], None]):
+    """Runs fn once the active unit of work has committed what came before it, or right away if there isn't one."""
+    if __active is not None:
+        __active.after_commit(fn)
+    else:
+        fn()
+
+
+def group(name:str):
+    """Starts a new group of writes in the active unit of work if there is one, see UnitOfWork.group."""
+    if __active is not None:
+        __active.group(name)
+
+
+def flush():
+    """Commits whatever the active unit of work holds, i.e. before waiting on something for a while."""
+    if __active is not None:
+        __active.flush()
+
+
+@contextmanager
+def begin(max_writes:int = None, max_seconds:float = None, on_failure:Callable[[str, Exception], None] = None):
+    """Holds the repos' writes for the duration of the block, flushing whatever's left at the end. Writes made before an
+    error are still flushed, they'd have been committed one by one otherwise.
+    NOTE: Meant for the thread running a scan, the buffer isn't locked."""
+    global __active
+    if __active is not None:
+        yield __active
+        return
+
+    __active = UnitOfWork(max_writes, max_seconds, on_failure=on_failure)
+    try:
+        yield __active
+    finally:
+        uow, __active = __active, None
+        uow.flush()
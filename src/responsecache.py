@@ -0,0 +1,24 @@
+import json
+import time
+import zlib
+from collections import OrderedDict
+import src.repos.responserepo as responserepo
+import src.saucenaoconfig as saucenaoconfig
+
+
+def ttl_seconds() -> float:
+    return saucenaoconfig.config.settings["RESPONSE_CACHE_TTL_DAYS"] * 24 * 60 * 60
+
+
+def get(md5:str, dbmask:int, ignore_ttl:bool = False) -> dict[str:any] | None:
+    """Returns the cached response for the file, parsed the same way attempt_send parses a live one. None if there isn't one
+    or it's older than RESPONSE_CACHE_TTL_DAYS."""
+    fetched_after = 0 if ignore_ttl else time.time() - ttl_seconds()
+    response = responserepo.get_response(md5, dbmask, fetched_after)
+    if response is None:
+        return None
+    return json.JSONDecoder(object_pairs_hook=OrderedDict).decode(zlib.decompress(response).decode("utf-8"))
+
+
+def put(md5:str, dbmask:int, data:dict[str:any]):
+    responserepo.upsert_response(md5, dbmask, time.time(), zlib.compress(json.dumps(data).encode("utf-8"), 9))
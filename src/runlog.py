@@ -0,0 +1,186 @@
+import os
+import gzip
+import json
+import time
+import atexit
+import shutil
+import datetime
+import threading
+from collections.abc import Iterator
+import src.saucenaoconfig as saucenaoconfig
+
+config = saucenaoconfig.config
+
+# What each run did to each file, one JSON object per line in a file per run. Records have the time, the action taken and
+# whichever of path, md5, similarity and post_id go with it, plus the message that was printed:
+#   favorited       favorited post_id on Danbooru and removed the file
+#   low_match       result recorded for check-results
+#   no_match        nothing above the low threshold
+#   banned          post_id's artist is banned, file kept
+#   smaller         post_id is smaller than the file, file kept
+#   near_duplicate  looks like an image already matched to post_id, recorded for check-results without a search
+#   invalid_pixiv   named by a Pixiv ID Danbooru doesn't have
+#   rejected        result turned down in check-results
+#   missing         file was already gone by check-results
+#   duplicate       copy of a file already scanned, removed
+#   changed         file changed since it was scanned
+#   info, notice, error   anything else worth keeping
+# Logs are gzipped once they've sat untouched for a day, and only the newest LOG_KEEP of them are kept.
+# Read them back with read() or 'main.py log'.
+
+PREFIX = "saucenao_"
+# Logs this fresh might still be open in another run (i.e. a check-results session left waiting on input), leave them be.
+IDLE_BEFORE_ROTATE = 24 * 60 * 60
+
+
+class RunLog:
+    """Keeps the log file open with writes buffered, flushed every flush_seconds from a background thread, on close() and
+    at exit. Safe to write to from any thread."""
+    def __init__(self, path:str, command:str, flush_seconds:float = None):
+        """
+        Args:
+            path (str): File to append to.
+            command (str): Command the run is for, added to every record.
+            flush_seconds (float, optional): Longest a record sits in the buffer. Defaults to LOG_FLUSH_SECONDS in config.json.
+        """
+        self.path = path
+        self.command = command
+        self.flush_seconds = flush_seconds if flush_seconds is not None else config.settings["LOG_FLUSH_SECONDS"]
+        self.__file = open(path, "a", encoding="utf-8", buffering=64 * 1024)
+        self.__lock = threading.Lock()
+        self.__closed = threading.Event()
+        self.__flusher = threading.Thread(target=self.__flush_every, name="runlog", daemon=True)
+        self.__flusher.start()
+        atexit.register(self.close)
+
+
+    def write(self, action:str, path:str = None, md5:str = None, similarity:float = None, post_id:int = None, message:str = None):
+        record = {"timestamp": datetime.datetime.now().isoformat(timespec="milliseconds"), "command": self.command, "action": action}
+        for key, value in [("path", path), ("md5", md5), ("similarity", similarity), ("post_id", post_id), ("message", message)]:
+            if value is not None:
+                record[key] = value
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self.__lock:
+            if not self.__file.closed:
+                self.__file.write(line)
+
+
+    def flush(self):
+        with self.__lock:
+            if not self.__file.closed:
+                self.__file.flush()
+
+
+    def __flush_every(self):
+        while not self.__closed.wait(self.flush_seconds):
+            self.flush()
+
+
+    def close(self):
+        if self.__closed.is_set():
+            return
+        self.__closed.set()
+        self.__flusher.join()
+        with self.__lock:
+            self.__file.close()
+        atexit.unregister(self.close)
+
+
+def log_dir() -> str:
+    path = os.path.expanduser(config.settings["LOG_DIR"])
+    return os.path.join(path, "TEST") if saucenaoconfig.IS_DEBUG else path
+
+
+def rotate(directory:str, keep:int = None, now:float = None):
+    """Gzips every log that's sat untouched for a day, old plain text .log ones included, then deletes all but the newest
+    keep compressed ones.
+
+    Args:
+        directory (str): Where the logs are.
+        keep (int, optional): Compressed logs to keep. Defaults to LOG_KEEP in config.json.
+        now (float, optional): Swappable for testing.
+    """
+    keep = keep if keep is not None else config.settings["LOG_KEEP"]
+    now = now if now is not None else time.time()
+    for name in os.listdir(directory):
+        full_path = os.path.join(directory, name)
+        if not name.startswith(PREFIX) or not name.endswith((".jsonl", ".log")) or now - os.path.getmtime(full_path) < IDLE_BEFORE_ROTATE:
+            continue
+        with open(full_path, "rb") as source, gzip.open(f"{full_path}.gz", "wb") as target:
+            shutil.copyfileobj(source, target)
+        os.remove(full_path)
+
+    # Names start with the time they were made, so sorting them sorts them by age.
+    compressed = sorted(name for name in os.listdir(directory) if name.startswith(PREFIX) and name.endswith(".gz"))
+    for name in compressed[:max(0, len(compressed) - keep)]:
+        os.remove(os.path.join(directory, name))
+
+
+__active:RunLog = None
+
+
+def start(command:str) -> RunLog:
+    """Starts a new log for the run, rotating the old ones first. Records are only kept between start() and close()."""
+    global __active
+    close()
+    directory = log_dir()
+    os.makedirs(directory, exist_ok=True)
+    rotate(directory)
+    name = f"{PREFIX}{datetime.datetime.now():%Y-%m-%d_%H-%M-%S}_{command}_{os.getpid()}.jsonl"
+    __active = RunLog(os.path.join(directory, name), command)
+    return __active
+
+
+def active() -> RunLog | None:
+    return __active
+
+
+def write(action:str, path:str = None, md5:str = None, similarity:float = None, post_id:int = None, message:str = None):
+    """Adds a record to the run's log, if one was started."""
+    if __active is not None:
+        __active.write(action, path, md5, similarity, post_id, message)
+
+
+def close():
+    global __active
+    if __active is not None:
+        __active.close()
+        __active = None
+
+
+def read(directory:str = None, actions:list[str] = None, path:str = None, md5:str = None, post_id:int = None,
+         since:datetime.datetime = None) -> Iterator[dict]:
+    """Yields the records of every log, oldest first, compressed ones included. Every filter given has to match.
+
+    Args:
+        directory (str, optional): Where the logs are. Defaults to LOG_DIR in config.json.
+        actions (list[str], optional): Only records with one of these actions.
+        path (str, optional): Only records whose path contains this.
+        md5, post_id (optional): Only records for this file or post.
+        since (datetime, optional): Only records from this time on.
+    """
+    directory = directory or log_dir()
+    if not os.path.isdir(directory):
+        return
+    since = since.isoformat() if since is not None else None
+    names = sorted(name for name in os.listdir(directory) if name.startswith(PREFIX) and name.endswith((".jsonl", ".jsonl.gz")))
+    for name in names:
+        full_path = os.path.join(directory, name)
+        with (gzip.open if name.endswith(".gz") else open)(full_path, "rt", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                # The last line of a run that was killed mid write.
+                except json.JSONDecodeError:
+                    continue
+                if actions and not record["action"] in actions:
+                    continue
+                if path is not None and not path in record.get("path", ""):
+                    continue
+                if md5 is not None and record.get("md5") != md5:
+                    continue
+                if post_id is not None and record.get("post_id") != post_id:
+                    continue
+                if since is not None and record["timestamp"] < since:
+                    continue
+                yield record
@@ -1,9 +1,14 @@
 import os
-import io
 import json
-import requests
-from PIL import Image, ImageFile
+from concurrent.futures import Executor
+from requests import Response
 from enum import Enum, IntFlag, auto
+import src.transport as transport
+import src.saucenaoconfig as saucenaoconfig
+import src.thumbnail as thumbnail
+import src.payloadcache as payloadcache
+import src.quotaledger as quotaledger
+from src.ratelimit import QuotaScheduler
 
 
 class API(object):
@@ -58,16 +63,28 @@ class API(object):
         index_mangadex = auto()
 
 
-    def __init__(self, dbmask:int, minsim:int, output_type:Output_Type = Output_Type.json):
+    def __init__(self, dbmask:int, minsim:int, output_type:Output_Type = Output_Type.json, 
+                 http:transport.Transport = None, url:str = None, cache:payloadcache.PayloadCache = None):
+        """
+        Args:
+            dbmask (int): DBMask flags of the indexes to search.
+            minsim (int): Minimum similarity of results to return.
+            output_type (Output_Type, optional): Response format. Defaults to json.
+            http (Transport, optional): Transport to send requests through. Defaults to the shared one.
+            url (str, optional): Search endpoint, swap for a local stand-in when testing. Defaults to SAUCENAO_URL in config.json.
+            cache (PayloadCache, optional): Where built thumbnails are kept by md5. Defaults to the shared one.
+        """
         self.dbmask = dbmask
         self.minsim = minsim
         self.output_type = output_type
+        self.http = http or transport.shared()
+        self.url = url or saucenaoconfig.config.settings["SAUCENAO_URL"]
+        self.cache = cache or payloadcache.shared()
 
 
     # Needs to be set as an environmental variable, set this in your .bashrc, .zshrc, or whatever shell you use on Linux,
     # alternatively for Windows/MacOSX look up how to add environmental variables
     __API_KEY = os.getenv("SAUCENAO_APIKEY")
-    __THUMBSIZE = (250,250)
     __ALLOWED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".bmp"}
     # Why the hell does python not allow you to return an iterable from a property? 
     # This is the one good occasion for a property and I can't even use it.
@@ -75,17 +92,9 @@ class API(object):
         return API.__ALLOWED_EXTENSIONS
 
 
-    def __get_image_data(fname):
+    def __get_image_data(fname, payload:bytes = None):
         """Extracts the image's bytes and adds it as a parameter to be used in the request."""
-        ImageFile.LOAD_TRUNCATED_IMAGES = True
-        with Image.open(fname) as image:
-            image = image.convert('RGB')
-            image.thumbnail(API.__THUMBSIZE, resample=Image.Resampling.LANCZOS)
-            with io.BytesIO() as imageData:
-                image.save(imageData,format='PNG')
-                file = {'file': ("image.png", imageData.getvalue())}
-        
-        return file
+        return {'file': ("image.png", payload or thumbnail.build_payload(fname))}
     
     
     def __set_params(self, params:dict[str:any]) -> dict[str:any]:
@@ -106,17 +115,128 @@ class API(object):
         return json.load(open("saucenao_sample.json"))
 
 
-    def send_request(self, file: str, params: dict[str:any] = {}) -> dict[str:any]:
-        """Sends image to Saucenao's API and returns any matches found in response.
+    def build_request(self, file: str, params: dict[str:any] = {}, payload: bytes = None, md5: str = None) -> tuple[dict, dict]:
+        """Returns the query params and file for a search. Builds the thumbnail if needed, so it can block for a bit.
 
         file: Image file that will be extracted and sent.
         params: Additional parameters to include in search.
+        payload: Thumbnail already built for the file (see thumbnail.py), built on the spot if not given.
+        md5: The file's md5. When given without a payload the thumbnail is looked up in the payload cache, and saved there 
+            if it had to be built. A payload passed in is left to the caller to cache.
         """
-        
-        file = API.__get_image_data(file)
-        params = self.__set_params(params)
+        if md5 is not None and payload is None:
+            payload = self.cache.get_or_build(md5, file)
+
+        return self.__set_params(dict(params)), API.__get_image_data(file, payload)
+
+
+    def send_request(self, file: str, params: dict[str:any] = {}, payload: bytes = None, md5: str = None) -> Response:
+        """Sends image to Saucenao's API and returns any matches found in response. Args are the same as build_request."""
+        params, file = self.build_request(file, params, payload, md5)
+        return self.http.post(self.url, params=params, files=file)
+
+
+class AsyncAPI(API):
+    """asyncio version of API for running lots of searches from one event loop. Requires aiohttp (pip install aiohttp),
+    which the synchronous API doesn't.
+
+    Thumbnails are built on an executor so the loop never blocks on PIL, and every send waits its turn on the 
+    QuotaScheduler the same way a scan does. Every response is recorded in the Quota_Ledger like attempt_send does, so 
+    searches made from here count towards updateschedule.next_run and the next scan's quota.
+    Point url at a local server to test against a stand-in, see tests/test_async_api.py.
+    """
+    def __init__(self, dbmask:int, minsim:int, output_type:API.Output_Type = API.Output_Type.json, url:str = None, 
+                 cache:payloadcache.PayloadCache = None, scheduler:QuotaScheduler = None, session = None, executor:Executor = None):
+        """
+        Args:
+            dbmask, minsim, output_type, url, cache: Same as API.
+            scheduler (QuotaScheduler, optional): Paces sends and is updated from each response. Share it between every
+                client using the same API key. Defaults to a new one seeded from the Quota_Ledger.
+            session (aiohttp.ClientSession, optional): Session to send requests through, created on first use if not given.
+            executor (Executor, optional): Where thumbnails are built. Defaults to the loop's default thread pool.
+        """
+        super().__init__(dbmask, minsim, output_type, url=url, cache=cache)
+        if scheduler is None:
+            scheduler = QuotaScheduler()
+            quotaledger.seed(scheduler)
+        self.scheduler = scheduler
+        self.executor = executor
+        self.__session = session
+        self.__owns_session = session is None
+
+
+    async def __aenter__(self):
+        return self
+
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+
+    async def close(self):
+        if self.__owns_session and self.__session is not None:
+            await self.__session.close()
+            self.__session = None
+
+
+    def __get_session(self):
+        if self.__session is None:
+            import aiohttp
+            config = saucenaoconfig.config.settings
+            self.__session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(
+                sock_connect=config["HTTP_CONNECT_TIMEOUT"], sock_read=config["HTTP_READ_TIMEOUT"]
+            ))
+        return self.__session
+
+
+    async def send_request(self, file: str, params: dict[str:any] = {}, payload: bytes = None, md5: str = None) -> list["Result"]:
+        """Searches Saucenao for the image and returns the results. Args are the same as API.build_request.
+
+        Server errors (500/521) are retried with the scheduler's backoff, a bad API key or running out of searches raises.
+        """
+        import asyncio
+        loop = asyncio.get_running_loop()
+        params, file = await loop.run_in_executor(self.executor, self.build_request, file, params, payload, md5)
+        # aiohttp won't send a None param where requests would just leave it off (i.e. no API key set).
+        params = {k: v for k, v in params.items() if v is not None}
+
+        attempt = 0
+        while True:
+            if not self.scheduler.can_continue():
+                raise Exception("Out of daily searches. Try again later.")
+            delay = self.scheduler.reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            attempt += 1
+            status, reason, text = await self.__post(params, file)
+            data = json.loads(text) if status == 200 else None
+            # SQLite write, kept off the loop like the thumbnail.
+            await loop.run_in_executor(self.executor, quotaledger.record, status, data["header"] if data else None)
+            match status:
+                case 200:
+                    self.scheduler.update(data["header"])
+                    return [Result(self.dbmask, r) for r in data.get("results", [])]
+                case 403:
+                    raise Exception("Incorrect or Invalid API Key!")
+                case 429:
+                    raise Exception("Out of daily searches. Try again later.")
+                case 500 | 521:
+                    delay = self.scheduler.backoff(attempt)
+                    if delay is None:
+                        raise Exception(f"Status Code: {status}\nMessage: {reason}")
+                    await asyncio.sleep(delay)
+                case _:
+                    raise Exception(f"Status Code: {status}\nMessage: {reason}")
+
 
-        return requests.post("http://saucenao.com/search.php", params=params, files=file)
+    async def __post(self, params:dict, file:dict) -> tuple[int, str, str]:
+        import aiohttp
+        name, data = file["file"]
+        form = aiohttp.FormData()
+        form.add_field("file", data, filename=name)
+        async with self.__get_session().post(self.url, params=params, data=form) as response:
+            return response.status, response.reason, await response.text()
 
 
 class Result:
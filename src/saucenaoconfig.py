@@ -8,6 +8,40 @@ IS_DEBUG = hasattr(sys, 'gettrace') and sys.gettrace() is not None
 
 class __config:
     __CONFIG_FILE="./config.json"
+    __DEFAULTS = {
+        "DEFAULT_BROWSER": "firefox",
+        "IMG_DATABASE": "./saucenaoDB.db",
+        "TEST_IMG_DATABASE": "./saucenaoDB_TEST.db",
+        "HIGH_THRESHOLD": 92.0,
+        "LOW_THRESHOLD": 65.0,
+        "BLACKLISTED_TERMS": [ " [AI]", " [NoScan]" ],
+        "HASH_WORKERS": 4,
+        "HASH_CHUNK_SIZE_KB": 1024,
+        "DANBOORU_REQUESTS_PER_SECOND": 10,
+        "MIN_SEARCHES_PER_RUN": 25,
+        "SAUCENAO_URL": "http://saucenao.com/search.php",
+        "HTTP_CONNECT_TIMEOUT": 10,
+        "HTTP_READ_TIMEOUT": 60,
+        "HTTP_RETRIES": 2,
+        "HTTP_POOL_SIZE": 10,
+        "THUMBNAIL_WORKERS": 2,
+        "THUMBNAIL_PREFETCH": 8,
+        "THUMBNAIL_CACHE": "./thumbnailcache.db",
+        "THUMBNAIL_CACHE_MB": 64,
+        "PHASH_MAX_DISTANCE": 6,
+        "RESPONSE_CACHE_TTL_DAYS": 30,
+        "PIPELINE_QUEUE_SIZE": 16,
+        "POST_CACHE_SIZE": 1024,
+        "POST_CACHE_TTL_DAYS": 7,
+        "REVIEW_PREFETCH": 3,
+        "UOW_FLUSH_WRITES": 100,
+        "UOW_FLUSH_SECONDS": 5,
+        "METRICS_FILE": "./saucenao_metrics.json",
+        "METRICS_TEXTFILE": "./saucenao_metrics.prom",
+        "LOG_DIR": "~/_saucenao_logs/",
+        "LOG_FLUSH_SECONDS": 5,
+        "LOG_KEEP": 60
+    }
 
     def __init__(self):
         self.settings = {}
@@ -17,17 +51,11 @@ class __config:
     def load_config(self):
         # If there's no default config file, create it.
         if not os.path.exists(self.__CONFIG_FILE):
-            self.settings = {
-                "DEFAULT_BROWSER": "firefox",
-                "IMG_DATABASE": "./saucenaoDB.db",
-                "TEST_IMG_DATABASE": "./saucenaoDB_TEST.db",
-                "HIGH_THRESHOLD": 92.0,
-                "LOW_THRESHOLD": 65.0,
-                "BLACKLISTED_TERMS": [ " [AI]", " [NoScan]" ]
-            }
+            self.settings = dict(self.__DEFAULTS)
             json.dump(self.settings, open(self.__CONFIG_FILE, "w"), ensure_ascii=False, indent=4)
         else:
-            self.settings = json.load(open(self.__CONFIG_FILE))
+            # Settings added since the config file was created fall back to their defaults.
+            self.settings = {**self.__DEFAULTS, **json.load(open(self.__CONFIG_FILE))}
             
 
 config = __config()
\ No newline at end of file
@@ -0,0 +1,209 @@
+import os
+import threading
+import src.repos.imagerepo as imagerepo
+import src.repos.unitofwork as unitofwork
+from src.database.imgdatabase import Parameter
+from src.modules.imgmodule import Image
+
+
+class ScanIndex:
+    """In-memory copy of the Images table used for the duration of a scan.
+
+    The table is loaded once and every insert/update/delete made through the index is written through to the
+    database, so lookups during the scan are dictionary hits rather than a SELECT per file.
+    Lookups are safe from any thread, the scan's pipeline stages read it while the scan thread writes. Every lookup and every
+    change to the dicts, or to an image in them, holds the same lock, so a reader never sees a move half done.
+    NOTE: Writes are still expected to come from the thread running the scan. A new image held by a unit of work has a RowId 
+    for its image_uid until it's flushed, see unitofwork.py.
+    """
+    def __init__(self):
+        self.__by_path:dict[str, Image] = {}
+        self.__by_md5:dict[str, Image] = {}
+        self.__by_uid:dict[int, Image] = {}
+        self.__by_inode:dict[int, Image] = {}
+        # Reentrant since check_existing_file moves images while holding it.
+        self.__lock = threading.RLock()
+        self.load()
+
+
+    def load(self):
+        images = imagerepo.get_images()
+        with self.__lock:
+            self.__by_path.clear()
+            self.__by_md5.clear()
+            self.__by_uid.clear()
+            self.__by_inode.clear()
+            for image in images:
+                self.__cache(image)
+
+
+    def __cache(self, image:Image):
+        self.__by_path[image.full_path] = image
+        self.__by_md5[image.md5] = image
+        self.__by_uid[image.image_uid] = image
+        if image.inode is not None:
+            self.__by_inode[image.inode] = image
+
+
+    def __uncache(self, image:Image):
+        self.__by_path.pop(image.full_path, None)
+        self.__by_md5.pop(image.md5, None)
+        self.__by_uid.pop(image.image_uid, None)
+        if self.__by_inode.get(image.inode) is image:
+            del self.__by_inode[image.inode]
+
+
+    def __len__(self):
+        with self.__lock:
+            return len(self.__by_path)
+
+
+    def get_by_path(self, full_path:str) -> Image | None:
+        with self.__lock:
+            return self.__by_path.get(full_path)
+
+
+    def get_by_md5(self, md5:str) -> Image | None:
+        with self.__lock:
+            return self.__by_md5.get(md5)
+
+
+    def has_status(self, full_path:str, statuses:list[int]) -> bool:
+        with self.__lock:
+            image = self.__by_path.get(full_path)
+            return image is not None and image.status in statuses
+
+
+    def cached_md5(self, full_path:str, stat:os.stat_result) -> str | None:
+        """Returns the recorded md5 if the file's fingerprint shows it hasn't changed, so it doesn't need to be read.
+        A file at a new path is matched by its inode, which covers moves and renames."""
+        with self.__lock:
+            image = self.__by_path.get(full_path)
+            if image is None:
+                image = self.__by_inode.get(stat.st_ino)
+                if image is None or not imagerepo.was_moved(image, stat):
+                    return None
+            return image.md5 if imagerepo.fingerprint_matches(image, stat) else None
+
+
+    def record_fingerprint(self, full_path:str, md5:str, stat:os.stat_result) -> bool:
+        """Backfills or refreshes the fingerprint of a file that had to be hashed. A file whose md5 changed was edited in place,
+        its record is updated to the new contents, or dropped if they're a copy of another image's (is_existing settles that
+        one). Returns True if the md5 changed, whatever was looked up for the old contents doesn't hold for the new."""
+        with self.__lock:
+            image = self.__by_path.get(full_path)
+            if image is None or (image.md5 == md5 and imagerepo.fingerprint_matches(image, stat)):
+                return False
+            holder = self.__by_md5.get(md5)
+
+        if image.md5 == md5:
+            imagerepo.update_fingerprint(image.image_uid, full_path, stat)
+            with self.__lock:
+                self.__uncache(image)
+                image.size, image.mtime_ns, image.inode = imagerepo.get_fingerprint(full_path, stat)
+                self.__cache(image)
+            return False
+
+        if holder is not None:
+            self.delete_image(image.image_uid)
+        else:
+            self.update_contents(image, md5, stat)
+        return True
+
+
+    def update_contents(self, image:Image, md5:str, stat:os.stat_result = None, status:imagerepo.image_scan_status = None):
+        """Records new contents for a file edited in place, keeping its image_uid. The perceptual hash was of the old contents."""
+        size, mtime_ns, inode = imagerepo.get_fingerprint(image.full_path, stat)
+        params = [Parameter("md5", md5), Parameter("size", size), Parameter("mtime_ns", mtime_ns), Parameter("inode", inode), 
+                  Parameter("phash", None)]
+        if status is not None:
+            params.append(Parameter("status", status))
+        imagerepo.update_image(update_params=params, where_params=[Parameter("image_uid", image.image_uid)])
+        with self.__lock:
+            self.__uncache(image)
+            image.md5, image.size, image.mtime_ns, image.inode, image.phash = md5, size, mtime_ns, inode, None
+            if status is not None:
+                image.status = int(status)
+            self.__cache(image)
+
+
+    def insert_image(self, full_path:str, md5:str, status:imagerepo.image_scan_status = imagerepo.image_scan_status.full_scan, 
+                     stat:os.stat_result = None) -> int | unitofwork.RowId:
+        image_uid = imagerepo.insert_image(full_path, md5, status, stat)
+        file_name, ext = os.path.splitext(os.path.basename(full_path))
+        size, mtime_ns, inode = imagerepo.get_fingerprint(full_path, stat)
+        image = Image({
+            "image_uid": image_uid,
+            "file_name": file_name,
+            "full_path": full_path,
+            "ext": ext,
+            "md5": md5,
+            "status": int(status),
+            "size": size,
+            "mtime_ns": mtime_ns,
+            "inode": inode,
+            "phash": None,
+        })
+        with self.__lock:
+            self.__cache(image)
+        return image_uid
+
+
+    def update_status(self, image:Image, status:imagerepo.image_scan_status):
+        imagerepo.update_image(
+            update_params=[Parameter("status", status)],
+            where_params=[Parameter("image_uid", image.image_uid)]
+        )
+        with self.__lock:
+            image.status = int(status)
+
+
+    def update_phash(self, image_uid:int, phash:str):
+        imagerepo.update_image(
+            update_params=[Parameter("phash", phash)],
+            where_params=[Parameter("image_uid", image_uid)]
+        )
+        with self.__lock:
+            image = self.__by_uid.get(image_uid)
+            if image is not None:
+                image.phash = phash
+
+
+    def move_image(self, image:Image, full_path:str):
+        file_name = os.path.splitext(os.path.basename(full_path))[0]
+        imagerepo.update_image(
+            update_params=[Parameter("file_name", file_name), Parameter("full_path", full_path)],
+            where_params=[Parameter("image_uid", image.image_uid)]
+        )
+        with self.__lock:
+            self.__uncache(image)
+            image.file_name = file_name
+            image.full_path = full_path
+            self.__cache(image)
+
+
+    def delete_image(self, image_uid:int):
+        imagerepo.delete_image(image_uid)
+        with self.__lock:
+            image = self.__by_uid.get(image_uid)
+            if image is not None:
+                self.__uncache(image)
+
+
+    def check_existing_file(self, full_path:str, md5:str, stat:os.stat_result = None):
+        """Checks the md5 against the index to tell if the file has been moved, renamed, or is a duplicate. A move is recorded."""
+        response = {"status": imagerepo.file_status.OK, "msg": None}
+        image = self.get_by_md5(md5)
+        # If the file doesn't match the full path then either it's been changed or is a dupe
+        if image is not None and full_path != image.full_path:
+            # Original still exists confirming this is a dupe. The fingerprint settles most moves without having to check.
+            if not imagerepo.was_moved(image, stat) and os.path.exists(image.full_path):
+                response["status"] = imagerepo.file_status.Duplicate
+                response["msg"] = f"{full_path} is a duplicate file. File with same MD5 already exists: {image.full_path}"
+            # Otherwise the file has been moved or renamed, update the database to reflect.
+            else:
+                response["status"] = imagerepo.file_status.Changed
+                response["msg"] = f"""File has been moved/renamed.\nOriginal Path: {image.full_path}\n     New Path: {full_path}"""
+                self.move_image(image, full_path)
+
+        return response
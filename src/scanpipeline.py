@@ -0,0 +1,189 @@
+import time
+import queue
+import threading
+from collections.abc import Callable, Iterable, Iterator
+
+# Runs the stages of a scan on their own threads with a bounded queue between each, so the slow parts (hashing,
+# Danbooru lookups, thumbnails) keep working ahead while the last stage waits on the Saucenao rate limit.
+# Items go through every stage in order and come out in the order they went in.
+
+# Marks the end of the stream, also passed along when a stage fails so everything after it winds down.
+END_OF_STREAM = object()
+# How often a blocked stage checks if the pipeline was closed.
+POLL_INTERVAL = 0.1
+
+
+class StageStats:
+    def __init__(self, name:str, depth:int):
+        self.name = name
+        self.depth = depth
+        self.items = 0
+        self.seconds = 0.0
+        self.peak = 0
+        self.__queue:queue.Queue = None
+
+
+    @property
+    def queued(self) -> int:
+        """Items done by this stage that the next one hasn't picked up yet."""
+        return self.__queue.qsize() if self.__queue is not None else 0
+
+
+    @property
+    def per_sec(self) -> float:
+        return self.items / self.seconds if self.seconds > 0 else 0.0
+
+
+    def watch(self, out:queue.Queue):
+        self.__queue = out
+
+
+    def __str__(self):
+        return f"{self.name:<10}{self.items:>6} items {self.per_sec:>9.1f}/s busy   queue {self.queued}/{self.depth} (peak {self.peak})"
+
+
+class PipelineStats:
+    def __init__(self):
+        self.stages:list[StageStats] = []
+        self.started = time.perf_counter()
+        self.taken = 0
+
+
+    def __str__(self):
+        elapsed = time.perf_counter() - self.started
+        lines = [str(s) for s in self.stages]
+        lines.append(f"{'final':<10}{self.taken:>6} items {(self.taken / elapsed if elapsed > 0 else 0):>9.1f}/s overall")
+        return "\n".join(lines)
+
+
+class Pipeline:
+    """Feeds items from source through each stage and hands them back when iterated.
+
+    The source is consumed on its own thread, then each stage function is called on its own thread with the item and
+    whatever it returns is passed on. Whoever iterates the pipeline is the final stage, so anything that has to happen
+    in order or on one thread (DB writes, output) belongs there rather than in a stage.
+    """
+    def __init__(self, source:Iterable, depth:int = 16):
+        """
+        Args:
+            source (Iterable): Items to feed in, iterated on the first stage's thread.
+            depth (int, optional): How many items the source can get ahead of the next stage. Defaults to 16.
+        """
+        self.stats = PipelineStats()
+        self.error:BaseException = None
+        self.__closed = threading.Event()
+        self.__threads:list[threading.Thread] = []
+        self.__queues:list[queue.Queue] = []
+        self.__started = False
+        self.__add(self.__run_source, "source", depth, source)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def stage(self, name:str, fn:Callable[[any], any], depth:int = 16) -> "Pipeline":
+        """Adds a stage after the last one. depth is how many of its results can wait on the next stage."""
+        if self.__started:
+            raise Exception("Can't add stages to a pipeline that's already running.")
+        self.__add(self.__run_stage, name, depth, self.__queues[-1], fn)
+        return self
+
+
+    def __add(self, target, name:str, depth:int, *args):
+        stats = StageStats(name, max(1, depth))
+        out = queue.Queue(maxsize=stats.depth)
+        stats.watch(out)
+        self.stats.stages.append(stats)
+        self.__queues.append(out)
+        self.__threads.append(threading.Thread(target=target, args=(*args, out, stats), name=f"pipeline-{name}", daemon=True))
+
+
+    def __put(self, out:queue.Queue, item, stats:StageStats = None) -> bool:
+        while not self.__closed.is_set():
+            try:
+                out.put(item, timeout=POLL_INTERVAL)
+                if stats is not None:
+                    stats.peak = max(stats.peak, out.qsize())
+                return True
+            except queue.Full:
+                continue
+        return False
+
+
+    def __get(self, source:queue.Queue):
+        while not self.__closed.is_set():
+            try:
+                return source.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                continue
+        return END_OF_STREAM
+
+
+    def __run_source(self, source:Iterable, out:queue.Queue, stats:StageStats):
+        iterator = iter(source)
+        try:
+            while not self.__closed.is_set():
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                stats.seconds += time.perf_counter() - start
+                stats.items += 1
+                if not self.__put(out, item, stats):
+                    break
+        except BaseException as e:
+            self.error = e
+        finally:
+            # Lets a generator source clean up (i.e. the hasher cancelling what it had queued) on this thread.
+            if hasattr(iterator, "close"):
+                iterator.close()
+            self.__put(out, END_OF_STREAM)
+
+
+    def __run_stage(self, source:queue.Queue, fn:Callable, out:queue.Queue, stats:StageStats):
+        try:
+            while True:
+                item = self.__get(source)
+                if item is END_OF_STREAM:
+                    break
+                start = time.perf_counter()
+                result = fn(item)
+                stats.seconds += time.perf_counter() - start
+                stats.items += 1
+                if not self.__put(out, result, stats):
+                    break
+        except BaseException as e:
+            self.error = e
+        finally:
+            self.__put(out, END_OF_STREAM)
+
+
+    def __iter__(self) -> Iterator:
+        if not self.__started:
+            self.__started = True
+            self.stats.started = time.perf_counter()
+            for thread in self.__threads:
+                thread.start()
+
+        while True:
+            item = self.__get(self.__queues[-1])
+            if item is END_OF_STREAM:
+                if self.error is not None:
+                    raise self.error
+                return
+            self.stats.taken += 1
+            yield item
+
+
+    def close(self):
+        """Stops every stage. Safe to call early, i.e. when the final stage runs out of searches."""
+        self.__closed.set()
+        for thread in self.__threads:
+            if thread.is_alive():
+                thread.join()
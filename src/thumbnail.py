@@ -0,0 +1,54 @@
+import io
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, Future
+from PIL import Image, ImageFile
+
+
+THUMBSIZE = (250,250)
+
+
+def build_payload(full_path:str, size:tuple[int, int] = THUMBSIZE) -> bytes:
+    """Scales the image down and encodes it as the PNG that gets uploaded to Saucenao."""
+    ImageFile.LOAD_TRUNCATED_IMAGES = True
+    with Image.open(full_path) as image:
+        # JPEGs can be decoded straight to 1/2, 1/4 or 1/8 scale, which skips most of the decode work on a big photo
+        # since it all gets thrown away by the thumbnail anyway. Draft never goes below the requested size. No-op for other formats.
+        image.draft("RGB", size)
+        image = image.convert("RGB")
+        image.thumbnail(size, resample=Image.Resampling.LANCZOS)
+        with io.BytesIO() as imageData:
+            image.save(imageData, format="PNG")
+            return imageData.getvalue()
+
+
+class ThumbnailPrefetcher:
+    """Builds upload payloads in a process pool ahead of when they're needed. submit() a file and hold on to the future,
+    the payload's ready by the time the Saucenao rate limit lets the next search through.
+
+    Workers are spawned rather than forked, forking a process that already has threads and open SQLite connections can
+    deadlock the child. They're started up front too, so create this before the scan starts any threads of its own.
+    """
+    def __init__(self, workers:int = 2):
+        workers = max(1, workers)
+        self.__pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        # The pool only starts a worker when it's handed work, so hand every worker something.
+        for future in [self.__pool.submit(os.getpid) for _ in range(workers)]:
+            future.result()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def close(self):
+        self.__pool.shutdown(cancel_futures=True)
+
+
+    def submit(self, full_path:str) -> Future:
+        """Starts building the payload, the caller keeps track of the future."""
+        return self.__pool.submit(build_payload, full_path)
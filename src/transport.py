@@ -0,0 +1,104 @@
+import requests
+from collections.abc import Callable
+from requests import Response
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+import src.saucenaoconfig as saucenaoconfig
+
+config = saucenaoconfig.config
+
+
+class TimeoutAdapter(HTTPAdapter):
+    """Pooled adapter that gives every request without a timeout of its own this one. The timeout lives here rather than in
+    Transport.request so clients that only borrow the session (see attach()) get it too."""
+    def __init__(self, timeout:tuple[float, float], pool_size:int):
+        self.timeout = timeout
+        super().__init__(pool_connections=pool_size, pool_maxsize=pool_size)
+
+
+    def send(self, request, timeout = None, **kwargs) -> Response:
+        return super().send(request, timeout=timeout if timeout is not None else self.timeout, **kwargs)
+
+
+def connect_failed(e:requests.RequestException) -> bool:
+    """Whether the request never reached the server, i.e. it's safe to send again."""
+    if isinstance(e, requests.ConnectTimeout):
+        return True
+    # requests hides urllib3's error as the reason of the MaxRetryError it wraps.
+    reason = getattr(e.args[0], "reason", None) if any(e.args) else None
+    return isinstance(reason, NewConnectionError)
+
+
+class Transport:
+    """Persistent HTTP session shared by the API clients.
+
+    Connections are pooled and kept alive between requests, and every request through the session gets a connect and
+    read timeout so a hung socket can't stall a cron run forever.
+    """
+    def __init__(self, connect_timeout:float = 10, read_timeout:float = 60, retries:int = 2, pool_size:int = 10, 
+                 session:requests.Session = None):
+        """
+        Args:
+            connect_timeout (float, optional): Seconds to wait for a connection.
+            read_timeout (float, optional): Seconds to wait between bytes of the response.
+            retries (int, optional): Times to retry a request that couldn't connect.
+            pool_size (int, optional): Connections kept open per host, should be at least the number of threads sharing it.
+            session (requests.Session, optional): Session to use instead of a new one.
+        """
+        self.session = session or requests.Session()
+        self.timeout = (connect_timeout, read_timeout)
+        adapter = TimeoutAdapter(self.timeout, pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.retries = retries
+        self.retry_hooks:list[Callable[[int, Exception], None]] = []
+
+
+    def add_retry_hook(self, hook:Callable[[int, Exception], None]):
+        """Hook is called with the attempt number and the error before each retry. Adding the same hook twice does nothing."""
+        if not hook in self.retry_hooks:
+            self.retry_hooks.append(hook)
+
+
+    def request(self, method:str, url:str, **kwargs) -> Response:
+        attempt = 0
+        while True:
+            try:
+                return self.session.request(method, url, **kwargs)
+            # Only retry when the connection couldn't be made. Anything later (a read timeout, a reset once the body was
+            # sent) means the server may already have the request, and for SauceNAO sending it again would spend a second search.
+            except requests.ConnectionError as e:
+                if not connect_failed(e) or attempt >= self.retries:
+                    raise
+                attempt += 1
+                for hook in self.retry_hooks:
+                    hook(attempt, e)
+
+
+    def get(self, url:str, **kwargs) -> Response:
+        return self.request("GET", url, **kwargs)
+
+
+    def post(self, url:str, **kwargs) -> Response:
+        return self.request("POST", url, **kwargs)
+
+
+    def attach(self, client) -> bool:
+        """Has another API client send its requests through this transport's session, if it keeps its own session around to swap.
+        The client gets the pooling and timeouts but not the retries, those are only in request()."""
+        if not hasattr(client, "session"):
+            return False
+        client.session = self.session
+        return True
+
+
+__shared:Transport = None
+
+
+def shared() -> Transport:
+    """Transport used by every client in the app unless one is handed its own."""
+    global __shared
+    if __shared is None:
+        __shared = Transport(config.settings["HTTP_CONNECT_TIMEOUT"], config.settings["HTTP_READ_TIMEOUT"], 
+                             config.settings["HTTP_RETRIES"], config.settings["HTTP_POOL_SIZE"])
+    return __shared
@@ -1,24 +1,27 @@
 import os
-import datetime
 import re
 from crontab import CronTab
+import src.quotaledger as quotaledger
+import src.metrics as metrics
 
 
-def format_command(directory:str):
-    return f"cd {os.getcwd()} ; python -u main.py scan {directory} -r -s"
+def format_command(directory:str, profile:bool = False):
+    return f"cd {os.getcwd()} ; python -u main.py scan {directory} -r -s{' --profile' if profile else ''}"
 
 
 def update_crontab_job(directory:str):
-    """Set the crontab job to a new time to help with running the next job."""
+    """Set the crontab job to the next time enough of the daily quota will have refilled to be worth running."""
     dirct = re.escape(directory)
-    time = datetime.datetime.now()
+    time = quotaledger.next_run()
     sauce_cron = CronTab(user='afrodown')
     jobs = sauce_cron.find_comment('saucenao task')
+    # A run with --profile keeps profiling the runs it schedules, so they keep showing up on the dashboards.
+    profile = metrics.active() is not None
     for job in jobs:
         # Yes, adding that space is important. Othewise could be determined to be part of a path rather than the complete path
         # i.e. "/path/ab" would be in "/path/ab/cd", but that space would throw it off (and spaces in a path must be escaped)
-        if not dirct+" " in job.command:
-            job.command = format_command(dirct) 
+        if not dirct+" " in job.command or profile != job.command.endswith(" --profile"):
+            job.command = format_command(dirct, profile) 
         job.setall(time.minute, time.hour)
         sauce_cron.write()
 
@@ -0,0 +1,100 @@
+# src.saucenaoconfig writes config.json to the working directory the moment it's imported and everything else (DBs, logs,
+# caches) goes by it, so the tests run from a scratch directory with a config of their own. That has to happen before 
+# anything imports src, which is why it's up here rather than in a fixture.
+import os
+import sys
+import json
+import tempfile
+import types
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix="saucenao_tests_")
+sys.path.insert(0, ROOT)
+os.chdir(WORKDIR)
+with open(os.path.join(WORKDIR, "config.json"), "w") as f:
+    json.dump({"LOG_DIR": os.path.join(WORKDIR, "logs"), "DANBOORU_REQUESTS_PER_SECOND": 1000}, f)
+
+import src.database.imgdatabase as imgdatabase
+
+
+class FakeClock:
+    """Stands in for time.monotonic and time.sleep, sleeping just moves the clock forward."""
+    def __init__(self, now:float = 1000.0):
+        self.now = now
+        self.slept:list[float] = []
+
+
+    def __call__(self) -> float:
+        return self.now
+
+
+    def sleep(self, seconds:float):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class StubDanbooru:
+    """Stand-in for danbooru.API. Knows the posts it's given by md5 and Pixiv ID, and records every call."""
+    def __init__(self, posts_by_md5:dict[str, list[dict]] = None, pixiv_ids:set[str] = ()):
+        self.posts_by_md5 = posts_by_md5 or {}
+        self.pixiv_ids = set(pixiv_ids)
+        self.calls:list[tuple[str, any]] = []
+        self.favorites:list[int] = []
+        # The real client keeps its requests.Session here, which danclient swaps for the app's.
+        self.session = None
+
+
+    def get_posts(self, params:dict) -> list[dict]:
+        self.calls.append(("get_posts", params["tags"]))
+        kind, _, values = params["tags"].partition(":")
+        values = values.split(",")
+        if kind == "md5":
+            return [post for md5 in values for post in self.posts_by_md5.get(md5, [])]
+        if kind == "pixiv":
+            return [{"id": 1, "is_banned": False}] if values[0] in self.pixiv_ids else []
+        if kind == "id":
+            return [self.post(int(post_id)) for post_id in values]
+        return []
+
+
+    def get_post(self, post_id:int) -> dict:
+        self.calls.append(("get_post", post_id))
+        return self.post(post_id)
+
+
+    def post(self, post_id:int) -> dict:
+        return {"id": post_id, "is_banned": False, "image_width": 4000, "image_height": 4000}
+
+
+    def add_favorite(self, post_id:int):
+        self.calls.append(("add_favorite", post_id))
+        self.favorites.append(post_id)
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
+
+
+@pytest.fixture
+def danbooru_module(monkeypatch) -> types.ModuleType:
+    """A `danbooru` module whose API is StubDanbooru, in place of the real package danclient imports."""
+    module = types.ModuleType("danbooru")
+    module.API = StubDanbooru
+    monkeypatch.setitem(sys.modules, "danbooru", module)
+    return module
+
+
+@pytest.fixture
+def database(tmp_path):
+    """A fresh, migrated database in place of the app's for the length of the test."""
+    previous = imgdatabase.__dict__.get("db_handler")
+    handler = getattr(imgdatabase, "__database")(str(tmp_path / "test.db"))
+    imgdatabase.db_handler = handler
+    yield handler
+    handler.close()
+    if previous is None:
+        del imgdatabase.db_handler
+    else:
+        imgdatabase.db_handler = previous
@@ -0,0 +1,99 @@
+import time
+import json
+import asyncio
+import pytest
+
+aiohttp = pytest.importorskip("aiohttp")
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+import src.saucenao as saucenao
+import src.repos.quotarepo as quotarepo
+from src.ratelimit import QuotaScheduler
+
+DANBOORU = int(saucenao.API.DBMask.index_danbooru)
+
+
+def header(long_remaining:int) -> dict:
+    return {"short_limit": "4", "short_remaining": 3, "long_limit": "100", "long_remaining": long_remaining, "results_returned": 1}
+
+
+def response(long_remaining:int, dan_id:int = 1234) -> dict:
+    return {"header": header(long_remaining), "results": [{
+        "header": {"similarity": "95.00", "thumbnail": "", "index_id": 9, "index_name": "Index #9", "dupes": 0, "hidden": 0},
+        "data": {"ext_urls": [], "danbooru_id": dan_id},
+    }]}
+
+
+class SauceStandIn:
+    """Local async SauceNAO, answering each search with the next (status, body) it was scripted with."""
+    def __init__(self, script:list[tuple[int, dict]]):
+        self.script = list(script)
+        self.requests:list[dict] = []
+        self.app = web.Application()
+        self.app.router.add_post("/search.php", self.search)
+
+
+    async def search(self, request:web.Request) -> web.Response:
+        form = await request.post()
+        self.requests.append({"query": dict(request.query), "file": form["file"].file.read()})
+        status, body = self.script.pop(0)
+        return web.Response(status=status, text=json.dumps(body), content_type="application/json")
+
+
+def run(script:list[tuple[int, dict]], searches:int = 1, scheduler:QuotaScheduler = None):
+    """Runs that many searches against a stand-in playing the script. Returns the results or the error, and the stand-in."""
+    stand_in = SauceStandIn(script)
+
+    async def main():
+        server = TestServer(stand_in.app)
+        await server.start_server()
+        try:
+            async with saucenao.AsyncAPI(DANBOORU, 50, url=str(server.make_url("/search.php")), scheduler=scheduler) as api:
+                return [await api.send_request("image.png", payload=b"thumbnail") for _ in range(searches)]
+        except Exception as e:
+            return e
+        finally:
+            await server.close()
+
+    return asyncio.run(main()), stand_in
+
+
+def ledger() -> list[tuple[int, int]]:
+    return [(e.status_code, e.long_remaining) for e in quotarepo.get_entries()]
+
+
+def test_search_returns_results_and_records_the_quota(database):
+    results, stand_in = run([(200, response(99))])
+    assert [r.data.dan_id for r in results[0]] == [1234]
+    assert stand_in.requests[0]["file"] == b"thumbnail"
+    assert stand_in.requests[0]["query"]["dbmask"] == str(DANBOORU)
+    assert ledger() == [(200, 99)]
+
+
+def test_server_errors_are_retried_with_backoff(database):
+    scheduler = QuotaScheduler(base_backoff=0.01, jitter=lambda: 0)
+    results, stand_in = run([(500, {}), (521, {}), (200, response(97))], scheduler=scheduler)
+    assert len(results[0]) == 1
+    assert len(stand_in.requests) == 3
+    assert ledger() == [(500, None), (521, None), (200, 97)]
+
+
+def test_gives_up_after_max_attempts(database):
+    scheduler = QuotaScheduler(max_attempts=2, base_backoff=0.01)
+    error, _ = run([(500, {}), (500, {})], scheduler=scheduler)
+    assert "500" in str(error)
+    assert ledger() == [(500, None), (500, None)]
+
+
+def test_out_of_searches_raises_and_is_recorded(database):
+    error, _ = run([(429, {})])
+    assert "Out of daily searches" in str(error)
+    assert ledger() == [(429, None)]
+
+
+def test_scheduler_is_seeded_from_the_ledger(database):
+    # A scan already used up the day's searches, the async client mustn't send any.
+    quotarepo.insert_entry(time.time(), 200, header(0))
+    error, stand_in = run([(200, response(0))])
+    assert "Out of daily searches" in str(error)
+    assert stand_in.requests == []
@@ -0,0 +1,141 @@
+import os
+import hashlib
+import threading
+import pytest
+from PIL import Image
+import src.danclient as danclient
+import src.transport as transport
+from src.danboorubatch import MD5Batcher, lookup_md5s
+from src.ratelimit import ThrottledClient, TokenBucket
+from conftest import StubDanbooru
+
+
+def post(post_id:int, md5:str = None, is_banned:bool = False) -> dict:
+    p = {"id": post_id, "is_banned": is_banned, "image_width": 4000, "image_height": 4000}
+    if md5 is not None:
+        p["md5"] = md5
+    return p
+
+
+def test_lookup_md5s_searches_a_batch_in_one_call():
+    api = StubDanbooru({"a": [post(1, "a")], "c": [post(3, "c")]})
+    found, calls = lookup_md5s(api, ["a", "b", "c"])
+    assert calls == 1
+    assert api.calls == [("get_posts", "md5:a,b,c")]
+    assert {md5: [p["id"] for p in posts] for md5, posts in found.items()} == {"a": [1], "c": [3]}
+
+
+def test_lookup_md5s_falls_back_to_single_lookups_for_hidden_md5s():
+    # Danbooru leaves md5 off posts the account can't fully see, those get narrowed down by searching halves again.
+    api = StubDanbooru({"a": [post(1, "a")], "b": [post(2)]})
+    found, calls = lookup_md5s(api, ["a", "b", "c"])
+    assert calls == 2
+    assert api.calls[1:] == [("get_posts", "md5:b")]
+    assert sorted(found) == ["a", "b"]
+
+
+def test_lookup_md5s_bisects_to_find_a_hidden_md5():
+    md5s = [f"{i:032x}" for i in range(100)]
+    hidden = md5s[37]
+    api = StubDanbooru({md5s[3]: [post(3, md5s[3])], hidden: [post(37)]})
+    found, calls = lookup_md5s(api, md5s)
+    assert sorted(found) == sorted([md5s[3], hidden])
+    assert found[hidden] == [post(37)]
+    # One search for the batch, then one per halving rather than one per unfound md5.
+    assert calls == len(api.calls) <= 1 + 7
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_batcher_hands_back_every_file_in_order(workers:int):
+    md5s = [f"{i:032x}" for i in range(25)]
+    api = StubDanbooru({md5: [post(i, md5)] for i, md5 in enumerate(md5s) if i % 4 == 0})
+    results = []
+    with MD5Batcher(api, batch_size=10, workers=workers) as batcher:
+        for i, md5 in enumerate(md5s):
+            results.extend(batcher.add(f"file{i}", md5))
+        results.extend(batcher.flush())
+
+    assert [key for key, _, _ in results] == [f"file{i}" for i in range(25)]
+    assert [bool(posts) for _, _, posts in results] == [i % 4 == 0 for i in range(25)]
+    assert batcher.stats.files == 25
+    assert batcher.stats.calls == 3
+
+
+def test_batcher_skips_files_that_fail_the_precheck():
+    api = StubDanbooru({"a": [post(1, "a")]})
+    with MD5Batcher(api, precheck=lambda key: key != "bad") as batcher:
+        batcher.add("good", "a")
+        batcher.add("bad", "b")
+        results = batcher.flush()
+
+    assert results == [("good", "a", [post(1, "a")]), ("bad", "b", None)]
+    assert api.calls == [("get_posts", "md5:a")]
+
+
+def test_batcher_wait_for_resolves_a_pending_md5_early():
+    api = StubDanbooru({"a": [post(1, "a")]})
+    with MD5Batcher(api, batch_size=100) as batcher:
+        assert batcher.add("first", "a") == []
+        assert batcher.is_pending("a")
+        assert batcher.wait_for("a") == [("first", "a", [post(1, "a")])]
+        assert not batcher.is_pending("a")
+
+
+def test_batcher_workers_share_a_throttled_client(clock):
+    api = StubDanbooru()
+    lock = threading.Lock()
+    def sleep(seconds:float):
+        with lock:
+            clock.sleep(seconds)
+    bucket = TokenBucket(2, 1, clock=clock, sleep=sleep)
+    with MD5Batcher(ThrottledClient(api, bucket), batch_size=1, workers=4) as batcher:
+        for i in range(6):
+            batcher.add(i, f"{i:032x}")
+        batcher.flush()
+
+    # Two calls go straight through, the other four wait their turn at two a second.
+    assert len(api.calls) == 6
+    assert sum(clock.slept) >= 2
+
+
+def test_create_api_shares_the_transport_session(danbooru_module):
+    api = danclient.create_api()
+    assert isinstance(api, StubDanbooru)
+    assert api.session is transport.shared().session
+
+
+def test_lazy_api_only_builds_the_client_when_used():
+    built = []
+    lazy = danclient.LazyAPI(lambda: built.append(1) or StubDanbooru())
+    assert built == []
+    lazy.get_posts({"tags": "md5:a"})
+    lazy.get_posts({"tags": "md5:b"})
+    assert built == [1]
+
+
+def test_md5_scan_batches_lookups_and_records_results(tmp_path, database, monkeypatch):
+    import src.saucenaoscan as saucenaoscan
+    import src.repos.imagerepo as imagerepo
+
+    folder = tmp_path / "images"
+    folder.mkdir()
+    for i in range(5):
+        Image.new("RGB", (16, 16), (i * 40, 0, 0)).save(folder / f"{i}.png")
+    md5s = {name: hashlib.md5((folder / name).read_bytes()).hexdigest() for name in os.listdir(folder)}
+    api = StubDanbooru({md5s["0.png"]: [post(10, md5s["0.png"])], md5s["1.png"]: [post(11, md5s["1.png"], is_banned=True)]})
+    monkeypatch.setattr(saucenaoscan, "danAPI", ThrottledClient(danclient.LazyAPI(lambda: api), TokenBucket(1000, 1)))
+
+    saucenaoscan.md5_scan(str(folder), False)
+
+    lookups = [tags for call, tags in api.calls if call == "get_posts"]
+    assert len(lookups) == 1
+    assert sorted(lookups[0].removeprefix("md5:").split(",")) == sorted(md5s.values())
+    assert api.favorites == [10]
+    assert not (folder / "0.png").exists()
+    statuses = {os.path.basename(image.full_path): image.status for image in imagerepo.get_images()}
+    assert statuses == {
+        "1.png": imagerepo.image_scan_status.banned_artist,
+        "2.png": imagerepo.image_scan_status.md5_only_scan,
+        "3.png": imagerepo.image_scan_status.md5_only_scan,
+        "4.png": imagerepo.image_scan_status.md5_only_scan,
+    }
@@ -0,0 +1,38 @@
+import os
+import src.repos.imagerepo as imagerepo
+from src.database.imgdatabase import Parameter
+
+FULL = imagerepo.image_scan_status.full_scan
+MD5_ONLY = imagerepo.image_scan_status.md5_only_scan
+
+
+def stat(size:int, inode:int) -> os.stat_result:
+    return os.stat_result((0o100644, inode, 0, 1, 0, 0, size, 0, 0, 0))
+
+
+def images() -> dict[str, tuple[str, int, int]]:
+    return {i.full_path: (i.md5, i.status, i.size) for i in imagerepo.get_images()}
+
+
+def test_bulk_insert_adds_new_rows(database):
+    stats = imagerepo.bulk_insert_images([("/a.png", "a", FULL, stat(1, 1)), ("/b.png", "b", FULL, stat(2, 2))])
+    assert (stats.rows, stats.written, stats.skipped) == (2, 2, 0)
+    assert images() == {"/a.png": ("a", FULL, 1), "/b.png": ("b", FULL, 2)}
+
+
+def test_bulk_insert_refreshes_a_path_already_recorded(database):
+    imagerepo.bulk_insert_images([("/a.png", "a", FULL, stat(1, 1))])
+    # Edited in place, same path with new contents.
+    stats = imagerepo.bulk_insert_images([("/a.png", "a2", MD5_ONLY, stat(5, 1))])
+    assert (stats.written, stats.skipped) == (1, 0)
+    assert images() == {"/a.png": ("a2", MD5_ONLY, 5)}
+    image = imagerepo.get_images([Parameter("full_path", "/a.png")])[0]
+    assert (image.size, image.inode) == (5, 1)
+
+
+def test_bulk_insert_skips_a_copy_under_another_path(database):
+    imagerepo.bulk_insert_images([("/a.png", "a", FULL, stat(1, 1)), ("/b.png", "b", FULL, stat(2, 2))])
+    # A new copy of a, and b's path now holding a copy of a. Neither can take a's md5 from it.
+    stats = imagerepo.bulk_insert_images([("/c.png", "a", FULL, stat(1, 3)), ("/b.png", "a", FULL, stat(1, 2))])
+    assert (stats.rows, stats.written, stats.skipped) == (2, 0, 2)
+    assert images() == {"/a.png": ("a", FULL, 1), "/b.png": ("b", FULL, 2)}
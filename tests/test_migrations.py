@@ -0,0 +1,146 @@
+import sqlite3
+import pytest
+import src.database.imgdatabase as imgdatabase
+import src.database.migrations as migrations
+from src.database.imgdatabase import Parameter
+import src.repos.imagerepo as imagerepo
+import src.repos.saucenaoresultrepo as saucenaoresultrepo
+import src.repos.quotarepo as quotarepo
+
+LATEST = len(migrations.MIGRATIONS)
+INDEXES = {"Saucenao_Results_image", "Saucenao_Results_pending", "Images_status", "Quota_Ledger_requested_at"}
+
+# Every repo query that has an index meant for it. SQLite has to search with the index rather than scan the table.
+QUERIES = {
+    "check-results review query": lambda: list(saucenaoresultrepo.get_pending_reviews(80)),
+    "pending results over threshold": lambda: saucenaoresultrepo.get_results([Parameter("similarity", 80, Parameter.Condition.GRTOREQUAL), Parameter("status", 0)]),
+    "reviewed results of an image": lambda: saucenaoresultrepo.get_results([Parameter("image_uid", 1), Parameter("status", 1)]),
+    "images by status": lambda: imagerepo.get_images([Parameter("status", 1)]),
+    # Same lookup SQLite does for the ON DELETE CASCADE when an image is deleted.
+    "cascade from Images": lambda: imgdatabase.db_handler.execute_query("SELECT 1 FROM Saucenao_Results WHERE image_uid = ?", [1]),
+    "quota ledger window": lambda: quotarepo.get_entries([Parameter("requested_at", 0, Parameter.Condition.GREATER)]),
+}
+
+# The schema init_setup created before there were migrations, which every database made back then still has.
+BASELINE_SCHEMA = """
+    CREATE TABLE Status_Saucenao_Results (status INTEGER PRIMARY KEY, status_type TEXT);
+    CREATE TABLE Status_Images (status INTEGER PRIMARY KEY, status_type TEXT);
+    INSERT INTO Status_Saucenao_Results VALUES (0, "Unknown"), (1, "No Match");
+    INSERT INTO Status_Images VALUES (1, "Full Scan"), (2, "MD5 Only Scan"), (3, "Banned Artist");
+    CREATE TABLE Images (
+        image_uid INTEGER PRIMARY KEY,
+        file_name TEXT,
+        full_path TEXT UNIQUE NOT NULL,
+        ext       TEXT,
+        md5       TEXT UNIQUE NOT NULL,
+        status    INTEGER DEFAULT 1,
+        FOREIGN KEY (status) REFERENCES Status_Images(status)
+    );
+    CREATE TABLE Saucenao_Results (
+        result_uid  INTEGER PRIMARY KEY,
+        image_uid   INTEGER,
+        site_flag   INTEGER,
+        site_id     INTEGER,
+        similarity  REAL,
+        status      INTEGER,
+        FOREIGN KEY (image_uid) REFERENCES Images(image_uid) ON DELETE CASCADE,
+        FOREIGN KEY (status) REFERENCES Status_Saucenao_Results(status)
+    );
+    INSERT INTO Images VALUES (7, "a", "/a.png", ".png", "a", 1);
+    INSERT INTO Saucenao_Results VALUES (1, 7, 512, 1234, 75.0, 0);
+"""
+
+
+def capture(conn:sqlite3.Connection, fn) -> list[str]:
+    """Runs fn and returns the SQL it ran, with the values bound in."""
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        fn()
+    finally:
+        conn.set_trace_callback(None)
+    return statements
+
+
+def indexes(conn:sqlite3.Connection) -> set[str]:
+    return {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name NOT LIKE 'sqlite_%'")}
+
+
+def open_handler(path:str):
+    return getattr(imgdatabase, "__database")(path)
+
+
+@pytest.mark.parametrize("label", QUERIES)
+def test_query_uses_its_index(database, label:str):
+    conn = database.get_connection()
+    statements = capture(conn, QUERIES[label])
+    assert any(statements)
+    for statement in statements:
+        plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {statement}")]
+        assert not [step for step in plan if step.startswith("SCAN")], plan
+
+
+def test_new_database_is_brought_up_to_date(database):
+    conn = database.get_connection()
+    assert migrations.version(conn) == LATEST
+    assert indexes(conn) >= INDEXES
+
+
+def test_up_to_date_database_costs_one_pragma(database):
+    conn = database.get_connection()
+    statements = capture(conn, lambda: migrations.migrate(database))
+    assert statements == ["PRAGMA user_version"]
+
+
+def test_only_missing_migrations_are_applied(database):
+    conn = database.get_connection()
+    for name in INDEXES:
+        conn.execute(f"DROP INDEX {name}")
+    conn.execute("PRAGMA user_version = 1")
+
+    assert migrations.migrate(database) == LATEST - 1
+    assert migrations.version(conn) == LATEST
+    assert indexes(conn) >= INDEXES
+
+
+def test_migration_is_checked_again_once_the_lock_is_held(database, monkeypatch):
+    # Another process finishes the migration between the first look at user_version and this one getting the write lock.
+    conn = database.get_connection()
+    conn.execute("PRAGMA user_version = 1")
+    other = sqlite3.connect(database.db_instance, isolation_level=None)
+    transaction = database.transaction
+
+    def racing_transaction():
+        other.execute(f"PRAGMA user_version = {LATEST}")
+        return transaction()
+
+    ran = []
+    monkeypatch.setattr(database, "transaction", racing_transaction)
+    monkeypatch.setattr(migrations, "MIGRATIONS", [lambda c: ran.append(0), lambda c: ran.append(1)])
+    assert migrations.migrate(database) == 0
+    assert ran == []
+    other.close()
+
+
+def test_baseline_schema_database_is_migrated(tmp_path):
+    path = str(tmp_path / "baseline.db")
+    with sqlite3.connect(path) as conn:
+        conn.executescript(BASELINE_SCHEMA)
+    conn.close()
+
+    handler = open_handler(path)
+    try:
+        conn = handler.get_connection()
+        assert migrations.version(conn) == LATEST
+        assert indexes(conn) >= INDEXES
+        columns = [c[1] for c in conn.execute("PRAGMA table_info(Images)")]
+        assert columns[-4:] == ["size", "mtime_ns", "inode", "phash"]
+        tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        assert tables >= {"Perceptual_Matches", "Saucenao_Responses", "Danbooru_Posts", "Quota_Ledger"}
+        # What was there is left alone.
+        image = dict(conn.execute("SELECT * FROM Images").fetchone())
+        assert (image["image_uid"], image["full_path"], image["md5"], image["size"]) == (7, "/a.png", "a", None)
+        assert [tuple(r) for r in conn.execute("SELECT image_uid, site_id FROM Saucenao_Results")] == [(7, 1234)]
+        assert [r[0] for r in conn.execute("SELECT status FROM Status_Images")] == [1, 2, 3]
+    finally:
+        handler.close()
@@ -0,0 +1,70 @@
+import io
+from PIL import Image
+import pytest
+import src.phashindex as phashindex
+import src.repos.saucenaoresultrepo as saucenaoresultrepo
+from src.phashindex import PerceptualIndex
+from src.scanindex import ScanIndex
+
+DANBOORU = 512
+
+
+def encode(image:Image.Image) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def flat(shade:int) -> bytes:
+    return encode(Image.new("L", (90, 80), shade))
+
+
+def checkers(size:int = 10) -> bytes:
+    image = Image.new("L", (90, 80))
+    image.putdata([255 * ((x // size + y // size) % 2) for y in range(80) for x in range(90)])
+    return encode(image)
+
+
+def test_busy_image_hashes_the_same_every_time():
+    assert phashindex.dhash(checkers()) == phashindex.dhash(checkers())
+    assert phashindex.dhash(checkers()) is not None
+
+
+@pytest.mark.parametrize("payload", [flat(0), flat(128), flat(255)], ids=["black", "grey", "white"])
+def test_flat_images_have_no_hash(payload:bytes):
+    assert phashindex.dhash(payload) is None
+
+
+def test_gradient_has_no_hash():
+    # Plenty of variance, but every bit comes out the same.
+    image = Image.new("L", (90, 80))
+    image.putdata([x * 255 // 89 for y in range(80) for x in range(90)])
+    assert phashindex.dhash(encode(image)) is None
+
+
+@pytest.mark.parametrize("value", [0, (1 << 64) - 1])
+def test_degenerate_hashes_are_neither_indexed_nor_matched(database, value:int):
+    index = PerceptualIndex(max_distance=6)
+    index.add(value, DANBOORU, 1, 95.0)
+    index.add(0x0f0f0f0f0f0f0f0f, DANBOORU, 2, 95.0)
+    assert index.find(value) is None
+    # Including ones recorded before they were left out.
+    assert PerceptualIndex(max_distance=6).find(value) is None
+    assert index.find(0x0f0f0f0f0f0f0f0e)[1].site_id == 2
+
+
+def test_near_duplicate_is_recorded_for_check_results_not_favorited(database, monkeypatch):
+    import src.saucenaoscan as saucenaoscan
+    monkeypatch.setattr(saucenaoscan, "scan_index", ScanIndex())
+    monkeypatch.setattr(saucenaoscan, "perceptual_index", PerceptualIndex(max_distance=6))
+    monkeypatch.setattr(saucenaoscan, "favorite_match", lambda *args, **kwargs: pytest.fail("favorited on a hash alone"))
+    phash = 0x0f0f0f0f0f0f0f0f
+    saucenaoscan.perceptual_index.add(phash, DANBOORU, 1234, 95.0)
+
+    # Identical hash, still only recorded.
+    assert saucenaoscan.resolve_near_duplicate("/a.png", "a", phash)
+    results = saucenaoresultrepo.get_results()
+    assert [(r.site_id, r.similarity, r.status) for r in results] == [(1234, 100.0, 0)]
+    assert saucenaoscan.scan_index.get_by_md5("a").phash == phashindex.to_hex(phash)
+    # No hash, nothing to go on.
+    assert not saucenaoscan.resolve_near_duplicate("/b.png", "b", None)
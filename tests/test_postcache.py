@@ -0,0 +1,69 @@
+from conftest import StubDanbooru
+from src.postcache import PostCache
+
+DAY = 24 * 60 * 60
+
+
+def fetched(api:StubDanbooru) -> list:
+    return [args for call, args in api.calls if call in ("get_post", "get_posts")]
+
+
+def test_post_is_fetched_once_then_kept_in_memory(database):
+    api = StubDanbooru()
+    cache = PostCache(api, capacity=10, ttl=DAY, clock=lambda: 1000.0)
+    assert cache.get_post(1) == api.post(1)
+    assert cache.get_post("1") == api.post(1)
+    assert fetched(api) == [1]
+    stats = cache.stats
+    assert (stats.misses, stats.memory_hits, stats.db_hits) == (1, 1, 0)
+
+
+def test_post_is_shared_through_the_table(database):
+    PostCache(StubDanbooru(), capacity=10, ttl=DAY, clock=lambda: 1000.0).get_post(1)
+    api = StubDanbooru()
+    cache = PostCache(api, capacity=10, ttl=DAY, clock=lambda: 1000.0)
+    assert cache.get_post(1) == api.post(1)
+    assert fetched(api) == []
+    assert cache.stats.db_hits == 1
+
+
+def test_expired_post_is_fetched_again(database):
+    now = [1000.0]
+    api = StubDanbooru()
+    cache = PostCache(api, capacity=10, ttl=DAY, clock=lambda: now[0])
+    cache.get_post(1)
+    now[0] += DAY - 1
+    cache.get_post(1)
+    assert fetched(api) == [1]
+    # Gone from memory and the table both.
+    now[0] += 1
+    cache.get_post(1)
+    assert fetched(api) == [1, 1]
+    assert PostCache(StubDanbooru(), capacity=10, ttl=DAY, clock=lambda: now[0]).get_post(1) == api.post(1)
+
+
+def test_least_recently_used_post_is_evicted(database):
+    api = StubDanbooru()
+    cache = PostCache(api, capacity=2, ttl=DAY, clock=lambda: 1000.0)
+    cache.get_post(1)
+    cache.get_post(2)
+    cache.get_post(1)
+    cache.get_post(3)
+    # 2 went, it's back from the table rather than Danbooru, 1 and 3 are still in memory.
+    cache.get_post(1)
+    cache.get_post(3)
+    cache.get_post(2)
+    assert fetched(api) == [1, 2, 3]
+    stats = cache.stats
+    assert (stats.memory_hits, stats.db_hits, stats.misses) == (3, 1, 3)
+
+
+def test_warm_fetches_only_what_isnt_cached(database):
+    api = StubDanbooru()
+    cache = PostCache(api, capacity=10, ttl=DAY, clock=lambda: 1000.0)
+    cache.get_post(1)
+    assert cache.warm([1, 2, 3, 3]) == 2
+    assert fetched(api)[1:] in (["id:2,3"], ["id:3,2"])
+    assert cache.warm([1, 2, 3]) == 0
+    cache.get_post(2)
+    assert cache.stats.memory_hits == 1
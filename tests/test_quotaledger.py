@@ -0,0 +1,77 @@
+import time
+import datetime
+import src.quotaledger as quotaledger
+import src.repos.quotarepo as quotarepo
+from src.modules.imgmodule import Quota_Entry
+from src.ratelimit import QuotaScheduler, SHORT_WINDOW, LONG_WINDOW
+
+
+def entry(requested_at:float, status_code:int = 200, long_limit:int = 100, long_remaining:int = None) -> Quota_Entry:
+    return Quota_Entry({
+        "ledger_uid": None, "requested_at": requested_at, "status_code": status_code, 
+        "short_limit": 4 if long_remaining is not None else None, "short_remaining": 3 if long_remaining is not None else None,
+        "long_limit": long_limit if long_remaining is not None else None, "long_remaining": long_remaining,
+    })
+
+
+def test_window_state_is_none_without_a_header():
+    assert quotaledger.window_state([entry(0, 429)], LONG_WINDOW, short=False, now=10) is None
+
+
+def test_window_state_expires_recorded_searches_a_window_after_they_were_made():
+    entries = [entry(0), entry(100), entry(200, long_remaining=97)]
+    limit, remaining, expiries = quotaledger.window_state(entries, LONG_WINDOW, short=False, now=300)
+    assert (limit, remaining) == (100, 97)
+    assert expiries == [LONG_WINDOW, LONG_WINDOW + 100, LONG_WINDOW + 200]
+
+    # Once the first one's a day old it's back.
+    _, remaining, _ = quotaledger.window_state(entries, LONG_WINDOW, short=False, now=LONG_WINDOW + 50)
+    assert remaining == 98
+
+
+def test_window_state_counts_searches_made_elsewhere_from_the_latest_response():
+    # SauceNAO says 5 are used but only 2 were made from here, the other 3 are assumed made at the latest response.
+    entries = [entry(0), entry(100, long_remaining=95)]
+    _, remaining, expiries = quotaledger.window_state(entries, LONG_WINDOW, short=False, now=100)
+    assert remaining == 95
+    assert expiries == [LONG_WINDOW] + [LONG_WINDOW + 100] * 4
+
+
+def test_window_state_keeps_every_recorded_search_when_more_are_outstanding():
+    # Fewer recorded than outstanding used to slice from the end and drop the oldest recorded searches.
+    entries = [entry(0), entry(100), entry(200, long_remaining=95)]
+    _, remaining, expiries = quotaledger.window_state(entries, LONG_WINDOW, short=False, now=200)
+    assert remaining == 95
+    assert expiries == [LONG_WINDOW, LONG_WINDOW + 100] + [LONG_WINDOW + 200] * 3
+
+
+def test_window_state_ignores_failed_searches():
+    entries = [entry(0), entry(50, 500), entry(100, long_remaining=98)]
+    _, _, expiries = quotaledger.window_state(entries, LONG_WINDOW, short=False, now=100)
+    assert expiries == [LONG_WINDOW, LONG_WINDOW + 100]
+
+
+def test_next_run_waits_for_enough_searches_to_come_back(database):
+    now = time.time()
+    for i in range(3):
+        quotarepo.insert_entry(now - 3000 + i * 1000, 200)
+    quotarepo.insert_entry(now - 1000, 200, {"short_limit": 4, "short_remaining": 3, "long_limit": 4, "long_remaining": 0})
+    # Searches made at -3000, -2000 and -1000 (twice, counting the one SauceNAO reported but we didn't record).
+    at = quotaledger.next_run(min_searches=2)
+    assert abs(at.timestamp() - (now - 2000 + LONG_WINDOW)) < 1
+
+
+def test_next_run_is_now_with_an_empty_ledger(database):
+    assert abs(quotaledger.next_run().timestamp() - datetime.datetime.now().timestamp()) < 1
+
+
+def test_seed_starts_the_scheduler_from_the_ledger(database, clock):
+    now = time.time()
+    quotarepo.insert_entry(now - 10, 200, {"short_limit": 4, "short_remaining": 2, "long_limit": 100, "long_remaining": 40})
+    scheduler = QuotaScheduler(clock=clock, sleep=clock.sleep)
+    quotaledger.seed(scheduler)
+    assert scheduler.short.available() == 2
+    assert scheduler.long.available() == 40
+    # The short window's searches were made 10 seconds ago, so they're back 20 seconds from now rather than 30.
+    clock.now += SHORT_WINDOW - 10
+    assert scheduler.short.available() == 4
@@ -0,0 +1,109 @@
+import pytest
+from src.ratelimit import TokenBucket, WindowBucket, QuotaScheduler, ThrottledClient, SHORT_WINDOW, LONG_WINDOW
+
+
+def test_token_bucket_queues_callers_past_capacity(clock):
+    bucket = TokenBucket(2, 1, clock=clock, sleep=clock.sleep)
+    assert [bucket.reserve() for _ in range(4)] == [0.0, 0.0, 0.5, 1.0]
+    # Four taken from two leaves it two in debt, refilling at two a second.
+    clock.now += 1.5
+    assert bucket.available() == pytest.approx(1.0)
+
+
+def test_token_bucket_never_refills_past_capacity(clock):
+    bucket = TokenBucket(5, 1, clock=clock, sleep=clock.sleep)
+    clock.now += 60
+    assert bucket.available() == 5
+
+
+def test_window_bucket_holds_each_token_a_full_window(clock):
+    bucket = WindowBucket(4, SHORT_WINDOW, clock=clock, sleep=clock.sleep)
+    sent = []
+    for _ in range(10):
+        bucket.acquire()
+        sent.append(clock.now)
+        clock.now += 1
+
+    # However the sends line up, no 30 second window ever sees more than 4 of them.
+    for start in sent:
+        assert sum(1 for t in sent if start <= t < start + SHORT_WINDOW) <= 4
+    assert sent[4] == sent[0] + SHORT_WINDOW
+
+
+def test_window_bucket_next_token_in(clock):
+    bucket = WindowBucket(2, 10, clock=clock, sleep=clock.sleep)
+    bucket.reserve()
+    clock.now += 3
+    bucket.reserve()
+    assert bucket.next_token_in() == 7
+    clock.now += 7
+    assert bucket.next_token_in() == 0
+
+
+def test_window_bucket_seed_takes_the_servers_count(clock):
+    bucket = WindowBucket(4, SHORT_WINDOW, clock=clock, sleep=clock.sleep)
+    bucket.reserve()
+    bucket.seed(6, 2)
+    assert bucket.capacity == 6
+    assert bucket.available() == 2
+    # Spends the server knows about but we don't are held for a full window from now.
+    clock.now += SHORT_WINDOW - 1
+    assert bucket.available() == 2
+    clock.now += 1
+    assert bucket.available() == 6
+
+
+def test_window_bucket_seed_with_known_spend_times(clock):
+    bucket = WindowBucket(4, SHORT_WINDOW, clock=clock, sleep=clock.sleep)
+    bucket.seed(4, 2, spent_ago=[25, 5])
+    assert bucket.available() == 2
+    clock.now += 5
+    assert bucket.available() == 3
+
+
+def test_scheduler_spaces_searches_over_the_short_window(clock):
+    scheduler = QuotaScheduler(short_limit=4, long_limit=100, clock=clock, sleep=clock.sleep)
+    for _ in range(5):
+        scheduler.wait()
+    assert clock.slept == [SHORT_WINDOW]
+    assert scheduler.long.available() == 95
+
+
+def test_scheduler_update_from_header(clock):
+    scheduler = QuotaScheduler(clock=clock, sleep=clock.sleep)
+    scheduler.update({"short_limit": "6", "short_remaining": 5, "long_limit": "200", "long_remaining": 0})
+    assert scheduler.state()["short_limit"] == 6
+    assert scheduler.state()["short_remaining"] == 5
+    assert not scheduler.can_continue()
+    clock.now += LONG_WINDOW
+    assert scheduler.can_continue()
+
+
+@pytest.mark.parametrize("attempt, jitter, expected", [
+    (1, 0.0, 15),
+    (1, 1.0, 30),
+    (2, 0.0, 30),
+    (3, 0.5, 90),
+    (6, 1.0, 600),
+])
+def test_scheduler_backoff_is_exponential_with_equal_jitter(clock, attempt:int, jitter:float, expected:float):
+    scheduler = QuotaScheduler(max_attempts=10, base_backoff=30, max_backoff=600, clock=clock, sleep=clock.sleep, jitter=lambda: jitter)
+    assert scheduler.backoff(attempt) == expected
+
+
+def test_scheduler_backoff_gives_up_after_max_attempts(clock):
+    scheduler = QuotaScheduler(max_attempts=3, clock=clock, sleep=clock.sleep)
+    assert scheduler.backoff(2) is not None
+    assert scheduler.backoff(3) is None
+
+
+def test_throttled_client_takes_a_token_per_call(clock):
+    class Client:
+        name = "client"
+        def ping(self):
+            return "pong"
+
+    throttled = ThrottledClient(Client(), TokenBucket(1, 1, clock=clock, sleep=clock.sleep))
+    assert [throttled.ping() for _ in range(3)] == ["pong"] * 3
+    assert throttled.name == "client"
+    assert clock.slept == [1.0, 1.0]
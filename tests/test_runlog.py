@@ -0,0 +1,92 @@
+import os
+import gzip
+import json
+import datetime
+import src.runlog as runlog
+from src.runlog import RunLog, IDLE_BEFORE_ROTATE
+
+NOW = 2_000_000_000.0
+
+
+def log(directory, name:str, records:list[dict] = (), age:float = 0) -> str:
+    full_path = os.path.join(directory, name)
+    with open(full_path, "w", encoding="utf-8") as f:
+        f.writelines(json.dumps(r) + "\n" for r in records)
+    os.utime(full_path, (NOW - age, NOW - age))
+    return full_path
+
+
+def test_rotate_compresses_only_idle_logs(tmp_path):
+    log(tmp_path, "saucenao_2026-01-01_scan.jsonl", [{"action": "no_match"}], age=IDLE_BEFORE_ROTATE)
+    log(tmp_path, "saucenao_2026-01-02_scan.jsonl", age=IDLE_BEFORE_ROTATE - 1)
+    log(tmp_path, "saucenao_2025-12-01.log", age=IDLE_BEFORE_ROTATE * 30)
+    log(tmp_path, "notes.jsonl", age=IDLE_BEFORE_ROTATE * 30)
+
+    runlog.rotate(str(tmp_path), keep=10, now=NOW)
+    assert sorted(os.listdir(tmp_path)) == [
+        "notes.jsonl",
+        "saucenao_2025-12-01.log.gz",
+        "saucenao_2026-01-01_scan.jsonl.gz",
+        # Might still be open in another run.
+        "saucenao_2026-01-02_scan.jsonl",
+    ]
+    with gzip.open(tmp_path / "saucenao_2026-01-01_scan.jsonl.gz", "rt") as f:
+        assert json.loads(f.readline()) == {"action": "no_match"}
+
+
+def test_rotate_keeps_only_the_newest_compressed_logs(tmp_path):
+    for day in range(1, 6):
+        log(tmp_path, f"saucenao_2026-01-0{day}_scan.jsonl", age=IDLE_BEFORE_ROTATE * 2)
+    runlog.rotate(str(tmp_path), keep=2, now=NOW)
+    assert sorted(os.listdir(tmp_path)) == ["saucenao_2026-01-04_scan.jsonl.gz", "saucenao_2026-01-05_scan.jsonl.gz"]
+
+
+def test_records_are_read_back_across_compressed_and_plain_logs(tmp_path):
+    log(tmp_path, "saucenao_2026-01-01_scan.jsonl", [
+        {"timestamp": "2026-01-01T10:00:00.000", "action": "favorited", "path": "/a/1.png", "md5": "a", "post_id": 1},
+        {"timestamp": "2026-01-01T10:00:01.000", "action": "no_match", "path": "/a/2.png", "md5": "b"},
+    ], age=IDLE_BEFORE_ROTATE)
+    runlog.rotate(str(tmp_path), keep=10, now=NOW)
+    full_path = log(tmp_path, "saucenao_2026-01-02_scan.jsonl", [
+        {"timestamp": "2026-01-02T10:00:00.000", "action": "low_match", "path": "/b/3.png", "md5": "c", "post_id": 1},
+    ])
+    # A run killed halfway through a line.
+    with open(full_path, "a") as f:
+        f.write('{"timestamp": "2026-01-02T10:')
+
+    def md5s(**filters) -> list[str]:
+        return [r["md5"] for r in runlog.read(str(tmp_path), **filters)]
+
+    assert md5s() == ["a", "b", "c"]
+    assert md5s(actions=["favorited", "low_match"]) == ["a", "c"]
+    assert md5s(path="/a/") == ["a", "b"]
+    assert md5s(post_id=1, since=datetime.datetime(2026, 1, 2)) == ["c"]
+
+
+def test_run_log_writes_every_record_once_closed(tmp_path):
+    run = RunLog(str(tmp_path / "saucenao_run.jsonl"), "scan", flush_seconds=60)
+    run.write("favorited", path="/a.png", md5="a", similarity=95.5, post_id=1, message="done")
+    run.write("info")
+    run.close()
+    run.write("ignored")
+    records = list(runlog.read(str(tmp_path)))
+    assert [(r["command"], r["action"]) for r in records] == [("scan", "favorited"), ("scan", "info")]
+    assert records[0]["similarity"] == 95.5 and not "path" in records[1]
+
+
+def test_start_rotates_and_opens_a_log_for_the_run():
+    directory = runlog.log_dir()
+    os.makedirs(directory, exist_ok=True)
+    old = log(directory, "saucenao_2000-01-01_scan.jsonl", [{"action": "info"}])
+    # start() goes by the real time, this one hasn't been touched since 1970.
+    os.utime(old, (0, 0))
+    try:
+        run = runlog.start("md5_scan")
+        assert runlog.active() is run
+        assert os.path.exists(f"{old}.gz") and not os.path.exists(old)
+        runlog.write("no_match", md5="a")
+    finally:
+        runlog.close()
+    assert runlog.active() is None
+    with open(run.path, encoding="utf-8") as f:
+        assert json.loads(f.readline())["command"] == "md5_scan"
@@ -0,0 +1,120 @@
+import os
+import src.repos.imagerepo as imagerepo
+from src.scanindex import ScanIndex
+
+FULL = imagerepo.image_scan_status.full_scan
+MD5_ONLY = imagerepo.image_scan_status.md5_only_scan
+
+
+def stat(size:int, inode:int, mtime_ns:int = 0) -> os.stat_result:
+    return os.stat_result((0o100644, inode, 0, 1, 0, 0, size, 0, 0, 0, 0.0, 0.0, 0.0, 0, mtime_ns, 0))
+
+
+def rows() -> dict[str, tuple[int, str, int]]:
+    return {i.full_path: (i.image_uid, i.md5, i.size) for i in imagerepo.get_images()}
+
+
+def test_edited_file_is_updated_in_place(database):
+    index = ScanIndex()
+    uid = index.insert_image("/a.png", "old", MD5_ONLY, stat(1, 1))
+    index.update_phash(uid, "ff")
+
+    assert index.record_fingerprint("/a.png", "new", stat(2, 1, mtime_ns=5))
+    assert rows() == {"/a.png": (uid, "new", 2)}
+    assert index.get_by_md5("old") is None
+    image = index.get_by_md5("new")
+    assert image is index.get_by_path("/a.png")
+    assert (image.image_uid, image.status, image.phash) == (uid, MD5_ONLY, None)
+    # Reloaded from the DB it's the same.
+    assert ScanIndex().get_by_md5("new").image_uid == uid
+
+
+def test_edited_into_a_copy_of_another_image_drops_the_old_record(database):
+    index = ScanIndex()
+    index.insert_image("/a.png", "a", MD5_ONLY, stat(1, 1))
+    other = index.insert_image("/b.png", "b", MD5_ONLY, stat(2, 2))
+
+    assert index.record_fingerprint("/a.png", "b", stat(2, 1, mtime_ns=5))
+    assert rows() == {"/b.png": (other, "b", 2)}
+    assert index.get_by_path("/a.png") is None
+    assert index.get_by_md5("b").full_path == "/b.png"
+
+
+def test_unchanged_md5_only_refreshes_the_fingerprint(database):
+    index = ScanIndex()
+    uid = index.insert_image("/a.png", "a", FULL, stat(1, 1))
+    # Touched, or copied back over itself.
+    assert not index.record_fingerprint("/a.png", "a", stat(1, 9, mtime_ns=5))
+    assert index.cached_md5("/a.png", stat(1, 9, mtime_ns=5)) == "a"
+    assert ScanIndex().get_by_path("/a.png").inode == 9
+    assert rows() == {"/a.png": (uid, "a", 1)}
+
+
+def test_lookups_by_path_and_md5(database):
+    index = ScanIndex()
+    uid = index.insert_image("/a.png", "a", FULL, stat(1, 1))
+    assert index.get_by_path("/a.png") is index.get_by_md5("a")
+    assert index.get_by_path("/a.png").image_uid == uid
+    assert index.get_by_path("/b.png") is None and index.get_by_md5("b") is None
+    assert index.has_status("/a.png", [int(FULL)])
+    assert not index.has_status("/a.png", [int(MD5_ONLY)])
+    assert len(index) == 1
+    # Written through, a fresh index loads the same.
+    assert ScanIndex().get_by_md5("a").full_path == "/a.png"
+
+
+def test_cached_md5_only_for_an_unchanged_file(database):
+    index = ScanIndex()
+    index.insert_image("/a.png", "a", FULL, stat(1, 1, mtime_ns=5))
+    assert index.cached_md5("/a.png", stat(1, 1, mtime_ns=5)) == "a"
+    assert index.cached_md5("/a.png", stat(1, 1, mtime_ns=6)) is None
+    assert index.cached_md5("/a.png", stat(2, 1, mtime_ns=5)) is None
+    assert index.cached_md5("/b.png", stat(1, 2)) is None
+
+
+def test_cached_md5_follows_a_moved_file_by_inode(database):
+    index = ScanIndex()
+    index.insert_image("/a.png", "a", FULL, stat(1, 1, mtime_ns=5))
+    assert index.cached_md5("/moved/a.png", stat(1, 1, mtime_ns=5)) == "a"
+    # Same inode but another size is a new file that reused it.
+    assert index.cached_md5("/moved/a.png", stat(2, 1, mtime_ns=5)) is None
+
+
+def test_moved_file_is_recorded_under_its_new_path(database, tmp_path):
+    index = ScanIndex()
+    uid = index.insert_image(str(tmp_path / "gone.png"), "a", FULL, stat(1, 1))
+    new_path = str(tmp_path / "new.png")
+
+    response = index.check_existing_file(new_path, "a", stat(1, 1))
+    assert response["status"] == imagerepo.file_status.Changed
+    assert index.get_by_path(str(tmp_path / "gone.png")) is None
+    assert index.get_by_path(new_path).image_uid == uid
+    assert index.get_by_md5("a").file_name == "new"
+    assert rows() == {new_path: (uid, "a", 1)}
+
+
+def test_copy_is_a_duplicate_while_the_original_exists(database, tmp_path):
+    original = tmp_path / "a.png"
+    original.write_bytes(b"a")
+    index = ScanIndex()
+    index.insert_image(str(original), "a", FULL, os.stat(original))
+
+    response = index.check_existing_file(str(tmp_path / "copy.png"), "a", stat(1, 99))
+    assert response["status"] == imagerepo.file_status.Duplicate
+    assert index.get_by_md5("a").full_path == str(original)
+
+
+def test_same_path_and_unknown_md5_are_ok(database):
+    index = ScanIndex()
+    index.insert_image("/a.png", "a", FULL, stat(1, 1))
+    assert index.check_existing_file("/a.png", "a", stat(1, 1))["status"] == imagerepo.file_status.OK
+    assert index.check_existing_file("/b.png", "b", stat(1, 2))["status"] == imagerepo.file_status.OK
+
+
+def test_deleted_image_is_gone_from_every_lookup(database):
+    index = ScanIndex()
+    uid = index.insert_image("/a.png", "a", FULL, stat(1, 1, mtime_ns=5))
+    index.delete_image(uid)
+    assert index.get_by_path("/a.png") is None and index.get_by_md5("a") is None
+    assert index.cached_md5("/moved.png", stat(1, 1, mtime_ns=5)) is None
+    assert rows() == {}
@@ -0,0 +1,69 @@
+import threading
+import pytest
+from src.scanpipeline import Pipeline
+
+
+def test_items_come_out_in_order_through_every_stage():
+    with Pipeline(range(50), depth=4) as pipeline:
+        pipeline.stage("double", lambda x: x * 2, 2).stage("str", str, 3)
+        assert list(pipeline) == [str(x * 2) for x in range(50)]
+    assert [s.items for s in pipeline.stats.stages] == [50, 50, 50]
+    assert pipeline.stats.taken == 50
+    assert all(s.peak <= s.depth for s in pipeline.stats.stages)
+
+
+def test_stage_error_is_raised_to_the_iterator():
+    def fail_on_three(x):
+        if x == 3:
+            raise ValueError("three")
+        return x
+
+    with Pipeline(range(10)) as pipeline:
+        pipeline.stage("check", fail_on_three)
+        taken = []
+        with pytest.raises(ValueError, match="three"):
+            for item in pipeline:
+                taken.append(item)
+    # Everything before the bad item still made it through.
+    assert taken == [0, 1, 2]
+
+
+def test_source_error_is_raised_to_the_iterator():
+    def source():
+        yield 1
+        raise OSError("walk failed")
+
+    with Pipeline(source()) as pipeline:
+        pipeline.stage("same", lambda x: x)
+        with pytest.raises(OSError, match="walk failed"):
+            list(pipeline)
+
+
+def test_closing_early_stops_every_thread_and_the_source():
+    closed = threading.Event()
+
+    def endless():
+        try:
+            i = 0
+            while True:
+                yield i
+                i += 1
+        finally:
+            closed.set()
+
+    pipeline = Pipeline(endless(), depth=2).stage("same", lambda x: x, 2)
+    for item in pipeline:
+        if item == 5:
+            break
+    pipeline.close()
+    # The source was closed on its own thread, so a generator gets to clean up.
+    assert closed.wait(1)
+    assert not [t for t in threading.enumerate() if t.name.startswith("pipeline-")]
+
+
+def test_stage_cant_be_added_once_running():
+    with Pipeline(range(3)) as pipeline:
+        iterator = iter(pipeline)
+        next(iterator)
+        with pytest.raises(Exception, match="already running"):
+            pipeline.stage("late", lambda x: x)
@@ -0,0 +1,154 @@
+import json
+import time
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import requests
+import src.transport as transport
+import src.danclient as danclient
+import src.saucenao as saucenao
+
+DANBOORU = int(saucenao.API.DBMask.index_danbooru)
+
+
+class StandIn:
+    """Local HTTP server for SauceNAO's search and Danbooru's posts, doing whatever it was scripted to for each request:
+    "ok" answers with the body, "hang" sits on the request past the read timeout, "reset" hangs up without answering."""
+    def __init__(self, script:list[str], body:dict = None):
+        self.script = list(script)
+        self.body = body or {}
+        self.requests:list[str] = []
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def handle_request(self):
+                length = int(self.headers.get("Content-Length", 0))
+                self.rfile.read(length)
+                stand_in.requests.append(self.path)
+                match stand_in.script.pop(0):
+                    case "hang":
+                        # The client's given up by the time this wakes, there's no one left to answer.
+                        time.sleep(0.5)
+                        self.close_connection = True
+                        return
+                    case "reset":
+                        self.close_connection = True
+                        return
+                data = json.dumps(stand_in.body).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = handle_request
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stand_in():
+    servers:list[StandIn] = []
+    def start(script:list[str], body:dict = None) -> StandIn:
+        servers.append(StandIn(script, body))
+        return servers[-1]
+    yield start
+    for server in servers:
+        server.close()
+
+
+@pytest.fixture
+def http(monkeypatch) -> transport.Transport:
+    """Shared transport with timeouts short enough to hit, and a record of every retry."""
+    http = transport.Transport(connect_timeout=1, read_timeout=0.2, retries=2)
+    http.retried = []
+    http.add_retry_hook(lambda attempt, e: http.retried.append(attempt))
+    monkeypatch.setattr(transport, "__shared", http)
+    return http
+
+
+class SessionDanbooru:
+    """The part of danbooru.API that matters here, it sends through whatever session it's been given."""
+    url:str = None
+
+    def __init__(self):
+        self.session = requests.Session()
+
+
+    def get_posts(self, params:dict) -> list[dict]:
+        return self.session.get(f"{self.url}/posts.json", params=params).json()
+
+
+def free_port() -> int:
+    """A port nothing is listening on, so connecting to it is refused."""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_search_goes_through_the_shared_transport(http, stand_in):
+    server = stand_in(["ok"], {"header": {}, "results": []})
+    api = saucenao.API(DANBOORU, 50, url=f"{server.url}/search.php")
+    response = api.send_request("image.png", payload=b"thumbnail")
+    assert response.status_code == 200
+    assert response.json() == {"header": {}, "results": []}
+    assert server.requests[0].startswith("/search.php?")
+
+
+def test_refused_connection_is_retried(http):
+    api = saucenao.API(DANBOORU, 50, url=f"http://127.0.0.1:{free_port()}/search.php")
+    with pytest.raises(requests.ConnectionError) as e:
+        api.send_request("image.png", payload=b"thumbnail")
+    assert transport.connect_failed(e.value)
+    assert http.retried == [1, 2]
+
+
+def test_reset_after_sending_is_not_retried(http, stand_in):
+    # The server may have counted the search already, sending it again could spend a second one.
+    server = stand_in(["reset", "ok"])
+    api = saucenao.API(DANBOORU, 50, url=f"{server.url}/search.php")
+    with pytest.raises(requests.ConnectionError) as e:
+        api.send_request("image.png", payload=b"thumbnail")
+    assert not transport.connect_failed(e.value)
+    assert len(server.requests) == 1
+    assert http.retried == []
+
+
+def test_read_timeout_is_not_retried(http, stand_in):
+    server = stand_in(["hang", "ok"])
+    api = saucenao.API(DANBOORU, 50, url=f"{server.url}/search.php")
+    with pytest.raises(requests.ReadTimeout):
+        api.send_request("image.png", payload=b"thumbnail")
+    assert len(server.requests) == 1
+    assert http.retried == []
+
+
+def test_danbooru_client_gets_the_shared_session(http, stand_in, danbooru_module):
+    server = stand_in(["ok"], [{"id": 1, "md5": "a"}])
+    danbooru_module.API = SessionDanbooru
+    SessionDanbooru.url = server.url
+    api = danclient.create_api()
+    assert api.session is http.session
+    assert api.get_posts({"tags": "md5:a"}) == [{"id": 1, "md5": "a"}]
+    assert server.requests[0].startswith("/posts.json?")
+
+
+def test_danbooru_client_times_out_on_the_borrowed_session(http, stand_in, danbooru_module):
+    # The danbooru package never passes a timeout, the transport's adapter has to supply one.
+    server = stand_in(["hang"])
+    danbooru_module.API = SessionDanbooru
+    SessionDanbooru.url = server.url
+    api = danclient.create_api()
+    with pytest.raises(requests.ReadTimeout):
+        api.get_posts({"tags": "md5:a"})
@@ -0,0 +1,121 @@
+import sqlite3
+import pytest
+import src.repos.unitofwork as unitofwork
+import src.repos.imagerepo as imagerepo
+import src.repos.saucenaoresultrepo as saucenaoresultrepo
+from src.repos.unitofwork import UnitOfWork, RowId
+
+INSERT = "INSERT INTO Images (full_path, md5) VALUES (?, ?)"
+
+
+def paths(database) -> list[str]:
+    return sorted(r["full_path"] for r in database.execute_query("SELECT full_path FROM Images"))
+
+
+def test_writes_are_held_until_flushed(database, clock):
+    uow = UnitOfWork(max_writes=10, max_seconds=60, clock=clock)
+    uow.add(INSERT, ["/a.png", "a"])
+    uow.add(INSERT, ["/b.png", "b"])
+    assert paths(database) == []
+    uow.flush()
+    assert paths(database) == ["/a.png", "/b.png"]
+    assert (uow.writes, uow.commits) == (2, 1)
+
+
+def test_flushes_once_max_writes_are_held(database, clock):
+    uow = UnitOfWork(max_writes=2, max_seconds=60, clock=clock)
+    uow.add(INSERT, ["/a.png", "a"])
+    assert paths(database) == []
+    uow.add(INSERT, ["/b.png", "b"])
+    assert paths(database) == ["/a.png", "/b.png"]
+
+
+def test_tick_flushes_old_writes_without_another_write(database, clock):
+    uow = UnitOfWork(max_writes=10, max_seconds=5, clock=clock)
+    uow.add(INSERT, ["/a.png", "a"])
+    clock.sleep(4)
+    uow.tick()
+    assert paths(database) == []
+    clock.sleep(1)
+    # Starting the next file checks the time too.
+    uow.group("/b.png")
+    assert paths(database) == ["/a.png"]
+
+
+def test_after_commit_waits_for_the_writes_before_it(database, clock):
+    done = []
+    uow = UnitOfWork(max_writes=10, max_seconds=60, clock=clock)
+    uow.add(INSERT, ["/a.png", "a"])
+    uow.after_commit(lambda: done.append(paths(database)))
+    assert done == []
+    uow.flush()
+    assert done == [["/a.png"]]
+
+
+def test_inserted_ids_can_be_used_before_the_flush(database, clock):
+    uow = UnitOfWork(max_writes=10, max_seconds=60, clock=clock)
+    row_id = uow.insert(INSERT, ["/a.png", "a"])
+    assert isinstance(row_id, RowId) and row_id.value is None
+    uow.add("UPDATE Images SET phash = ? WHERE image_uid = ?", ["ff", row_id])
+    uow.flush()
+    rows = database.execute_query("SELECT image_uid, phash FROM Images")
+    assert [(r["image_uid"], r["phash"]) for r in rows] == [(row_id.value, "ff")]
+
+
+def test_ids_come_from_the_db_so_other_writers_cant_collide(database):
+    # Another process adds an image while this one's insert is still held.
+    with unitofwork.begin(max_writes=10, max_seconds=60):
+        held = imagerepo.insert_image("/a.png", "a")
+        other = database.execute_change(INSERT, ["/b.png", "b"])
+    assert held.value != other
+    assert paths(database) == ["/a.png", "/b.png"]
+
+
+def test_failed_group_only_loses_its_own_writes(database, clock):
+    failures, removed = [], []
+    uow = UnitOfWork(max_writes=10, max_seconds=60, clock=clock, on_failure=lambda name, e: failures.append(name))
+    database.execute_change(INSERT, ["/taken.png", "taken"])
+
+    uow.group("/a.png")
+    uow.add(INSERT, ["/a.png", "a"])
+    uow.after_commit(lambda: removed.append("/a.png"))
+    uow.group("/b.png")
+    uow.add(INSERT, ["/b.png", "b"])
+    # Runs into an md5 already recorded, rolls back /b.png's first insert too.
+    uow.add(INSERT, ["/b2.png", "taken"])
+    uow.after_commit(lambda: removed.append("/b.png"))
+    uow.group("/c.png")
+    uow.add(INSERT, ["/c.png", "c"])
+    uow.flush()
+
+    assert paths(database) == ["/a.png", "/c.png", "/taken.png"]
+    assert failures == ["/b.png"]
+    assert removed == ["/a.png"]
+    assert (uow.commits, uow.failures) == (1, 1)
+
+
+def test_failure_is_raised_once_the_rest_are_committed(database, clock):
+    uow = UnitOfWork(max_writes=10, max_seconds=60, clock=clock)
+    uow.group("/a.png")
+    uow.add(INSERT, ["/a.png", "a"])
+    uow.group("/b.png")
+    uow.add(INSERT, ["/b.png", "a"])
+    with pytest.raises(sqlite3.IntegrityError):
+        uow.flush()
+    assert paths(database) == ["/a.png"]
+
+
+def test_writes_made_before_an_error_are_still_committed(database):
+    with pytest.raises(RuntimeError):
+        with unitofwork.begin(max_writes=10, max_seconds=60):
+            saucenaoresultrepo.insert_result(imagerepo.insert_image("/a.png", "a"), 512, 1, 70.0)
+            raise RuntimeError()
+    assert unitofwork.active() is None
+    assert paths(database) == ["/a.png"]
+    assert len(saucenaoresultrepo.get_results()) == 1
+
+
+def test_without_a_unit_of_work_writes_commit_right_away(database):
+    image_uid = imagerepo.insert_image("/a.png", "a")
+    assert isinstance(image_uid, int)
+    assert paths(database) == ["/a.png"]